@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+
+from flask import Blueprint, Response, request
+
+from db.db import (
+    RECIPE_SORTS,
+    get_approved_recipes_with_user,
+    get_change_version,
+    get_changes_since,
+    get_public_recipe,
+    get_rating_data,
+    get_recipe_versions,
+    get_reviews_page,
+)
+
+
+# ---------------------------------------------
+# JSON API (v1)
+# ---------------------------------------------
+# Read-only JSON for the approved catalogue. Every response carries a
+# strong ETag and Cache-Control, and a matching If-None-Match gets an
+# empty 304, so clients and the CDN only download what changed.
+#
+# ETags come from row versions (migration 9), checked with one small query
+# before anything else runs - a 304 costs no listing query and no JSON.
+#
+#   GET /api/v1/recipes                     ?sort=newest|top&before=&after=&limit=&fields=
+#   GET /api/v1/recipes/<id>                ?fields=
+#   GET /api/v1/recipes/<id>/reviews        ?before=&after=&limit=&fields=
+#   GET /api/v1/recipes/<id>/rating
+#   GET /api/v1/changes                     ?since=<version>&limit=
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+API_MAX_AGE = int(os.environ.get("API_MAX_AGE", "60"))
+
+LIST_FIELDS = ("id", "title", "category", "image_url", "creator_username", "avg_rating", "total_reviews")
+RECIPE_FIELDS = (
+    "id", "title", "ingredients", "instructions", "category", "image_url",
+    "video_url", "creator_username", "avg_rating", "total_reviews",
+)
+REVIEW_FIELDS = ("id", "username", "rating", "comment", "created_at")
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def select_fields(allowed):
+    """Fields requested with ?fields=a,b (all of allowed when absent)."""
+    requested = request.args.get("fields")
+    if not requested:
+        return allowed
+    fields = tuple(f.strip() for f in requested.split(",") if f.strip())
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise BadRequest(f"unknown field(s): {', '.join(unknown)}; allowed: {', '.join(allowed)}")
+    return fields
+
+
+def pick(row, fields):
+    return {field: row[field] for field in fields}
+
+
+def version_etag(*versions):
+    """Strong ETag for this URL (path + query, so fields/cursors count) at these row versions."""
+    key = repr((request.path, sorted(request.args.items(multi=True)), versions))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def json_response(payload, status=200, etag=None, max_age=API_MAX_AGE):
+    """Compact JSON; successful responses get an ETag and Cache-Control."""
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, sort_keys=True).encode("utf-8")
+    response = Response(body, status=status, mimetype="application/json")
+    if status == 200:
+        response.set_etag(etag or hashlib.blake2b(body, digest_size=16).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def conditional(etag, build):
+    """304 if the client already has etag, else the JSON payload build() returns."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = API_MAX_AGE
+        return response
+    return json_response(build(), etag=etag)
+
+
+def error(message, status):
+    return json_response({"error": message}, status)
+
+
+@api.errorhandler(BadRequest)
+def bad_request(e):
+    return error(str(e), 400)
+
+
+def page_payload(key, page, fields):
+    return {
+        key: [pick(row, fields) for row in page.rows],
+        "next": page.next_cursor,
+        "prev": page.prev_cursor,
+    }
+
+
+@api.route("/recipes")
+def list_recipes():
+    sort = request.args.get("sort", "newest")
+    if sort not in RECIPE_SORTS:
+        raise BadRequest(f"sort must be one of {', '.join(RECIPE_SORTS)}")
+    fields = select_fields(LIST_FIELDS)
+
+    def build():
+        page = get_approved_recipes_with_user(
+            before=request.args.get("before"),
+            after=request.args.get("after"),
+            limit=request.args.get("limit"),
+            sort=sort,
+        )
+        return page_payload("recipes", page, fields)
+
+    # A listing can change with any write, so it is tagged with the global version
+    return conditional(version_etag(get_change_version()), build)
+
+
+def recipe_versions_or_404(recipe_id):
+    versions = get_recipe_versions(recipe_id)
+    if not versions or versions["status"] != "approved":
+        return None
+    return tuple(versions)
+
+
+@api.route("/recipes/<int:recipe_id>")
+def get_recipe(recipe_id):
+    fields = select_fields(RECIPE_FIELDS)
+    versions = recipe_versions_or_404(recipe_id)
+    if not versions:
+        return error("recipe not found", 404)
+
+    return conditional(version_etag(*versions), lambda: pick(get_public_recipe(recipe_id), fields))
+
+
+@api.route("/recipes/<int:recipe_id>/reviews")
+def list_reviews(recipe_id):
+    fields = select_fields(REVIEW_FIELDS)
+    versions = recipe_versions_or_404(recipe_id)
+    if not versions:
+        return error("recipe not found", 404)
+
+    def build():
+        page = get_reviews_page(
+            recipe_id,
+            before=request.args.get("before"),
+            after=request.args.get("after"),
+            limit=request.args.get("limit"),
+        )
+        return page_payload("reviews", page, fields)
+
+    return conditional(version_etag(*versions), build)
+
+
+@api.route("/recipes/<int:recipe_id>/rating")
+def get_rating(recipe_id):
+    versions = recipe_versions_or_404(recipe_id)
+    if not versions:
+        return error("recipe not found", 404)
+
+    def build():
+        data = get_rating_data(recipe_id)
+        return {
+            "recipe_id": recipe_id,
+            "avg_rating": data["avg_rating"],
+            "total_reviews": data["total_reviews"],
+        }
+
+    return conditional(version_etag(versions[1]), build)
+
+
+@api.route("/changes")
+def list_changes():
+    """
+    Incremental sync: recipes and reviews changed or deleted after ?since.
+    Only approved recipes (and their reviews) are listed; a recipe that is
+    no longer approved comes as deleted.
+    Clients keep the returned "next" and pass it as since next time; until
+    has_more is false there are more changes to fetch right away.
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", 0)) or None
+    except ValueError:
+        raise BadRequest("since and limit must be integers")
+
+    def build():
+        changes, next_since, has_more = get_changes_since(since, limit, tables=("recipes", "reviews"))
+        return {"changes": changes, "next": next_since, "has_more": has_more}
+
+    return conditional(version_etag(get_change_version()), build)
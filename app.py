@@ -1,13 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import io
+import os
+import sys
+import click
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, get_flashed_messages, stream_with_context
+from markupsafe import Markup, escape
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
 
 # Import the separated DB connection
 from db.db import (
-    get_approved_recipes,
-    get_total_admins,
-    get_total_approved_recipes,
-    get_total_users,
+    get_random_approved_recipes,
+    get_top_rated_recipes,
+    get_site_stats,
+    get_cache_stats,
     create_user,
     add_recipe,
     get_user_by_email,
@@ -27,7 +31,9 @@ from db.db import (
     reject_user,
     approve_delete_recipe,
     reject_delete_request,
-    get_user_recipes,
+    get_recipes_for_users,
+    get_recipe_owners,
+    MAX_USERS_PER_LOOKUP,
     update_user,
     get_user_by_id,
     delete_user,
@@ -35,25 +41,145 @@ from db.db import (
     approve_recipe,
     reject_recipe,
     get_recipes_by_user,
+    repair_rating_aggregates,
+    repair_site_stats,
+    search_recipes,
+    rebuild_search_index,
+    HIGHLIGHT_START,
+    HIGHLIGHT_END,
+    what_can_i_cook,
+    suggest_ingredients,
+    rebuild_ingredient_index,
+    on_recipe_change,
+    count_pending,
+    BATCH_ACTIONS,
+    get_recipe_versions,
 )
+from cache import LRUCache
+from mailer import outbox, send_email
+from db.recommend import RECOMMEND_K, build_recommendations, get_recommended_recipes, get_similar_recipes
+from db.bulk import FORMATS, guess_format, import_recipes, export_lines, export_recipes
+from api import api
+import profiling
+from assets import build_assets, init_assets
+from images import ImageError, fetch_missing, images, init_images, store_upload
+from compression import init_compression
+from sessions import init_sessions, regenerate_session
+from passwords import PasswordBusy, check_user_password, hash_password, hasher
+from db.connection import release_db_connection, get_pool_stats
+from db.migrations import migrate
+
+# Bring the schema up to date before serving anything. Not in the worker
+# processes of the image and password pools: they are spawned, and spawn
+# imports the main script again as __mp_main__ (python app.py).
+if __name__ != "__mp_main__":
+    migrate()
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 
+# Flask settings from FLASK_* variables and, last, the Python file named by
+# RECIPE_SETTINGS. Loaded before the init_* calls below, which take their
+# own settings (SESSION_BACKEND, IMAGE_*) from app.config when set there.
+app.config.from_prefixed_env()
+app.config.from_envvar("RECIPE_SETTINGS", silent=True)
+
+# Sessions kept server-side; the cookie holds only their id (SESSION_BACKEND)
+session_store = init_sessions(app)
+
+# Opt-in request/query timing and /metrics (PROFILE=1); a no-op otherwise
+profiling.install(app)
+
+# Fingerprinted static files from `flask build-assets`, if they were built
+init_assets(app)
+
+# Local copies and resized variants of recipe images under /img
+init_images(app)
+
+# gzip / brotli for text responses the client accepts (COMPRESS=0 to turn off)
+init_compression(app)
+
+# Each request borrows one pooled DB connection and gives it back here
+app.teardown_appcontext(release_db_connection)
+
+# JSON API under /api/v1
+app.register_blueprint(api)
+
+# Background threads (the mail outbox) start with the first request each
+# process serves, so a preloading server (wsgi.py) never forks with them
+# running. Starting them also delivers anything left from a previous run.
+_workers_pid = None
+
+
+@app.before_request
+def start_background_workers():
+    global _workers_pid
+    if _workers_pid != os.getpid():
+        _workers_pid = os.getpid()
+        outbox.start()
+
+
+# ---------------------------------------------
+# PAGINATION HELPERS
+# ---------------------------------------------
+def page_args(prefix=""):
+    """Cursor arguments for a paged listing, read from the query string."""
+    return {
+        "before": request.args.get(prefix + "before"),
+        "after": request.args.get(prefix + "after"),
+        "limit": request.args.get(prefix + "limit"),
+    }
+
+
+@app.context_processor
+def pagination_helpers():
+    def page_url(prefix="", before=None, after=None):
+        # Keep every other listing's cursor; only move this one
+        args = request.args.to_dict()
+        args.pop(prefix + "before", None)
+        args.pop(prefix + "after", None)
+        if before:
+            args[prefix + "before"] = before
+        if after:
+            args[prefix + "after"] = after
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    return {"page_url": page_url}
+
+
+# ---------------------------------------------
+# STREAMED PAGES
+# ---------------------------------------------
+STREAM_BUFFER = 64  # template output pieces per chunk sent
+
+
+def stream_page(template_name, **context):
+    """
+    render_template for the big listings: the page is sent in chunks while
+    it renders, so the browser gets the <head> (and starts fetching CSS)
+    before the last table row is done.
+    """
+    # The session cookie goes out before the body, so flashed messages
+    # must leave the session now; the template then reads them from the request
+    get_flashed_messages()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype="text/html")
+
 # ---------------------------------------------
 # HOME
 # ---------------------------------------------
-import random
 @app.route("/")
 def home():
-    all_recipes = get_approved_recipes()
-
-    featured_recipes = random.sample(all_recipes, min(3, len(all_recipes)))
-    popular_recipes = random.sample(all_recipes, min(6, len(all_recipes)))
-
-    total_recipes = get_total_approved_recipes()
-    total_users = get_total_users()
-    total_chefs = get_total_admins()
+    # Random picks come from a cached id array; "popular" is the best rated
+    featured_recipes = get_random_approved_recipes(3)
+    popular_recipes = get_top_rated_recipes(6)
+
+    stats = get_site_stats()
+    total_recipes = stats["total_recipes"]
+    total_users = stats["total_users"]
+    total_chefs = stats["total_admins"]
     total_features = 50  # demo value
 
     user_stories = [
@@ -78,33 +204,24 @@ def home():
 # ---------------------------------------------
 
 import random
-import smtplib
-from email.message import EmailMessage
 
-EMAIL_ADDRESS = "prithviroshan2003@gmail.com"
-EMAIL_PASSWORD = "ivca waor kjne ydyf"
+OTP_VALID_MINUTES = 5
 
 def generate_otp():
     return str(random.randint(100000, 999999))
 
 def send_otp_email(to_email, otp):
-    msg = EmailMessage()
-    msg["Subject"] = "Verify Your Account - OTP"
-    msg["From"] = EMAIL_ADDRESS
-    msg["To"] = to_email
-    msg.set_content(f"""
+    # Queued in the email outbox; a background worker does the SMTP part.
+    # An OTP that could not go out while still valid is not sent at all.
+    send_email(to_email, "Verify Your Account - OTP", f"""
 Hello,
 
 Your OTP for account verification is: {otp}
 
-This OTP is valid for 5 minutes.
+This OTP is valid for {OTP_VALID_MINUTES} minutes.
 
 Thank you!
-""")
-
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        server.send_message(msg)
+""", max_age=OTP_VALID_MINUTES * 60)
 
 
 @app.route("/signup", methods=["GET", "POST"])
@@ -118,11 +235,17 @@ def signup():
             flash("❌ Email already exists! Please use a different email.", "danger")
             return render_template("register.html", username=request.form["username"], email=email)
 
+        try:
+            password_hash = hash_password(request.form["password"])
+        except PasswordBusy:
+            flash("Too many sign-ups right now, please try again in a moment.", "danger")
+            return render_template("register.html", username=request.form["username"], email=email), 503
+
         # If email doesn't exist, continue with OTP process
         session["signup_data"] = {
             "username": request.form["username"],
             "email": email,
-            "password": generate_password_hash(request.form["password"])
+            "password": password_hash
         }
 
         otp = generate_otp()
@@ -179,7 +302,14 @@ def login():
 
         user = get_user_by_email(email)  # Use DB method
 
-        if user and check_password_hash(user["password"], password):
+        try:
+            valid = user is not None and check_user_password(user, password)
+        except PasswordBusy:
+            flash("Too many sign-ins right now, please try again in a moment.", "danger")
+            return render_template("login.html", role=role), 503
+
+        if valid:
+            regenerate_session()
             session["user_id"] = user["id"]
             session["username"] = user["username"]
             session["is_admin"] = user["is_admin"]
@@ -208,15 +338,41 @@ def logout():
 # ---------------------------------------------
 # USER DASHBOARD
 # ---------------------------------------------
+# Cards in "recommended for you" here and "similar recipes" on recipe pages
+RECOMMENDATIONS_SHOWN = 6
+
+
 @app.route("/user_dashboard")
 def user_dashboard():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    return render_template("user_dashboard.html", username=session["username"])
+    recommended = get_recommended_recipes(session["user_id"], RECOMMENDATIONS_SHOWN)
+    heading = "Recommended for you"
+    if not recommended:
+        # Nothing rated yet (or no build has run): the best rated instead
+        recommended = get_top_rated_recipes(RECOMMENDATIONS_SHOWN)
+        heading = "Popular right now"
+    return render_template(
+        "user_dashboard.html",
+        username=session["username"],
+        recommended_recipes=recommended,
+        recommended_heading=heading,
+    )
 
 # ---------------------------------------------
 # ADD RECIPE
 # ---------------------------------------------
+def form_image_url():
+    """The recipe form's image: an uploaded file (stored locally) wins over the URL field."""
+    upload = request.files.get("image_file")
+    if upload and upload.filename:
+        try:
+            return store_upload(upload)
+        except ImageError as e:
+            flash(f"Image not uploaded: {e}", "warning")
+    return request.form["image_url"]
+
+
 @app.route("/add_recipe", methods=["GET", "POST"])
 def add_recipe_route():
     if "user_id" not in session:
@@ -227,7 +383,7 @@ def add_recipe_route():
         ingredients = request.form["ingredients"]
         instructions = request.form["instructions"]
         category = request.form["category"]
-        image_url = request.form["image_url"]
+        image_url = form_image_url()
         video_url = request.form["video_url"]
 
         add_recipe(title, ingredients, instructions, category, image_url, video_url, session["user_id"])
@@ -248,36 +404,144 @@ def view_recipes():
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    recipes = get_approved_recipes_with_user()
+    sort = request.args.get("sort", "newest")
+    page = get_approved_recipes_with_user(sort=sort, **page_args())
 
-    return render_template(
+    return stream_page(
         "view_recipes.html",
-        recipes=recipes,
+        recipes=page.rows,
+        page=page,
+        sort=sort,
         username=session.get("username")
     )
 
 # ---------------------------------------------------
-# ✅ VIEW SINGLE RECIPE WITH CREATOR + REVIEWS
-@app.route("/recipe/<int:recipe_id>")
-def view_recipe(recipe_id):
+# ✅ SEARCH RECIPES
+@app.template_filter("highlight")
+def highlight_filter(text):
+    """Escape search output, then wrap the matched terms in <mark>."""
+    html = str(escape(text or ""))
+    return Markup(html.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>"))
+
+
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    page = search_recipes(query, **page_args())
+
+    return render_template(
+        "search.html",
+        query=query,
+        page=page,
+        username=session.get("username")
+    )
+
+# ---------------------------------------------------
+# ✅ WHAT CAN I COOK
+def split_terms(value):
+    return [term.strip() for term in (value or "").split(",") if term.strip()][:30]
+
+
+@app.route("/what_can_i_cook")
+def cook():
+    have = request.args.get("have", "")
+    need = request.args.get("need", "")
+
+    results = what_can_i_cook(split_terms(have), require=split_terms(need)) if have else []
+
+    return render_template(
+        "cook.html",
+        have=have,
+        need=need,
+        results=results,
+        username=session.get("username")
+    )
+
+
+@app.route("/ingredients/suggest")
+def ingredient_suggestions():
+    return {"ingredients": suggest_ingredients(request.args.get("q", ""))}
+
+# ---------------------------------------------------
+# ✅ RECIPE PAGE FRAGMENT CACHE
+# ---------------------------------------------------
+# The recipe body and the review list only change when the recipe, its
+# creator or its reviews do, so they are rendered once per set of row
+# versions and reused; checking the versions is a single indexed query.
+# The session-dependent parts of the page (navbar, review form, flashed
+# messages) are still rendered on every request.
+FRAGMENT_CACHE_MB = float(os.environ.get("FRAGMENT_CACHE_MB", "32"))
+FRAGMENT_CACHE_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_ENTRIES", "5000"))
+FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", "600"))
+
+recipe_fragments = LRUCache(
+    max_bytes=int(FRAGMENT_CACHE_MB * 1024 * 1024),
+    max_entries=FRAGMENT_CACHE_ENTRIES,
+    ttl=FRAGMENT_CACHE_TTL,
+)
+
+
+@on_recipe_change
+def drop_recipe_fragments(recipe_ids):
+    # Versions already keep stale entries from being served; this just
+    # frees their memory straight away
+    for recipe_id in recipe_ids:
+        recipe_fragments.delete(recipe_id)
+
+
+def render_recipe_fragments(recipe_id):
+    """(title, body html, reviews html) for a recipe page, or None if it doesn't exist."""
+    # Read the versions before the content: a render that races a write is
+    # stored under the old versions and replaced on the next request
+    versions = get_recipe_versions(recipe_id)
+    if not versions:
+        return None
+    versions = tuple(versions)
+
+    cached = recipe_fragments.get(recipe_id)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+
     recipe = get_recipe_by_id(recipe_id)
     if not recipe:
-        flash("Recipe not found!", "danger")
-        return redirect(url_for("home"))
+        return None
 
     reviews = get_reviews_by_recipe(recipe_id)
     rating_data = get_rating_data(recipe_id)
 
-    avg_rating = rating_data["avg_rating"] or 0
-    total_reviews = rating_data["total_reviews"]
+    body = render_template(
+        "_recipe_body.html",
+        recipe=recipe,
+        avg_rating=rating_data["avg_rating"] or 0,
+        total_reviews=rating_data["total_reviews"]
+    )
+    reviews_block = render_template("_recipe_reviews.html", reviews=reviews)
+
+    fragments = (recipe["title"], Markup(body), Markup(reviews_block))
+    size = sum(len(part.encode("utf-8")) for part in fragments)
+    recipe_fragments.set(recipe_id, (versions, fragments), size)
+    return fragments
+
+
+# ---------------------------------------------------
+# ✅ VIEW SINGLE RECIPE WITH CREATOR + REVIEWS
+@app.route("/recipe/<int:recipe_id>")
+def view_recipe(recipe_id):
+    fragments = render_recipe_fragments(recipe_id)
+    if not fragments:
+        flash("Recipe not found!", "danger")
+        return redirect(url_for("home"))
+
+    title, body, reviews_block = fragments
 
     return render_template(
-        "view_RecipeInfo.html",
-        recipe=recipe,
-        username=session.get("username"),
-        reviews=reviews,
-        avg_rating=avg_rating,
-        total_reviews=total_reviews
+        "View_RecipeInfo.html",
+        recipe_id=recipe_id,
+        recipe_title=title,
+        recipe_body=body,
+        reviews_block=reviews_block,
+        similar_recipes=get_similar_recipes(recipe_id, RECOMMENDATIONS_SHOWN),
+        username=session.get("username")
     )
 
 
@@ -286,8 +550,11 @@ def add_review_route(recipe_id):
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    rating = request.form["rating"]
+    rating = request.form.get("rating", type=int)
     comment = request.form.get("comment", "")
+    if rating is None or not 1 <= rating <= 5:
+        flash("Please choose a rating from 1 to 5.", "danger")
+        return redirect(url_for("view_recipe", recipe_id=recipe_id))
 
     add_review(recipe_id, session["user_id"], rating, comment)
 
@@ -297,7 +564,7 @@ def add_review_route(recipe_id):
 @app.route("/recipe/<int:recipe_id>/reviews")
 def get_reviews(recipe_id):
     reviews = get_recipe_reviews(recipe_id)
-    return reviews
+    return [dict(r) for r in reviews]
 
 # ---------------------------------------------
 # EDIT RECIPE
@@ -311,7 +578,7 @@ def edit_recipe(recipe_id):
         ingredients = request.form["ingredients"]
         instructions = request.form["instructions"]
         category = request.form["category"]
-        image_url = request.form["image_url"]
+        image_url = form_image_url()
         video_url = request.form["video_url"]
 
         update_recipe(recipe_id, title, ingredients, instructions, category, image_url, video_url)
@@ -345,29 +612,80 @@ def admin_dashboard():
     if "is_admin" not in session or session["is_admin"] != 1:
         return redirect("/login")
 
-    users = get_all_users_with_recipe_count()
+    page = get_all_users_with_recipe_count(**page_args())
 
-    return render_template("admin_dashboard.html",
-                           users=users,
-                           username=session["username"])
+    return stream_page("admin_dashboard.html",
+                       users=page.rows,
+                       page=page,
+                       username=session["username"])
 
 @app.route("/admin_requests")
 def admin_requests():
     if "is_admin" not in session or session["is_admin"] != 1:
         return redirect("/login")
 
-    pending_users = get_pending_users()
-    pending_deletes = get_pending_delete_requests()
-    pending_recipes = get_pending_recipes()
+    # Each section pages and filters independently (users_before=..., recipes_q=..., ...)
+    filters = {queue: moderation_filters(queue + "_") for queue in BATCH_ACTIONS}
+    pending_users = get_pending_users(**page_args("users_"), q=filters["users"]["q"])
+    pending_deletes = get_pending_delete_requests(**page_args("deletes_"), **filters["deletes"])
+    pending_recipes = get_pending_recipes(**page_args("recipes_"), **filters["recipes"])
 
-    return render_template(
+    # Size of each "all matching" action, shown on its button
+    matching = {queue: count_pending(queue, **filters[queue]) for queue in BATCH_ACTIONS}
+
+    return stream_page(
         "admin_requests.html",
         pending_users=pending_users,
         pending_deletes=pending_deletes,
         pending_recipes=pending_recipes,
+        filters=filters,
+        matching=matching,
         username=session["username"]
     )
 
+
+def moderation_filters(prefix=""):
+    """Filter box values of one admin_requests section."""
+    return {
+        "q": request.args.get(prefix + "q", "").strip() or None,
+        "category": request.args.get(prefix + "category", "").strip() or None,
+    }
+
+
+# ---------------------------------------------
+# ADMIN BATCH MODERATION
+# ---------------------------------------------
+@app.route("/admin/batch/<queue>/<action>", methods=["POST"])
+def admin_batch(queue, action):
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return redirect(url_for("login"))
+
+    helper = BATCH_ACTIONS.get(queue, {}).get(action)
+    if helper is None:
+        flash("Unknown batch action!", "danger")
+        return redirect(url_for("admin_requests"))
+
+    q = request.form.get("q") or None
+    category = request.form.get("category") or None
+    # Back to the same filtered view
+    back = url_for("admin_requests", **{
+        f"{queue}_{name}": value for name, value in (("q", q), ("category", category)) if value
+    })
+
+    if request.form.get("all_matching"):
+        count = helper(q=q, category=category)
+    else:
+        ids = request.form.getlist("ids", type=int)
+        if not ids:
+            flash("Nothing selected.", "info")
+            return redirect(back)
+        count = helper(ids)
+
+    labels = {"users": "user(s)", "recipes": "recipe(s)", "deletes": "delete request(s)"}
+    verb = "Approved" if action == "approve" else "Rejected"
+    flash(f"{verb} {count} {labels[queue]}.", "success" if action == "approve" else "danger")
+    return redirect(back)
+
 # ---------------------------------------------
 # ADMIN APPROVE / REJECT USER
 # ---------------------------------------------
@@ -410,16 +728,184 @@ def admin_reject_delete(recipe_id):
 # ---------------------------------------------
 # ADMIN GET USER RECIPES
 # ---------------------------------------------
+# The dashboard prefetches the recipe lists of every user on the page with
+# one request (one grouped query); lists are cached per user for a short
+# while and dropped as soon as one of that user's recipes changes. The TTL
+# only matters for writes made by other processes.
+USER_RECIPES_TTL = int(os.environ.get("USER_RECIPES_TTL", "30"))
+USER_RECIPES_CACHE_ENTRIES = int(os.environ.get("USER_RECIPES_CACHE_ENTRIES", "2000"))
+
+user_recipes = LRUCache(
+    max_bytes=8 * 1024 * 1024,
+    max_entries=USER_RECIPES_CACHE_ENTRIES,
+    ttl=USER_RECIPES_TTL,
+)
+# recipe id -> owner, for recipes in cached lists: deleted recipes can no
+# longer be looked up. Entries left over from evicted lists only cost a
+# needless delete, and the whole map is reset if it grows too large.
+_cached_recipe_owners = {}
+MAX_CACHED_RECIPE_OWNERS = 100_000
+
+
+@on_recipe_change
+def drop_user_recipes(recipe_ids):
+    if not user_recipes.stats()["entries"]:
+        return
+    owners, unknown = set(), []
+    for recipe_id in recipe_ids:
+        owner = _cached_recipe_owners.pop(recipe_id, None)
+        if owner is None:
+            unknown.append(recipe_id)
+        else:
+            owners.add(owner)
+    # New recipes aren't in any cached list yet, but their owner's list is stale
+    if unknown:
+        owners.update(get_recipe_owners(unknown).values())
+    for user_id in owners:
+        user_recipes.delete(user_id)
+
+
+def load_user_recipes(user_ids):
+    """{user id: [recipe dicts]} from the cache, with every miss loaded in one query."""
+    found, missing = {}, []
+    for user_id in user_ids:
+        cached = user_recipes.get(user_id)
+        if cached is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = cached
+
+    if missing:
+        if len(_cached_recipe_owners) > MAX_CACHED_RECIPE_OWNERS:
+            user_recipes.clear()
+            _cached_recipe_owners.clear()
+        for user_id, rows in get_recipes_for_users(missing).items():
+            recipes = [{"id": r["id"], "title": r["title"], "category": r["category"]} for r in rows]
+            for r in recipes:
+                _cached_recipe_owners[r["id"]] = user_id
+            size = 64 + sum(100 + len(r["title"] or "") + len(r["category"] or "") for r in recipes)
+            user_recipes.set(user_id, recipes, size)
+            found[user_id] = recipes
+    return found
+
+
 @app.route("/admin/get_user_recipes/<int:user_id>")
 def admin_get_user_recipes(user_id):
     if "is_admin" not in session or session["is_admin"] != 1:
         return {"error": "Unauthorized"}, 403
 
-    recipes = get_user_recipes(user_id)
-    return {"recipes": [
-        {"id": r["id"], "title": r["title"], "category": r["category"]}
-        for r in recipes
-    ]}
+    return {"recipes": load_user_recipes([user_id])[user_id]}
+
+
+@app.route("/admin/user_recipes")
+def admin_user_recipes():
+    """Recipe lists of many users: ?ids=1,2,3 (at most MAX_USERS_PER_LOOKUP)."""
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    try:
+        user_ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip()]
+    except ValueError:
+        return {"error": "ids must be a comma separated list of user ids"}, 400
+    if len(user_ids) > MAX_USERS_PER_LOOKUP:
+        return {"error": f"At most {MAX_USERS_PER_LOOKUP} users per request"}, 400
+
+    recipes = load_user_recipes(list(dict.fromkeys(user_ids)))
+    return {"recipes": {str(user_id): rows for user_id, rows in recipes.items()}}
+
+
+@app.route("/admin/pool_stats")
+def admin_pool_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    return get_pool_stats()
+
+
+@app.route("/admin/outbox_stats")
+def admin_outbox_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    return outbox.stats()
+
+
+@app.route("/admin/image_stats")
+def admin_image_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    return images.stats()
+
+
+@app.route("/admin/session_stats")
+def admin_session_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    if session_store is None:
+        return {"backend": "cookie"}
+    return session_store.stats()
+
+
+@app.route("/admin/password_stats")
+def admin_password_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    return hasher.stats()
+
+
+@app.route("/admin/export_recipes")
+def admin_export_recipes():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    fmt = request.args.get("format", "jsonl")
+    if fmt not in FORMATS:
+        return {"error": f"format must be one of {', '.join(FORMATS)}"}, 400
+    status = request.args.get("status") or None
+
+    # Streamed row by row - the catalogue is never held in memory
+    return Response(
+        stream_with_context(export_lines(fmt, status)),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=recipes.{fmt}"},
+    )
+
+
+@app.route("/admin/import_recipes", methods=["POST"])
+def admin_import_recipes():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    upload = request.files.get("file")
+    if not upload:
+        return {"error": "no file uploaded"}, 400
+
+    fmt = request.form.get("format") or guess_format(upload.filename or "")
+    # Rows that name no owner belong to the importing admin
+    owner = request.form.get("owner") or get_user_by_id(session["user_id"])["email"]
+    lines = io.TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    try:
+        report = import_recipes(
+            lines, fmt,
+            owner_email=owner,
+            status=request.form.get("status") or None,
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return report
+
+
+@app.route("/admin/cache_stats")
+def admin_cache_stats():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    stats = get_cache_stats()
+    stats["recipe_fragments"] = recipe_fragments.stats()
+    return stats
 
 
 @app.route("/admin/edit_user/<int:user_id>", methods=["GET", "POST"])
@@ -567,6 +1053,106 @@ def request_delete(recipe_id):
     return redirect(url_for("view_recipes"))  # or wherever your recipes are listed
 
 
+# ---------------------------------------------
+# MAINTENANCE COMMANDS
+# ---------------------------------------------
+@app.cli.command("repair-ratings")
+def repair_ratings_command():
+    """Recompute the stored rating aggregates from the reviews table."""
+    changed = repair_rating_aggregates()
+    print(f"Repaired rating aggregates for {changed} recipe(s).")
+
+
+@app.cli.command("repair-stats")
+def repair_stats_command():
+    """Recount the home page counters in site_stats."""
+    repair_site_stats()
+    print("Site stats recounted:", get_site_stats())
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from the recipes table."""
+    rebuild_search_index()
+    print("Search index rebuilt.")
+
+
+@app.cli.command("rebuild-ingredients")
+def rebuild_ingredients_command():
+    """Re-normalize all recipe ingredients into the ingredient index."""
+    count = rebuild_ingredient_index()
+    print(f"Indexed ingredients for {count} recipe(s).")
+
+
+@app.cli.command("fetch-images")
+def fetch_images_command():
+    """Download every recipe image not stored locally yet, with its variants."""
+    stored, failed = fetch_missing()
+    print(f"Stored {stored} image(s), {failed} failed.")
+
+
+@app.cli.command("sweep-sessions")
+def sweep_sessions_command():
+    """Delete expired server-side sessions (the app also does this as it runs)."""
+    if session_store is None:
+        print("SESSION_BACKEND=cookie: nothing stored server-side.")
+        return
+    print(f"Deleted {session_store.backend.sweep()} expired session(s).")
+
+
+@app.cli.command("build-recommendations")
+@click.option("--full", is_flag=True, help="Recompute every recipe, not just the newly reviewed ones.")
+@click.option("--k", type=int, default=None, help="Neighbours kept per recipe.")
+def build_recommendations_command(full, k):
+    """Update the precomputed similar recipes from the reviews (run from cron)."""
+    report = build_recommendations(full=full, k=k or RECOMMEND_K)
+    print(f"Recomputed {report['recomputed']} recipe(s), patched {report['patched']}, "
+          f"removed {report['removed']} in {report['seconds']}s.")
+
+
+@app.cli.command("import-recipes")
+@click.argument("path", type=click.Path(allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Defaults to the file extension.")
+@click.option("--owner", help="Email of the user owning rows that name no owner.")
+@click.option("--approve", is_flag=True, help="Import every recipe as approved.")
+@click.option("--chunk-size", type=int, default=None, help="Rows per transaction.")
+def import_recipes_command(path, fmt, owner, approve, chunk_size):
+    """Bulk-import recipes from a JSONL or CSV file ("-" for stdin)."""
+    fmt = fmt or guess_format(path)
+    with click.open_file(path, encoding="utf-8") as lines:
+        report = import_recipes(
+            lines, fmt,
+            owner_email=owner,
+            status="approved" if approve else None,
+            chunk_size=chunk_size,
+        )
+
+    for line_no, reason in report["errors"]:
+        print(f"line {line_no}: {reason}", file=sys.stderr)
+    print(f"Imported {report['imported']} recipe(s), skipped {report['skipped']}.")
+
+
+@app.cli.command("export-recipes")
+@click.argument("path", type=click.Path(allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Defaults to the file extension.")
+@click.option("--status", type=click.Choice(["pending", "approved"]), help="Only export this status.")
+def export_recipes_command(path, fmt, status):
+    """Stream every recipe to a JSONL or CSV file ("-" for stdout)."""
+    fmt = fmt or guess_format(path)
+    with click.open_file(path, "w", encoding="utf-8") as out:
+        count = export_recipes(out, fmt, status)
+    print(f"Exported {count} recipe(s).", file=sys.stderr if path == "-" else sys.stdout)
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Fingerprint, minify and pre-compress static/ into static/dist/."""
+    for source, built, size, built_size, variants in build_assets(app.static_folder):
+        extra = f" (+{', '.join(variants)})" if variants else ""
+        print(f"{source} -> dist/{built}  {size} -> {built_size} bytes{extra}")
+    print("Restart the app to pick up the new manifest.")
+
+
 # ---------------------------------------------
 # RUN APP
 # ---------------------------------------------
@@ -0,0 +1,225 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+#   flask build-assets        fingerprint, minify and pre-compress static/
+#                             into static/dist/ and write its manifest
+#
+# Once static/dist/manifest.json exists, url_for("static", filename=...)
+# points at the fingerprinted copy, which is served with a one-year
+# immutable Cache-Control - a changed file gets a new name, so browsers
+# never need to revalidate. Rebuild after editing anything in static/.
+ASSETS_DIR = "dist"
+MANIFEST = "manifest.json"
+ASSET_MAX_AGE = 365 * 24 * 3600
+USE_ASSET_MANIFEST = os.environ.get("USE_ASSET_MANIFEST", "1") == "1"
+# Send the .br / .gz made at build time to clients that accept them (turn
+# off when a proxy in front does its own compression)
+SERVE_PRECOMPRESSED = os.environ.get("SERVE_PRECOMPRESSED", "1") == "1"
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".xml", ".map"}
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+# ---------------------------------------------
+# MINIFY
+# ---------------------------------------------
+# Deliberately conservative: whitespace and comments only, never renaming
+# or reordering, and string literals are left exactly as written.
+
+_CSS_STRING = re.compile(r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')""")
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+# A colon in a declaration (the text up to the next ; or } rather than {):
+# in a selector "div :first-child" the space is a descendant combinator
+_CSS_DECLARATION_COLON = re.compile(r":\s+(?=[^{};]*[;}])")
+
+
+def minify_css(text):
+    text = _CSS_COMMENT.sub("", text)
+    parts = _CSS_STRING.split(text)
+    for i in range(0, len(parts), 2):  # even parts are outside strings
+        part = re.sub(r"\s+", " ", parts[i])
+        part = re.sub(r"\s*([{};,>])\s*", r"\1", part)
+        part = _CSS_DECLARATION_COLON.sub(":", part)
+        parts[i] = part.replace(";}", "}")
+    return "".join(parts).strip()
+
+
+def _ends_in_template(line, inside):
+    """Whether line (starting inside a template literal or not) ends inside one."""
+    quote = "`" if inside else None
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quote:
+            if c == "\\":
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+        elif line.startswith("//", i):
+            break
+        elif line.startswith("/*", i):
+            end = line.find("*/", i + 2)
+            if end < 0:
+                break
+            i = end + 1
+        i += 1
+    return quote == "`"
+
+
+def minify_js(text):
+    # Only blank lines and indentation: anything cleverer needs a JS parser.
+    # Inside a template literal whitespace and blank lines are part of the
+    # string, so those lines are kept as they are.
+    lines = []
+    inside = False
+    for line in text.splitlines():
+        started_inside, inside = inside, _ends_in_template(line, inside)
+        if started_inside:
+            lines.append(line)
+        elif inside:
+            lines.append(line.lstrip())
+        elif line.strip():
+            lines.append(line.strip())
+    return "\n".join(lines)
+
+
+def minify_svg(text):
+    text = re.sub(r"<!--.*?-->", "", text, flags=re.S)
+    text = re.sub(r"<\?xml[^>]*\?>", "", text)
+    return re.sub(r">\s+<", "><", text).strip()
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js, ".svg": minify_svg}
+
+
+# ---------------------------------------------
+# BUILD
+# ---------------------------------------------
+
+def fingerprint(data):
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def _compress(path, data):
+    """Write path.gz (and path.br with the brotli module) when they are smaller."""
+    written = []
+    gz = gzip.compress(data, compresslevel=9, mtime=0)  # mtime=0: same input, same bytes
+    if len(gz) < len(data):
+        with open(path + ".gz", "wb") as f:
+            f.write(gz)
+        written.append("gz")
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            with open(path + ".br", "wb") as f:
+                f.write(br)
+            written.append("br")
+    return written
+
+
+def build_assets(static_folder):
+    """
+    Rebuild static/dist/ from everything else in static/. Returns a list of
+    (source, built name, original size, built size, compressed variants).
+    """
+    out_dir = os.path.join(static_folder, ASSETS_DIR)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    manifest = {}
+    report = []
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and ASSETS_DIR in dirs:
+            dirs.remove(ASSETS_DIR)
+        for name in sorted(files):
+            source = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, "/")
+            with open(os.path.join(root, name), "rb") as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(source)
+            minify = MINIFIERS.get(ext.lower())
+            if minify:
+                data = minify(data.decode("utf-8")).encode("utf-8")
+
+            built = f"{stem}.{fingerprint(data)}{ext}"
+            path = os.path.join(out_dir, built)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+            variants = _compress(path, data) if ext.lower() in COMPRESSIBLE else []
+            manifest[source] = built
+            report.append((source, built, os.path.getsize(os.path.join(root, name)), len(data), variants))
+
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return report
+
+
+# ---------------------------------------------
+# SERVING
+# ---------------------------------------------
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, ASSETS_DIR, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app):
+    """Point url_for("static") at built assets and serve them with far-future caching."""
+    manifest = load_manifest(app.static_folder) if USE_ASSET_MANIFEST else {}
+    dist_dir = os.path.join(app.static_folder, ASSETS_DIR)
+
+    @app.url_defaults
+    def fingerprinted_static_url(endpoint, values):
+        if endpoint == "static" and manifest:
+            built = manifest.get(values.get("filename"))
+            if built:
+                values["filename"] = f"{ASSETS_DIR}/{built}"
+
+    # More specific than Flask's /static/<path:filename>, so it wins for dist/
+    @app.route(f"{app.static_url_path}/{ASSETS_DIR}/<path:filename>")
+    def built_asset(filename):
+        response = None
+        if SERVE_PRECOMPRESSED:
+            for encoding, suffix in ENCODINGS:
+                if request.accept_encodings[encoding] and os.path.isfile(os.path.join(dist_dir, filename + suffix)):
+                    response = send_from_directory(
+                        dist_dir, filename + suffix,
+                        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                        max_age=ASSET_MAX_AGE,
+                    )
+                    response.headers["Content-Encoding"] = encoding
+                    break
+        if response is None:
+            response = send_from_directory(dist_dir, filename, max_age=ASSET_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept-Encoding")
+        return response
+
+    return manifest
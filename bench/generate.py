@@ -0,0 +1,340 @@
+"""
+Write a synthetic recipe database of any size for benchmarks.
+
+    python -m bench.generate --size large --out bench/large.db
+    python -m bench.generate --users 5000 --recipes 50000 --reviews 400000 --skew 1.2
+
+The output is the app's real schema (every migration applied) filled with
+reproducible data: the same --seed and sizes always give the same rows.
+Popularity is Zipf-skewed - a few users write most recipes and a few
+recipes get most reviews - and text lengths are configurable.
+
+Logins: admin@example.com / admin123 and user<N>@example.com / bench.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+
+from werkzeug.security import generate_password_hash
+
+from db.ingredients import normalize_ingredient
+from db.migrations import migrate
+
+
+# name -> (users, recipes, reviews)
+SIZES = {
+    "tiny": (100, 1_000, 5_000),
+    "small": (1_000, 10_000, 100_000),
+    "medium": (10_000, 100_000, 1_000_000),
+    "large": (100_000, 1_000_000, 10_000_000),
+}
+
+CHUNK = 50_000  # rows per executemany
+
+CATEGORIES = [
+    "Main Course", "Dessert", "Breakfast", "Salad", "Soup", "Snack",
+    "Appetizer", "Side Dish", "Drink", "Bread", "Vegan", "Seafood",
+]
+
+INGREDIENTS = """
+    salt pepper olive-oil butter garlic onion red-onion shallot sugar brown-sugar
+    flour egg milk cream sour-cream yogurt parmesan cheddar mozzarella feta
+    chicken-breast chicken-thigh beef pork bacon sausage shrimp salmon tuna tofu
+    rice basmati-rice pasta spaghetti noodle bread breadcrumb potato sweet-potato carrot
+    celery tomato cherry-tomato tomato-paste bell-pepper chili jalapeno cucumber zucchini eggplant
+    spinach kale lettuce cabbage broccoli cauliflower mushroom pea corn green-bean
+    lemon lime orange apple banana strawberry blueberry raspberry mango pineapple
+    cumin paprika oregano basil thyme rosemary parsley cilantro ginger cinnamon
+    nutmeg turmeric curry-powder vanilla honey maple-syrup soy-sauce vinegar mustard mayonnaise
+    chicken-stock vegetable-stock coconut-milk peanut-butter almond walnut cashew oat chickpea lentil
+    black-bean kidney-bean baking-powder baking-soda yeast cocoa chocolate-chip dark-chocolate avocado scallion
+""".split()
+
+WORDS = """
+    stir heat add mix combine whisk simmer boil bake roast fry saute chop slice
+    season serve cover cool rest fold pour spread drain toss blend knead shape
+    until golden tender crisp smooth thick bubbling fragrant soft glossy light
+    minutes hour oven pan pot bowl tray skillet lid medium low high heat
+    gently slowly quickly evenly occasionally then with and the into over a of
+    sauce dough batter mixture filling topping crust glaze broth marinade
+    family classic quick easy spicy creamy crunchy smoky zesty rustic weeknight
+    grandma's summer winter holiday sunday garden homestyle one-pot sheet-pan
+""".split()
+
+UNITS = ["1 cup", "2 cups", "1/2 cup", "1 tbsp", "2 tbsp", "1 tsp", "200g", "1 lb", "3", "2", "1 pinch"]
+
+RATING_WEIGHTS = [5, 7, 15, 33, 40]  # 1..5 stars, mostly positive like real sites
+
+
+def zipf_cum_weights(n, skew):
+    """Cumulative weights for picking rank 1..n with P(k) ~ 1/k**skew (0 = uniform)."""
+    return list(itertools.accumulate(1.0 / (k ** skew) for k in range(1, n + 1)))
+
+
+def skewed_picker(rng, ids, skew):
+    """Return pick(k) -> k ids, popularity skewed but not correlated with id order."""
+    ids = list(ids)
+    rng.shuffle(ids)
+    cum_weights = zipf_cum_weights(len(ids), skew)
+
+    def pick(k):
+        return rng.choices(ids, cum_weights=cum_weights, k=k)
+    return pick
+
+
+def text_length(rng, mean):
+    return max(1, int(rng.gauss(mean, mean / 3)))
+
+
+def sentence(rng, mean_words):
+    return " ".join(rng.choices(WORDS, k=text_length(rng, mean_words))).capitalize() + "."
+
+
+def ingredient_vocabulary():
+    """Ingredient names that come out of the app's normalizer unchanged."""
+    names = [name.replace("-", " ") for name in INGREDIENTS]
+    return [name for name in names if normalize_ingredient(name) == name]
+
+
+# ---------------------------------------------
+# LOADING
+# ---------------------------------------------
+# Triggers and secondary indexes are dropped while the rows go in and put
+# back afterwards; everything they would maintain (versions, rating
+# aggregates, site_stats, the search index) is written directly instead.
+
+def _suspend(conn, kind, tables):
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = ? AND tbl_name IN (%s) AND sql IS NOT NULL"
+        % ",".join("?" * len(tables)),
+        (kind, *tables),
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return [sql for _, sql in rows]
+
+
+def _insert(conn, sql, rows):
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK))
+        if not chunk:
+            return total
+        conn.executemany(sql, chunk)
+        total += len(chunk)
+
+
+def generate(out, users, recipes, reviews, seed=42, skew=1.1, title_words=4,
+             instruction_words=120, comment_words=20, ingredients_per_recipe=9,
+             pending=0.05, delete_requests=0.005, unapproved=0.02, progress=print):
+    """Build the database at out (which must not exist yet). Returns row counts."""
+    if os.path.exists(out):
+        raise FileExistsError(out)
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    def step(message):
+        progress(f"[{time.perf_counter() - started:7.1f}s] {message}")
+
+    migrate(out)
+    conn = sqlite3.connect(out, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -512000")
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("BEGIN")
+
+    tables = ("users", "recipes", "reviews", "recipe_ingredients")
+    triggers = _suspend(conn, "trigger", tables)
+    indexes = _suspend(conn, "index", tables)
+
+    # Versions: users first, then recipes, then reviews, as migration 9 would
+    recipe_base = users
+    review_base = users + recipes
+
+    # --- users (id 1 is the admin)
+    step(f"users: {users:,}")
+    password = generate_password_hash("bench")
+    admin_password = generate_password_hash("admin123")
+
+    def user_rows():
+        yield (1, "admin", "admin@example.com", admin_password, 1, 1, 1)
+        for user_id in range(2, users + 1):
+            approved = 0 if rng.random() < unapproved else 1
+            yield (user_id, f"{rng.choice(WORDS)}{user_id}", f"user{user_id}@example.com",
+                   password, approved, 0, user_id)
+
+    _insert(conn, """
+        INSERT INTO users (id, username, email, password, is_approved, is_admin, version, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, user_rows())
+
+    # --- recipe statuses and owners are decided first so reviews can target them
+    statuses = bytearray(recipes + 1)  # 0 pending, 1 approved, 2 approved + delete request
+    approved_ids = []
+    for recipe_id in range(1, recipes + 1):
+        if rng.random() >= pending:
+            statuses[recipe_id] = 2 if rng.random() < delete_requests else 1
+            approved_ids.append(recipe_id)
+
+    # --- reviews, with the rating aggregates added up on the way
+    step(f"reviews: {reviews:,}")
+    rating_sum = array("q", bytes(8 * (recipes + 1)))
+    rating_count = array("q", bytes(8 * (recipes + 1)))
+    pick_reviewer = skewed_picker(rng, range(2, users + 1), skew)
+    pick_reviewed = skewed_picker(rng, approved_ids, skew)
+    start_ts = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    span = 2 * 365 * 86400
+
+    def review_rows():
+        review_id = 0
+        while review_id < reviews:
+            k = min(CHUNK, reviews - review_id)
+            for recipe_id, user_id, rating in zip(pick_reviewed(k), pick_reviewer(k),
+                                                  rng.choices(range(1, 6), RATING_WEIGHTS, k=k)):
+                review_id += 1
+                rating_sum[recipe_id] += rating
+                rating_count[recipe_id] += 1
+                comment = sentence(rng, comment_words) if rng.random() < 0.7 else ""
+                created = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start_ts + span * review_id / reviews))
+                yield (review_id, recipe_id, user_id, rating, comment, created, review_base + review_id)
+
+    if approved_ids and users > 1:
+        _insert(conn, """
+            INSERT INTO reviews (id, recipe_id, user_id, rating, comment, created_at, version, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, review_rows())
+    else:
+        reviews = 0
+
+    # --- recipes and their normalized ingredients
+    step(f"recipes: {recipes:,}")
+    vocabulary = ingredient_vocabulary()
+    pick_owner = skewed_picker(rng, range(1, users + 1), skew)
+    pick_ingredient = skewed_picker(rng, vocabulary, skew)
+    ingredient_rows = []
+    ingredient_total = 0
+
+    def recipe_rows():
+        nonlocal ingredient_total
+        owners = pick_owner(recipes)
+        for recipe_id in range(1, recipes + 1):
+            names = list(dict.fromkeys(pick_ingredient(text_length(rng, ingredients_per_recipe))))
+            ingredient_rows.extend((recipe_id, name) for name in names)
+            if len(ingredient_rows) >= CHUNK:
+                conn.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient) VALUES (?, ?)", ingredient_rows)
+                ingredient_total += len(ingredient_rows)
+                ingredient_rows.clear()
+
+            count = rating_count[recipe_id]
+            title = " ".join(rng.choices(WORDS, k=text_length(rng, title_words))).title()
+            yield (
+                recipe_id,
+                f"{title} {names[0].title()}",
+                "\n".join(f"{rng.choice(UNITS)} {name}" for name in names),
+                " ".join(sentence(rng, 12) for _ in range(max(1, instruction_words // 12))),
+                rng.choice(CATEGORIES),
+                owners[recipe_id - 1],
+                1 if statuses[recipe_id] == 2 else 0,
+                "pending" if statuses[recipe_id] == 0 else "approved",
+                rating_sum[recipe_id],
+                count,
+                rating_sum[recipe_id] / count if count else None,
+                recipe_base + recipe_id,
+            )
+
+    _insert(conn, """
+        INSERT INTO recipes
+        (id, title, ingredients, instructions, category, user_id, delete_request, status,
+         rating_sum, rating_count, avg_rating, version, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, recipe_rows())
+    conn.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient) VALUES (?, ?)", ingredient_rows)
+    ingredient_total += len(ingredient_rows)
+
+    # --- derived state the triggers and write helpers normally keep
+    step("counters, indexes and triggers")
+    conn.execute("UPDATE change_counter SET version = ? WHERE id = 1", (review_base + reviews,))
+    conn.execute("""
+        INSERT OR REPLACE INTO site_stats (id, total_recipes, total_users, total_admins)
+        VALUES (
+            1,
+            (SELECT COUNT(*) FROM recipes WHERE status = 'approved'),
+            (SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_admin = 0),
+            (SELECT COUNT(*) FROM users WHERE is_admin = 1)
+        )
+    """)
+    for sql in indexes + triggers:
+        conn.execute(sql)
+
+    step("search index")
+    conn.execute("INSERT INTO recipes_fts(recipes_fts) VALUES ('rebuild')")
+    conn.execute("COMMIT")
+
+    step("analyze")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    step("done")
+    return {
+        "users": users,
+        "recipes": recipes,
+        "approved_recipes": len(approved_ids),
+        "reviews": reviews,
+        "recipe_ingredients": ingredient_total,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--out", default="bench/bench.db", help="database to create")
+    parser.add_argument("--size", choices=SIZES, default="small", help="preset for the three counts below")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--recipes", type=int)
+    parser.add_argument("--reviews", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for popularity (0 = uniform)")
+    parser.add_argument("--title-words", type=int, default=4)
+    parser.add_argument("--instruction-words", type=int, default=120)
+    parser.add_argument("--comment-words", type=int, default=20)
+    parser.add_argument("--ingredients", type=int, default=9, help="average ingredients per recipe")
+    parser.add_argument("--pending", type=float, default=0.05, help="fraction of recipes awaiting approval")
+    parser.add_argument("--force", action="store_true", help="overwrite --out")
+    args = parser.parse_args(argv)
+
+    users, recipes, reviews = SIZES[args.size]
+    users = max(1, args.users if args.users is not None else users)
+    recipes = args.recipes if args.recipes is not None else recipes
+    reviews = args.reviews if args.reviews is not None else reviews
+
+    if os.path.exists(args.out):
+        if not args.force:
+            sys.exit(f"{args.out} exists (use --force to overwrite)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+
+    counts = generate(
+        args.out, users, recipes, reviews,
+        seed=args.seed,
+        skew=args.skew,
+        title_words=args.title_words,
+        instruction_words=args.instruction_words,
+        comment_words=args.comment_words,
+        ingredients_per_recipe=args.ingredients,
+        pending=args.pending,
+    )
+    size_mb = os.path.getsize(args.out) / 1024 / 1024
+    print(", ".join(f"{k}={v:,}" for k, v in counts.items()) + f" -> {args.out} ({size_mb:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Round-trip the email outbox through a local SMTP server (aiosmtpd).
+
+    pip install aiosmtpd
+    python -m bench.mail                      # 200 messages into a scratch database
+    python -m bench.mail --messages 1000 --workers 4
+
+Starts an aiosmtpd server on localhost, queues --messages through
+mailer.send_email() and waits until the server has received all of them.
+One recipient is refused by the server and one message expires before a
+worker gets to it. It then checks that every message arrived once with its
+subject and body, and that the outbox rows ended up sent (or failed for
+the refused and expired ones) with their bodies cleared. Exits 1 on any
+mismatch.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+REFUSED = "refused@example.com"
+EXPIRED = "expired@example.com"
+
+
+class Collector:
+    """aiosmtpd handler that keeps every accepted message."""
+
+    def __init__(self):
+        self.messages = []
+        self.arrived = threading.Condition()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return "550 no such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        from email import message_from_bytes
+
+        message = message_from_bytes(envelope.content)
+        with self.arrived:
+            self.messages.append((envelope.rcpt_tos[0], message["Subject"], message.get_payload().strip()))
+            self.arrived.notify_all()
+        return "250 Message accepted for delivery"
+
+    def wait_for(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self.arrived:
+            while len(self.messages) < count and time.monotonic() < deadline:
+                self.arrived.wait(deadline - time.monotonic())
+            return len(self.messages)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2, help="outbox worker threads")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for delivery")
+    args = parser.parse_args(argv)
+
+    from aiosmtpd.controller import Controller
+
+    tmp = tempfile.TemporaryDirectory()
+    db_name = os.path.join(tmp.name, "mail.db")
+    # Before anything imports db.connection or mailer, which read them once
+    os.environ.update({
+        "RECIPE_DB": db_name,
+        "SMTP_HOST": "localhost",
+        "SMTP_PORT": str(args.port),
+        "SMTP_SECURITY": "none",
+        "MAIL_WORKERS": str(args.workers),
+        "MAIL_MAX_ATTEMPTS": "1",
+    })
+    os.environ.pop("SMTP_USER", None)
+
+    from db.migrations import migrate
+    migrate(db_name)
+    import mailer
+
+    collector = Collector()
+    server = Controller(collector, hostname="localhost", port=args.port)
+    server.start()
+    try:
+        expected = {
+            f"user{i}@example.com": (f"Message {i}", f"Body of message {i}.")
+            for i in range(args.messages)
+        }
+        started = time.perf_counter()
+        # Past its max_age by the time a worker claims it
+        mailer.send_email(EXPIRED, "Too late", "Never sent.", max_age=0)
+        mailer.send_email(REFUSED, "Refused", "Never accepted.")
+        for to_addr, (subject, body) in expected.items():
+            mailer.send_email(to_addr, subject, body)
+        received = collector.wait_for(len(expected), args.timeout)
+        elapsed = time.perf_counter() - started
+        # Let the workers record the last batch
+        deadline = time.monotonic() + args.timeout
+        while mailer.outbox.stats()["queue"]["pending"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stats = mailer.outbox.stats()
+    finally:
+        mailer.outbox.stop()
+        server.stop()
+
+    problems = []
+    delivered = {}
+    for to_addr, subject, body in collector.messages:
+        if to_addr in delivered:
+            problems.append(f"{to_addr} received twice")
+        delivered[to_addr] = (subject, body)
+    for to_addr, message in expected.items():
+        if delivered.get(to_addr) != message:
+            problems.append(f"{to_addr}: expected {message}, got {delivered.get(to_addr)}")
+    for to_addr in (REFUSED, EXPIRED):
+        if to_addr in delivered:
+            problems.append(f"{to_addr} should not have been delivered")
+
+    conn = sqlite3.connect(db_name)
+    rows = {row[0]: row[1:] for row in conn.execute("SELECT to_addr, status, body FROM email_outbox")}
+    conn.close()
+    tmp.cleanup()
+    for to_addr, (status, body) in rows.items():
+        want = "failed" if to_addr in (REFUSED, EXPIRED) else "sent"
+        if status != want:
+            problems.append(f"outbox row for {to_addr} is {status}, expected {want}")
+        if body:
+            problems.append(f"outbox row for {to_addr} still holds its body")
+
+    print(f"{received}/{len(expected)} delivered in {elapsed:.2f}s "
+          f"({received / elapsed:.0f} msg/s, {stats['smtp_connects']} SMTP connection(s), "
+          f"{args.workers} worker(s)); outbox {stats['queue']}")
+    for problem in problems[:20]:
+        print("  " + problem)
+    if problems:
+        print(f"{len(problems)} problem(s)")
+        return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
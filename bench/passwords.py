@@ -0,0 +1,111 @@
+"""
+Benchmark password checks: logins per second, per core, by work factor.
+
+    python -m bench.passwords                                      # hashing alone
+    python -m bench.passwords --method scrypt:16384:8:1 --method pbkdf2:sha256:600000
+    python -m bench.passwords --db bench/medium.db                 # whole POST /login
+
+Concurrent "request threads" check a password for --seconds, once per
+--workers setting (0 = on the request thread, as before the pool). Each
+line shows logins/s, logins/s per core in use and the latency a login
+waits. With --db the threads post to /login through the test client as
+the generator's user2@example.com / bench, so the user lookup and the
+session write are included. The first login with a new --method rehashes
+that user's password, so use a copy of the database.
+"""
+import argparse
+import os
+import threading
+import time
+
+from bench.run import percentile
+
+
+def run_burst(login, threads, seconds):
+    """Call login() from threads threads for seconds; returns sorted latencies in ms."""
+    samples = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop():
+        mine = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            login()
+            mine.append((time.perf_counter() - started) * 1000)
+        with lock:
+            samples.extend(mine)
+
+    pool = [threading.Thread(target=loop) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sorted(samples)
+
+
+def hash_login(hasher, method):
+    from werkzeug.security import generate_password_hash
+
+    stored = generate_password_hash("bench", method)
+
+    def login():
+        matches, _ = hasher.check(stored, "bench")
+        assert matches
+    return login
+
+
+def app_login(hasher):
+    import passwords
+    from app import app
+
+    # check_user_password() uses whatever passwords.hasher is at call time
+    passwords.hasher.stop()
+    passwords.hasher = hasher
+    client = app.test_client()
+
+    def login():
+        response = client.post("/login", data={"email": "user2@example.com", "password": "bench"})
+        assert response.status_code == 302, response.status_code
+    return login
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--method", action="append", help="werkzeug hash method (repeatable)")
+    parser.add_argument("--workers", default=None, help="comma-separated pool sizes, 0 = no pool")
+    parser.add_argument("--threads", type=int, default=None, help="concurrent request threads")
+    parser.add_argument("--seconds", type=float, default=5.0, help="per setting")
+    parser.add_argument("--db", help="generated database to log in against (POST /login)")
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    threads = args.threads or cores * 4
+    workers = [int(w) for w in (args.workers or f"0,{cores}").split(",")]
+    # Before anything imports db.connection, which reads it once
+    if args.db:
+        os.environ["RECIPE_DB"] = os.path.abspath(args.db)
+
+    import passwords
+
+    methods = args.method or [passwords.PASSWORD_HASH_METHOD]
+    print(f"{cores} core(s), {threads} request threads, {args.seconds:g}s per setting")
+
+    for method in methods:
+        method = passwords.normalize_method(method)
+        print(method)
+        for count in workers:
+            hasher = passwords.PasswordHasher(workers=count, queue=max(threads, 1), method=method)
+            login = app_login(hasher) if args.db else hash_login(hasher, method)
+            login()  # start the pool outside the timing
+            started = time.perf_counter()
+            samples = run_burst(login, threads, args.seconds)
+            rate = len(samples) / (time.perf_counter() - started)
+            in_use = min(cores, count or threads)
+            print(f"  workers {count:<3} {rate:8.1f} logins/s  {rate / in_use:7.1f}/s per core   "
+                  f"p50 {percentile(samples, 50):7.1f} ms   p99 {percentile(samples, 99):7.1f} ms")
+            hasher.stop()
+
+
+if __name__ == "__main__":
+    main()
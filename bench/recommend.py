@@ -0,0 +1,160 @@
+"""
+Benchmark the recommender build: time and peak memory.
+
+    python -m bench.recommend --synthetic --size large          # 10^7 ratings in memory, compute only
+    python -m bench.recommend --db bench/large.db               # whole build on a generated DB
+
+--synthetic draws Zipf-skewed ratings like bench.generate does, straight
+into arrays, and times the similarity computation alone (NumPy/SciPy
+required). --db runs build_recommendations() on a generated database (it
+adds reviews, so use a copy): a full build, an incremental one after
+--new-reviews fresh reviews, then the request-time lookups. Memory is
+the growth in peak RSS, which with --db includes SQLite's page cache and
+memory-mapped pages.
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+from bench.run import percentile
+
+
+def peak_rss_mb():
+    # KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def synthetic_ratings(users, recipes, reviews, skew, seed):
+    """(user ids, recipe ids, ratings) arrays, popularity Zipf-skewed and shuffled."""
+    import numpy as np
+
+    from bench.generate import RATING_WEIGHTS
+
+    rng = np.random.default_rng(seed)
+
+    def picker(n):
+        weights = np.cumsum(1.0 / np.arange(1, n + 1) ** skew)
+        ids = rng.permutation(n) + 1
+        return lambda k: ids[np.searchsorted(weights, rng.random(k) * weights[-1])]
+
+    pick_user, pick_recipe = picker(users), picker(recipes)
+    stars = np.cumsum(RATING_WEIGHTS) / sum(RATING_WEIGHTS)
+    return (
+        pick_user(reviews).astype(np.int64),
+        pick_recipe(reviews).astype(np.int64),
+        (np.searchsorted(stars, rng.random(reviews)) + 1).astype(np.float32),
+    )
+
+
+def bench_synthetic(args):
+    from bench.generate import SIZES
+    from db import recommend
+
+    if recommend.np is None:
+        sys.exit("--synthetic needs numpy and scipy")
+    if args.size not in SIZES:
+        sys.exit(f"--size must be one of {', '.join(SIZES)}")
+    users, recipes, reviews = SIZES[args.size]
+    reviews = args.reviews or reviews
+    print(f"{users:,} users, {recipes:,} recipes, {reviews:,} ratings (skew {args.skew}), k={args.k}")
+
+    base = peak_rss_mb()
+    started = time.perf_counter()
+    ratings = synthetic_ratings(users, recipes, reviews, args.skew, args.seed)
+    print(f"  draw ratings      {time.perf_counter() - started:8.1f}s")
+
+    started = time.perf_counter()
+    ratings = recommend.select_ratings(*ratings)
+    print(f"  select ratings    {time.perf_counter() - started:8.1f}s  ({len(ratings[0]):,} kept)")
+
+    started = time.perf_counter()
+    rows = stored = 0
+    for _, ids, _ in recommend.compute_neighbours(ratings, args.k):
+        rows += 1
+        stored += len(ids)
+    seconds = time.perf_counter() - started
+    print(f"  neighbours        {seconds:8.1f}s  ({rows:,} recipes, {rows / seconds:,.0f}/s)")
+    print(f"  stored size       {stored * 8 / 1024 / 1024:8.1f} MB of packed ids + scores")
+    print(f"  peak RSS growth   {peak_rss_mb() - base:8.1f} MB")
+
+
+def bench_db(args):
+    import random
+    import sqlite3
+
+    from db.connection import release_db_connection
+    from db.db import add_review
+    from db.migrations import migrate
+    from db.recommend import build_recommendations, get_recommended_recipes, get_similar_recipes
+
+    migrate()
+    marks = []
+    base = peak_rss_mb()
+    report = build_recommendations(full=True, k=args.k, progress=lambda message: marks.append(
+        (message, time.perf_counter())
+    ))
+    done = time.perf_counter()
+    stages = [" ".join(message.split()[:2]) for message, _ in marks]
+    times = [at for _, at in marks] + [done]
+    print(f"full build          {report['seconds']:8.1f}s  ({report['recomputed']:,} recipes)")
+    for stage, start, end in zip(stages, times, times[1:]):
+        print(f"  {stage:<21}{end - start:4.1f}s")
+    print(f"  peak RSS growth   {peak_rss_mb() - base:8.1f} MB")
+
+    conn = sqlite3.connect(args.db)
+    users, recipes, size = conn.execute("""
+        SELECT (SELECT MAX(id) FROM users), (SELECT MAX(id) FROM recipes),
+               (SELECT SUM(length(similar_ids) + length(scores)) FROM recipe_similarity)
+    """).fetchone()
+    conn.close()
+    print(f"  table payload     {(size or 0) / 1024 / 1024:8.1f} MB")
+
+    rng = random.Random(args.seed)
+    for _ in range(args.new_reviews):
+        add_review(rng.randint(1, recipes), rng.randint(2, users), rng.randint(1, 5), "bench")
+    report = build_recommendations(k=args.k, progress=lambda message: None)
+    print(f"incremental build   {report['seconds']:8.1f}s  after {args.new_reviews:,} new reviews "
+          f"({report['recomputed']:,} recomputed, {report['patched']:,} patched)")
+
+    for name, lookup, top in (
+        ("similar_recipes", get_similar_recipes, recipes),
+        ("recommended", get_recommended_recipes, users),
+    ):
+        samples = []
+        for _ in range(args.lookups):
+            started = time.perf_counter()
+            lookup(rng.randint(1, top))
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        print(f"{name:<19} p50 {percentile(samples, 50):6.2f} ms   p99 {percentile(samples, 99):6.2f} ms")
+    release_db_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", action="store_true", help="in-memory ratings, similarity step only")
+    source.add_argument("--db", help="generated database to build on (it is modified)")
+    parser.add_argument("--size", default="large", help="bench.generate preset for --synthetic")
+    parser.add_argument("--reviews", type=int, help="override the preset's rating count")
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--k", type=int, default=20, help="neighbours kept per recipe")
+    parser.add_argument("--new-reviews", type=int, default=1000, help="reviews added before the incremental build")
+    parser.add_argument("--lookups", type=int, default=2000, help="timed lookups per query")
+    args = parser.parse_args(argv)
+
+    # Before anything imports db.connection, which reads it once
+    if args.db:
+        os.environ["RECIPE_DB"] = os.path.abspath(args.db)
+    if args.synthetic:
+        bench_synthetic(args)
+    else:
+        bench_db(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Benchmark the main routes against a (generated) database.
+
+    python -m bench.generate --size medium --out bench/medium.db
+    python -m bench.run --db bench/medium.db                      # in-process test client
+    python -m bench.run --db bench/medium.db --http http://127.0.0.1:8000 --processes 4 --threads 8
+
+Every run prints requests/s and p50/p95/p99 latency per route and saves a
+JSON result named after the current commit in bench/results/, so a later
+run can be compared with it:
+
+    python -m bench.run --db bench/medium.db --against latest --fail-over 15
+    python -m bench.run --report bench/results/OLD.json bench/results/NEW.json
+
+In --http mode the server must already be running on the same database
+(e.g. RECIPE_DB=bench/medium.db flask run --no-debugger); the driver logs
+in as admin@example.com / user2@example.com, the generator's accounts.
+"""
+import argparse
+import glob
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+
+# name -> (path template, who is logged in: None, "user" or "admin")
+ROUTES = {
+    "home": ("/", None),
+    "view_recipes": ("/view_recipes", "user"),
+    "view_recipes_top": ("/view_recipes?sort=top", "user"),
+    "recipe": ("/recipe/{recipe_id}", "user"),
+    "recipe_reviews": ("/recipe/{recipe_id}/reviews", None),
+    "search": ("/search?q={term}", None),
+    # Two letters as a prefix match a large part of the table
+    "search_prefix": ("/search?q={prefix}", None),
+    "what_can_i_cook": ("/what_can_i_cook?have={pantry}", None),
+    "admin_dashboard": ("/admin_dashboard", "admin"),
+    "admin_requests": ("/admin_requests", "admin"),
+    "api_recipes": ("/api/v1/recipes", None),
+    "api_recipe": ("/api/v1/recipes/{recipe_id}", None),
+}
+
+LOGINS = {
+    "admin": ("admin@example.com", "admin123", 1, 1),
+    "user": ("user2@example.com", "bench", 2, 0),
+}
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# ---------------------------------------------
+# WORKLOAD
+# ---------------------------------------------
+
+def database_info(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        counts = {
+            table: conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+            for table in ("users", "recipes", "reviews")
+        }
+        # Popular recipes get more traffic, like on the real site
+        recipe_ids = [row[0] for row in conn.execute("""
+            SELECT id FROM recipes WHERE status = 'approved'
+            ORDER BY rating_count DESC, id LIMIT 1000
+        """)]
+    finally:
+        conn.close()
+    counts["size_mb"] = round(os.path.getsize(db_path) / 1024 / 1024, 1)
+    return counts, recipe_ids
+
+
+def build_paths(template, count, recipe_ids, seed):
+    """count concrete URLs for one route, the same ones on every run."""
+    from bench.generate import ingredient_vocabulary
+
+    rng = random.Random(f"{seed}-{template}")
+    vocabulary = ingredient_vocabulary()
+    paths = []
+    for _ in range(count):
+        term = rng.choice(vocabulary)
+        paths.append(template.format(
+            recipe_id=rng.choice(recipe_ids) if recipe_ids else 1,
+            term=urllib.parse.quote(term),
+            prefix=urllib.parse.quote(term[:2]),
+            pantry=urllib.parse.quote(",".join(rng.sample(vocabulary, 6))),
+        ))
+    return paths
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, wall_time):
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": round(len(values) / wall_time, 1) if wall_time else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+# ---------------------------------------------
+# IN-PROCESS (Flask test client)
+# ---------------------------------------------
+
+def run_test_client(routes, requests, warmup, recipe_ids, seed):
+    from app import app
+
+    results = {}
+    for name in routes:
+        template, auth = ROUTES[name]
+        client = app.test_client()
+        if auth:
+            _, _, user_id, is_admin = LOGINS[auth]
+            with client.session_transaction() as session:
+                session["user_id"] = user_id
+                session["username"] = auth
+                session["is_admin"] = is_admin
+
+        paths = build_paths(template, warmup + requests, recipe_ids, seed)
+        for path in paths[:warmup]:
+            client.get(path)
+
+        latencies, errors = [], 0
+        for path in paths[warmup:]:
+            start = time.perf_counter()
+            response = client.get(path)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 300:
+                errors += 1
+        results[name] = summarize(latencies, errors, sum(latencies))
+        print_route(name, results[name])
+    return results
+
+
+# ---------------------------------------------
+# HTTP LOAD DRIVER (multi-process)
+# ---------------------------------------------
+# Each process runs `threads` threads, each with one keep-alive connection.
+# Routes are driven one after another so their numbers don't mix.
+
+_cookies = {}
+
+
+def _login(base_url, auth):
+    if auth not in _cookies:
+        email, password, _, _ = LOGINS[auth]
+        url = urllib.parse.urlsplit(base_url)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        conn.request(
+            "POST", "/login",
+            body=urllib.parse.urlencode({"email": email, "password": password}),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        cookie = response.getheader("Set-Cookie", "").split(";")[0]
+        if not cookie:
+            raise RuntimeError(f"could not log in as {email}")
+        _cookies[auth] = cookie
+    return _cookies[auth]
+
+
+def _http_worker(job):
+    base_url, auth, paths, threads = job
+    url = urllib.parse.urlsplit(base_url)
+    headers = {"Cookie": _login(base_url, auth)} if auth else {}
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def drive(share):
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        mine, failed = [], 0
+        for path in share:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 300:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                failed += 1
+            mine.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=drive, args=(paths[i::threads],)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors[0]
+
+
+def run_http(base_url, routes, requests, warmup, recipe_ids, seed, processes, threads):
+    results = {}
+    with multiprocessing.Pool(processes) as pool:
+        for name in routes:
+            template, auth = ROUTES[name]
+            paths = build_paths(template, warmup + requests, recipe_ids, seed)
+            pool.map(_http_worker, [(base_url, auth, paths[:warmup][i::processes], 1) for i in range(processes)])
+
+            jobs = [(base_url, auth, paths[warmup:][i::processes], threads) for i in range(processes)]
+            start = time.perf_counter()
+            outcomes = pool.map(_http_worker, jobs)
+            wall_time = time.perf_counter() - start
+
+            latencies = [latency for process_latencies, _ in outcomes for latency in process_latencies]
+            results[name] = summarize(latencies, sum(errors for _, errors in outcomes), wall_time)
+            print_route(name, results[name])
+    return results
+
+
+# ---------------------------------------------
+# RESULTS
+# ---------------------------------------------
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+
+    try:
+        return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+    except OSError:
+        return "unknown", False
+
+
+def save_results(result, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}{'-dirty' if result['dirty'] else ''}-{result['mode']}.json"
+    path = os.path.join(out_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return path
+
+
+def latest_result(out_dir, mode=None):
+    paths = sorted(glob.glob(os.path.join(out_dir, f"*-{mode}.json" if mode else "*.json")))
+    return paths[-1] if paths else None
+
+
+def print_route(name, stats):
+    print(
+        f"{name:<18} {stats['requests']:>6} req {stats['errors']:>4} err "
+        f"{stats['throughput'] or 0:>9.1f} req/s   p50 {stats['p50_ms'] or 0:>8.2f}   "
+        f"p95 {stats['p95_ms'] or 0:>8.2f}   p99 {stats['p99_ms'] or 0:>8.2f} ms"
+    )
+
+
+def compare(old, new, fail_over=None):
+    """Print new vs old per route; returns the routes whose p95 got more than fail_over % worse."""
+    print(f"\n{old['commit']} ({old['timestamp']}) -> {new['commit']} ({new['timestamp']})")
+    print(f"{'route':<18} {'req/s':>18} {'p50 ms':>22} {'p95 ms':>22} {'p99 ms':>22}")
+
+    def change(before, after):
+        if not before or after is None:
+            return f"{after or 0:>10.2f}         "
+        return f"{after:>10.2f} ({(after - before) / before * 100:+6.1f}%)"
+
+    regressions = []
+    for name, stats in new["routes"].items():
+        base = old["routes"].get(name)
+        if base is None:
+            continue
+        print(
+            f"{name:<18} {change(base['throughput'], stats['throughput']):>18} "
+            f"{change(base['p50_ms'], stats['p50_ms'])} {change(base['p95_ms'], stats['p95_ms'])} "
+            f"{change(base['p99_ms'], stats['p99_ms'])}"
+        )
+        if fail_over is not None and base["p95_ms"] and stats["p95_ms"] is not None:
+            if (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 > fail_over:
+                regressions.append(name)
+    return regressions
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--db", default="bench/bench.db", help="database the app (or server) uses")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated subset of: " + ", ".join(ROUTES))
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--http", metavar="URL", help="drive a running server instead of the test client")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=4, help="connections per process (--http)")
+    parser.add_argument("--out", default=RESULTS_DIR, help="where results are saved")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--against", metavar="RESULT", help="compare with a saved result ('latest' = newest of the same mode)")
+    parser.add_argument("--fail-over", type=float, metavar="PCT", help="exit 1 if any p95 is PCT%% worse than --against")
+    parser.add_argument("--report", nargs=2, metavar=("OLD", "NEW"), help="only compare two saved results")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        sys.exit(1 if compare(load(args.report[0]), load(args.report[1]), args.fail_over) else 0)
+
+    routes = [name.strip() for name in args.routes.split(",") if name.strip()]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error(f"unknown route(s): {', '.join(unknown)}")
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} not found - create it with python -m bench.generate")
+
+    # Before anything imports db.connection, which reads it once
+    os.environ["RECIPE_DB"] = os.path.abspath(args.db)
+    os.environ.setdefault("MAIL_WORKERS", "0")
+
+    mode = "http" if args.http else "client"
+    baseline = latest_result(args.out, mode) if args.against == "latest" else args.against
+
+    counts, recipe_ids = database_info(args.db)
+    print(f"{mode} benchmark on {args.db}: " + ", ".join(f"{k}={v:,}" for k, v in counts.items()))
+
+    if args.http:
+        results = run_http(args.http.rstrip("/"), routes, args.requests, args.warmup, recipe_ids,
+                           args.seed, args.processes, args.threads)
+    else:
+        results = run_test_client(routes, args.requests, args.warmup, recipe_ids, args.seed)
+
+    commit, dirty = git_revision()
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "dirty": dirty,
+        "mode": mode,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "db": dict(counts, path=args.db),
+        "settings": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "processes": args.processes if args.http else 1,
+            "threads": args.threads if args.http else 1,
+        },
+        "routes": results,
+    }
+    if not args.no_save:
+        print(f"saved {save_results(result, args.out)}")
+
+    if baseline:
+        regressions = compare(load(baseline), result, args.fail_over)
+        if regressions:
+            print(f"p95 regressed more than {args.fail_over}% on: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
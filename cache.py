@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# ---------------------------------------------
+# IN-PROCESS CACHES
+# ---------------------------------------------
+
+class CachedValue:
+    """
+    A single value built by loader() and reused until it is ttl seconds old
+    or invalidate() is called. Only one thread reloads a stale value; the
+    others keep getting the old one meanwhile instead of piling onto the DB.
+    Only the very first load makes callers wait.
+    """
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._has_value = False
+        self._loaded_at = None
+        # Bumped by invalidate(), so a reload that started earlier (and may
+        # have read the data before the write) does not count as fresh
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def get(self):
+        if self._fresh():
+            self.hits += 1
+            return self._value
+
+        # Someone else is already reloading - serve the stale value if we have one
+        if not self._lock.acquire(blocking=not self._has_value):
+            self.hits += 1
+            return self._value
+        try:
+            if self._fresh():
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            generation = self._generation
+            loaded_at = time.monotonic()
+            self._value = self.loader()
+            self._has_value = True
+            if generation == self._generation:
+                self._loaded_at = loaded_at
+            return self._value
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = None
+
+    def update(self, fn):
+        """
+        Patch the loaded value in place with fn(value) instead of reloading
+        it. A reload already under way read the data before the change, so
+        it is not trusted either (the next get() reloads again).
+        """
+        self._generation += 1
+        if self._has_value:
+            fn(self._value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by total size in bytes (and optionally by
+    entry count), with an optional TTL per entry. Callers pass the size of
+    what they store; the least recently used entries go first.
+    """
+
+    def __init__(self, max_bytes, max_entries=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size, ttl=None):
+        """Store value; ttl (seconds) overrides the cache's own for this entry."""
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes or (
+                self.max_entries is not None and len(self._data) > self.max_entries
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def purge_expired(self):
+        """Drop every expired entry now rather than when it is next looked up."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key for key, (_, _, expires_at) in self._data.items()
+                if expires_at is not None and now >= expires_at
+            ]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
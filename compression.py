@@ -0,0 +1,108 @@
+import gzip
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ---------------------------------------------
+# RESPONSE COMPRESSION
+# ---------------------------------------------
+# Compresses text responses for clients that accept it: brotli when the
+# module is installed and the client prefers it, gzip otherwise. Small
+# bodies are not worth the CPU (or the bytes - gzip adds ~20 of its own).
+# Streamed responses are compressed chunk by chunk with a flush after each
+# one, so streaming keeps working through the compressor.
+#
+#   COMPRESS=0               off (e.g. when a proxy in front compresses)
+#   COMPRESS_MIN_SIZE=1024   bytes below which bodies go out as they are
+COMPRESS = os.environ.get("COMPRESS", "1") == "1"
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml", "image/svg+xml",
+)
+
+
+def choose_encoding():
+    """Best encoding the client accepts, or None. Equal q-values prefer brotli."""
+    accepted = request.accept_encodings
+    options = [("br", accepted["br"])] if brotli is not None else []
+    options.append(("gzip", accepted["gzip"]))
+    encoding, quality = max(options, key=lambda option: option[1])
+    return encoding if quality > 0 else None
+
+
+def _compressible(response):
+    return (
+        response.status_code == 200
+        and request.method != "HEAD"
+        and "Content-Encoding" not in response.headers
+        and not response.direct_passthrough  # send_file and friends
+        and "no-transform" not in response.headers.get("Cache-Control", "")
+        and (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def _compressor(encoding):
+    """(compress(chunk) -> bytes, flush() -> bytes, finish() -> bytes) for a stream."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def _compress_stream(chunks, encoding):
+    compress, flush, finish = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    if not _compressible(response):
+        return response
+
+    # Whatever the outcome, caches must key this URL on Accept-Encoding
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == "br":
+            response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+
+    response.headers["Content-Encoding"] = encoding
+    # Different bytes than the identity body, so the ETag can only be weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    if COMPRESS:
+        app.after_request(compress_response)
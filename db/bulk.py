@@ -0,0 +1,182 @@
+import csv
+import itertools
+import json
+import os
+
+from db.db import (
+    RECIPE_IMPORT_COLUMNS,
+    get_user_by_email,
+    import_recipe_chunk,
+    iter_recipes_for_export,
+)
+from db.ingredients import normalize_ingredients
+
+
+# ---------------------------------------------
+# BULK RECIPE IMPORT / EXPORT
+# ---------------------------------------------
+# JSONL: one recipe object per line. CSV: a header row with the same keys.
+#
+#   title, ingredients, instructions      required
+#   category, image_url, video_url        optional
+#   status                                "pending" (default) or "approved"
+#   user_email or user_id                 owner; falls back to --owner
+#
+# Export writes the same keys (plus id, username and rating columns, which
+# import ignores), so an export can be fed straight back in.
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "1000"))
+MAX_REPORTED_ERRORS = 50
+
+FORMATS = ("jsonl", "csv")
+STATUSES = ("pending", "approved")
+REQUIRED_FIELDS = ("title", "ingredients", "instructions")
+
+EXPORT_FIELDS = (
+    "id", "title", "ingredients", "instructions", "category", "image_url",
+    "video_url", "status", "username", "user_email", "avg_rating", "rating_count",
+)
+
+
+def guess_format(filename):
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(lines, fmt):
+    """Yield (line number, raw dict) from a text stream without reading it all in."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_no, record
+
+
+def validate_recipe(record, status=None):
+    """Return a clean recipe dict ready for import_recipe_chunk, or raise ValueError."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+
+    recipe = {}
+    for col in RECIPE_IMPORT_COLUMNS + ("user_email",):
+        value = record.get(col)
+        if value is not None:
+            value = str(value).strip()
+        recipe[col] = value or None
+
+    for col in REQUIRED_FIELDS:
+        if not recipe[col]:
+            raise ValueError(f"missing {col}")
+
+    recipe["status"] = status or recipe["status"] or "pending"
+    if recipe["status"] not in STATUSES:
+        raise ValueError(f"bad status {recipe['status']!r}")
+
+    user_id = record.get("user_id")
+    if user_id not in (None, ""):
+        try:
+            recipe["user_id"] = int(user_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"bad user_id {user_id!r}")
+
+    recipe["ingredient_names"] = normalize_ingredients(recipe["ingredients"])
+    return recipe
+
+
+def import_recipes(lines, fmt="jsonl", owner_email=None, status=None, chunk_size=None):
+    """
+    Stream recipes from a text stream into the database, chunk_size rows
+    per transaction. Invalid rows are skipped and reported, not fatal.
+    Returns {"imported", "skipped", "errors": [(line, reason), ...]}.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    default_user_id = None
+    if owner_email:
+        owner = get_user_by_email(owner_email)
+        if not owner:
+            raise ValueError(f"No user with email {owner_email}")
+        default_user_id = owner["id"]
+
+    report = {"imported": 0, "skipped": 0, "errors": []}
+
+    def skip(line_no, reason):
+        report["skipped"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append((line_no, reason))
+
+    def valid_rows():
+        for line_no, record in read_records(lines, fmt):
+            try:
+                yield line_no, validate_recipe(record, status)
+            except ValueError as e:
+                skip(line_no, str(e))
+
+    rows = valid_rows()
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size or IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        inserted, rejected = import_recipe_chunk([recipe for _, recipe in chunk], default_user_id)
+        report["imported"] += inserted
+        for position, reason in rejected:
+            skip(chunk[position][0], reason)
+
+    return report
+
+
+def export_lines(fmt="jsonl", status=None):
+    """Yield the catalogue as text lines (for files or a streamed response)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    rows = iter_recipes_for_export(status)
+    if fmt == "jsonl":
+        for row in rows:
+            yield json.dumps({field: row[field] for field in EXPORT_FIELDS}, ensure_ascii=False) + "\n"
+        return
+
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.pop()
+    for row in rows:
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+        yield buffer.pop()
+
+
+def export_recipes(out, fmt="jsonl", status=None):
+    """Write the catalogue to a text stream; returns the number of recipes."""
+    count = -1 if fmt == "csv" else 0  # don't count the CSV header
+    for line in export_lines(fmt, status):
+        out.write(line)
+        count += 1
+    return count
+
+
+class _LineBuffer:
+    """Write target for csv.writer that hands each formatted row back."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def pop(self):
+        text = "".join(self._parts)
+        self._parts.clear()
+        return text
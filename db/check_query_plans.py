@@ -0,0 +1,225 @@
+"""
+Run EXPLAIN QUERY PLAN on every query issued by the helpers in db/db.py -
+reads, the SQL inside their run_write() jobs and the cache loaders - and
+fail when one of them falls back to a full table scan.
+
+    python -m db.check_query_plans
+
+The helpers run against a small generated database (so fetches that only
+happen when rows exist are reached), with the caches emptied before each
+call. Every public helper must be callable from CALLS or with 1 for each
+required argument; each one gets a fresh copy of the database, so writes
+do not affect the helpers after them.
+"""
+import inspect
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import types
+
+import db.connection as connection
+import db.db as queries
+import db.ingredients as ingredients
+from cache import CachedValue
+
+
+# Helpers that are allowed to scan a whole table, with the reason why
+ALLOWED_SCANS = {
+    "repair_rating_aggregates": "recomputes every recipe's rating from its reviews",
+    "rebuild_ingredient_index": "re-normalizes the ingredients of every recipe",
+}
+
+# Public functions that issue no SQL of their own
+NOT_QUERIES = {"on_recipe_change"}
+
+# (args, kwargs) to call a helper with, when 1 for every required
+# parameter will not do. Several entries cover the cursor (seek) variants
+# of paged listings, search pages and each moderation queue.
+CALLS = {
+    "get_recipes_for_users": [([[1, 2]], {})],
+    "get_recipe_owners": [([[1, 2]], {})],
+    "get_random_approved_recipes": [([5], {})],
+    "get_top_rated_recipes": [([5], {})],
+    "get_user_by_email": [(["user2@example.com"], {})],
+    "get_approved_recipes_with_user": [
+        ([], {}), ([], {"before": "5"}), ([], {"after": "5"}),
+        ([], {"sort": "top"}), ([], {"sort": "top", "before": "4.5_5"}),
+    ],
+    "get_all_users_with_recipe_count": [([], {}), ([], {"before": "5"}), ([], {"after": "5"})],
+    "get_pending_users": [([], {}), ([], {"before": "5"}), ([], {"q": "user"})],
+    "get_pending_recipes": [([], {}), ([], {"before": "5"}), ([], {"q": "a", "category": "Dessert"})],
+    "get_pending_delete_requests": [([], {}), ([], {"before": "5"}), ([], {"q": "a"})],
+    "get_reviews_page": [([1], {}), ([1], {"before": "5"}), ([1], {"after": "5"})],
+    "get_changes_since": [([0], {}), ([0], {"tables": ("recipes", "reviews")})],
+    "create_user": [(["check", "check@example.com", "hash"], {})],
+    "update_password_hash": [([2, "old", "new"], {})],
+    "add_recipe": [(["Check", "2 eggs\n1 cup flour", "Mix.", "Dessert", "", "", 2], {})],
+    "add_review": [([1, 2, 4, "Good"], {})],
+    "update_recipe": [([1, "Check", "2 eggs\nsugar", "Mix.", "Dessert", "", ""], {})],
+    "update_user": [([2, "check", "check@example.com"], {})],
+    "count_pending": [
+        ([queue], kwargs)
+        for queue in queries.MODERATION_QUEUES
+        for kwargs in ({}, {"q": "a", "category": "Dessert"})
+    ],
+    **{
+        name: [([], {"ids": [1, 2, 3]}), ([], {"q": "a"}), ([], {})]
+        for name in (
+            "approve_users", "reject_users", "approve_recipes", "reject_recipes",
+            "approve_delete_requests", "reject_delete_requests",
+        )
+    },
+    "search_recipes": [
+        (["chicken"], {}), (["ch"], {}), (["chicken"], {"before": "1.5_300"}), (["chicken"], {"after": "1.5_5"}),
+    ],
+    "what_can_i_cook": [([["chicken", "garlic", "salt"]], {"require": ["garlic"]})],
+    "suggest_ingredients": [(["ch"], {})],
+    "import_recipe_chunk": [([[
+        {"title": "Check", "ingredients": "salt", "instructions": "Mix.", "category": "Snack",
+         "status": "approved", "user_email": "user2@example.com", "ingredient_names": ["salt"]},
+        {"title": "Check", "ingredients": "salt", "instructions": "Mix.", "category": "Snack",
+         "status": "pending", "user_id": 3, "ingredient_names": ["salt"]},
+    ]], {"default_user_id": 1})],
+    "iter_recipes_for_export": [([], {"status": "approved"})],
+}
+
+
+class _RecordingCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        self.connection.statements.append((sql, params))
+        return super().execute(sql, params)
+
+
+class _RecordingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = []
+
+    def cursor(self, factory=_RecordingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, params))
+        return super().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            self.statements.append((sql, seq_of_params[0]))
+        return super().executemany(sql, seq_of_params)
+
+
+def _helpers():
+    for name, func in inspect.getmembers(queries, inspect.isfunction):
+        if not name.startswith("_") and name not in NOT_QUERIES and func.__module__ == queries.__name__:
+            yield name, func
+
+
+def _calls(name, func):
+    if name in CALLS:
+        return CALLS[name]
+    params = inspect.signature(func).parameters.values()
+    return [([1 for p in params if p.default is inspect.Parameter.empty], {})]
+
+
+def _caches():
+    for module in (queries, ingredients):
+        for value in vars(module).values():
+            if isinstance(value, CachedValue):
+                yield value
+
+
+def _full_scans(conn, sql, params):
+    plan = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params)
+    scans = []
+    subqueries = set()
+    for row in plan:
+        detail = row[3]
+        if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+            subqueries.add(detail.split()[1])
+            continue
+        if not detail.startswith("SCAN ") or "USING" in detail or "(" in detail:
+            continue
+        scanned = detail.split()[1]
+        # Not table scans: json_each() over a parameter, a VALUES or
+        # SELECT ? row, a subquery's own result, and the temp.staged_ids
+        # scratch table, which holds just the ids being changed
+        if "VIRTUAL TABLE" in detail or detail == "SCAN CONSTANT ROW":
+            continue
+        if scanned in subqueries or scanned.startswith("temp."):
+            continue
+        scans.append(detail)
+    return scans
+
+
+def _seed(db_name):
+    """A small database with every kind of row the helpers look for."""
+    from bench.generate import generate
+
+    generate(db_name, users=40, recipes=400, reviews=2000, pending=0.2,
+             delete_requests=0.05, unapproved=0.2, progress=lambda message: None)
+    # Plan as a fresh deployment would, without statistics from the tiny tables
+    conn = sqlite3.connect(db_name)
+    conn.execute("DROP TABLE IF EXISTS sqlite_stat1")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+
+def check(seed_db, work_db):
+    # Writes run inline on the recording connection instead of the writer
+    connection.WRITE_QUEUE = False
+
+    failures = []
+    for name, func in _helpers():
+        shutil.copyfile(seed_db, work_db)
+        conn = sqlite3.connect(work_db, factory=_RecordingConnection)
+        conn.row_factory = sqlite3.Row
+        for module in (connection, queries, ingredients):
+            module.get_db_connection = lambda: conn
+        for cache in _caches():
+            cache.invalidate()
+
+        for args, kwargs in _calls(name, func):
+            result = func(*args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                list(result)
+        if conn.in_transaction:
+            conn.rollback()
+
+        for sql, sql_params in conn.statements:
+            scans = _full_scans(conn, sql, sql_params)
+            if scans and name not in ALLOWED_SCANS:
+                failures.append((name, scans, sql))
+
+        status = "FAIL" if any(f[0] == name for f in failures) else "ok"
+        print(f"{status:4}  {name} ({len(conn.statements)} queries)")
+        conn.close()
+
+    # The loaded caches hold rows of the last copy; leave nothing behind
+    for cache in _caches():
+        cache.invalidate()
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_db = os.path.join(tmp, "seed.db")
+        _seed(seed_db)
+        failures = check(seed_db, os.path.join(tmp, "query_plans.db"))
+
+    for name, scans, sql in failures:
+        print(f"\n{name} does a full scan ({', '.join(scans)}):")
+        print("    " + " ".join(sql.split()))
+
+    if failures:
+        print(f"\n{len(failures)} quer{'y' if len(failures) == 1 else 'ies'} fall back to a full scan")
+        return 1
+
+    print("\nNo full table scans.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import atexit
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+DB_NAME = os.environ.get("RECIPE_DB", "recipe.db")
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+WRITE_QUEUE = os.environ.get("DB_WRITE_QUEUE", "1") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("DB_WRITE_BATCH_SIZE", "64"))
+
+
+# ---------------------------------------------
+# STORAGE PROFILES
+# ---------------------------------------------
+# Applied to every connection the app opens. WAL lets readers keep going
+# while a writer commits; busy_timeout makes a blocked writer wait instead
+# of failing straight away with "database is locked".
+STORAGE_PROFILES = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,  # negative = KiB, so ~64 MB
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -16000,
+        "busy_timeout": 10000,
+        "foreign_keys": "ON",
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 1024 * 1024 * 1024,
+        "cache_size": -256000,
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+}
+
+STORAGE_PROFILE = os.environ.get("DB_PROFILE", "default")
+
+
+def get_storage_profile(name=None):
+    """
+    Return the PRAGMA settings for a profile. Single settings can be
+    overridden with DB_PRAGMA_<NAME>, e.g. DB_PRAGMA_SYNCHRONOUS=FULL.
+    """
+    name = name or STORAGE_PROFILE
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {name}")
+
+    profile = dict(STORAGE_PROFILES[name])
+    for pragma in profile:
+        override = os.environ.get(f"DB_PRAGMA_{pragma.upper()}")
+        if override is not None:
+            profile[pragma] = override
+    return profile
+
+
+def apply_storage_profile(conn, profile=None):
+    for pragma, value in (profile or get_storage_profile()).items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+# Class of every connection the pool and the writer open. profiling.py
+# swaps in a timing subclass; by default there is no wrapper at all.
+connection_factory = sqlite3.Connection
+
+
+def set_connection_factory(factory):
+    """Use factory for connections opened from now on (call before the first query)."""
+    global connection_factory
+    connection_factory = factory
+
+
+def connect(db_name=None):
+    """Open a new connection with the storage profile applied."""
+    conn = sqlite3.connect(db_name or DB_NAME, check_same_thread=False, factory=connection_factory)
+    conn.row_factory = sqlite3.Row
+    apply_storage_profile(conn)
+    return conn
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    A thread checks a connection out on its first get_db_connection() call
+    and keeps it until release() - for the web app that is the whole Flask
+    request, so every helper in a request shares one connection.
+    """
+
+    def __init__(self, db_name, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.db_name = db_name
+        self.size = size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._closing = False
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        return connect(self.db_name)
+
+    def acquire(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        start = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(
+                        f"no database connection free after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+
+        self._local.conn = conn
+        return conn
+
+    def release(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+
+        # Never hand a half-finished transaction to the next borrower
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            self._in_use -= 1
+            closing = self._closing
+            if closing:
+                self._opened -= 1
+        if closing:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close_all(self):
+        """Close every idle connection; checked-out ones close on release."""
+        with self._lock:
+            self._closing = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def after_fork(self):
+        """In a forked child: start empty, leaving the parent's connections alone."""
+        _inherited.append((self._idle, self._local))
+        self._reset()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 6),
+                "wait_time_max": round(self._max_wait, 6),
+            }
+
+
+# ---------------------------------------------
+# SERIALIZED WRITER
+# ---------------------------------------------
+class SerializedWriter:
+    """
+    Single background thread that owns the only writing connection.
+
+    Write jobs are callables taking a connection. Jobs that queue up while a
+    transaction is running are batched into the next one; each job runs in
+    its own SAVEPOINT so a failing job is rolled back without taking the
+    rest of the batch down with it. A job runs in a copy of the submitting
+    thread's context, so context variables (the profiler's per-request
+    query log) carry over to the writer thread.
+    """
+
+    def __init__(self, db_name, batch_size=WRITE_BATCH_SIZE):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self._reset()
+
+    def _reset(self):
+        self._conn = None
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._jobs_done = 0
+        self._jobs_failed = 0
+        self._max_batch = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, job):
+        """Queue a job and block until its transaction has committed."""
+        # A job that writes through another helper is already on the writer
+        if threading.current_thread() is self._thread:
+            return job(self._conn)
+
+        self._ensure_started()
+        future = Future()
+        self._jobs.put((job, contextvars.copy_context(), future))
+        return future.result()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join()
+
+    def _run(self):
+        self._conn = connect(self.db_name)
+        self._conn.isolation_level = None  # transactions are managed here
+
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                break
+
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(item)
+
+            self._run_batch(batch)
+
+        self._conn.close()
+
+    def _run_batch(self, batch):
+        conn = self._conn
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, context, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = context.run(job, conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, result, None))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(future, None, e) for _, _, future in batch]
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                failed += 1
+                future.set_exception(error)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._jobs_done += len(batch) - failed
+            self._jobs_failed += failed
+            self._max_batch = max(self._max_batch, len(batch))
+
+    def after_fork(self):
+        """In a forked child: the writer thread is gone, start a new one on demand."""
+        _inherited.append((self._conn, self._jobs))
+        self._reset()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "enabled": WRITE_QUEUE,
+                "queued": self._jobs.qsize(),
+                "batches": self._batches,
+                "jobs": self._jobs_done,
+                "failed": self._jobs_failed,
+                "max_batch": self._max_batch,
+            }
+
+
+# ---------------------------------------------
+# PROCESSES
+# ---------------------------------------------
+# An SQLite connection must not be used - or even closed - on both sides of
+# a fork(). A forked child (a gunicorn worker after preload, a
+# multiprocessing worker) therefore gets an empty pool and a new writer,
+# and the parent's connections stay referenced here so they are never
+# garbage-collected (closed) in the child.
+_inherited = []
+
+pool = ConnectionPool(DB_NAME)
+writer = SerializedWriter(DB_NAME)
+atexit.register(writer.stop)
+
+
+def _after_fork_in_child():
+    pool.after_fork()
+    writer.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def close_all_connections():
+    """Graceful shutdown: let queued writes commit, then close idle connections."""
+    writer.stop()
+    pool.close_all()
+
+
+def get_db_connection():
+    """
+    Return the connection checked out by the current thread.
+    Helpers must not close it; release_db_connection() returns it to the pool.
+    """
+    return pool.acquire()
+
+
+def release_db_connection(exc=None):
+    """Give the current thread's connection back (used as the Flask teardown)."""
+    pool.release()
+
+
+def run_write(job):
+    """
+    Run job(conn) inside a write transaction and return its result.
+    Jobs must not commit themselves. With DB_WRITE_QUEUE=0 the job runs
+    directly on the request's pooled connection instead of the writer.
+    """
+    if WRITE_QUEUE:
+        return writer.submit(job)
+
+    conn = get_db_connection()
+    with conn:
+        return job(conn)
+
+
+def get_pool_stats():
+    return {"pool": pool.stats(), "writer": writer.stats()}
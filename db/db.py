@@ -1,16 +1,271 @@
+import json
+import os
+import random
+import re
 import sqlite3
+from array import array
 
+from cache import CachedValue
+from db.connection import DB_NAME, get_db_connection, run_write
+from db.ingredients import ingredient_index, refresh_ingredient_index, store_recipe_ingredients
 
-
-DB_NAME = "recipe.db"
-import os
 print("Using DB file:", os.path.abspath(DB_NAME))
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+# ---------------------------------------------
+# WRITE HELPERS
+# ---------------------------------------------
+# All writes go through run_write() so they are serialized (and batched)
+# on the single writer connection.
+
+def _write(sql, params=()):
+    """Run one write statement and return the number of rows it touched."""
+    return run_write(lambda conn: conn.execute(sql, params).rowcount)
+
+
+def _apply_rating_delta(conn, recipe_id, sum_delta, count_delta):
+    """Adjust the stored rating aggregates of one recipe in place."""
+    conn.execute("""
+        UPDATE recipes
+        SET rating_sum = rating_sum + :sum,
+            rating_count = rating_count + :count,
+            avg_rating = CASE WHEN rating_count + :count > 0
+                              THEN (rating_sum + :sum) * 1.0 / (rating_count + :count)
+                         END
+        WHERE id = :id
+    """, {"id": recipe_id, "sum": sum_delta, "count": count_delta})
+
+
+def _fts_index(conn, where, params):
+    """Add the recipes matching where to the search index."""
+    conn.execute(f"""
+        INSERT INTO recipes_fts (rowid, title, ingredients, instructions, category)
+        SELECT id, title, ingredients, instructions, category
+        FROM recipes
+        WHERE {where}
+    """, params)
+
+
+def _fts_unindex(conn, where, params):
+    """
+    Drop the recipes matching where from the search index. External-content
+    FTS needs the old column values, so call this before the row changes.
+    """
+    conn.execute(f"""
+        INSERT INTO recipes_fts (recipes_fts, rowid, title, ingredients, instructions, category)
+        SELECT 'delete', id, title, ingredients, instructions, category
+        FROM recipes
+        WHERE {where}
+    """, params)
+
+
+# Multi-row deletes first put the ids they act on into a temp table, then
+# run each statement once over the whole set - the same code path serves
+# one id or ten thousand.
+STAGED_IDS = "(SELECT id FROM temp.staged_ids)"
+
+
+def _stage_ids(conn, select, params=()):
+    """Replace the contents of temp.staged_ids with the ids select returns."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS staged_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.staged_ids")
+    conn.execute(f"INSERT OR IGNORE INTO temp.staged_ids (id) {select}", params)
+    return [row[0] for row in conn.execute("SELECT id FROM temp.staged_ids")]
+
+
+def _delete_staged_recipes(conn):
+    """Delete the staged recipes together with their reviews (foreign keys are enforced)."""
+    conn.execute(f"DELETE FROM reviews WHERE recipe_id IN {STAGED_IDS}")
+    conn.execute(f"DELETE FROM recipe_ingredients WHERE recipe_id IN {STAGED_IDS}")
+    _fts_unindex(conn, f"id IN {STAGED_IDS}", ())
+    return conn.execute(f"DELETE FROM recipes WHERE id IN {STAGED_IDS}").rowcount
+
+
+def _delete_staged_users(conn):
+    """Delete the staged users, their reviews, their recipes and the reviews on those."""
+    # Take their reviews out of the aggregates of recipes that stay
+    conn.execute(f"""
+        UPDATE recipes
+        SET rating_sum = recipes.rating_sum - gone.rating_sum,
+            rating_count = recipes.rating_count - gone.rating_count,
+            avg_rating = CASE WHEN recipes.rating_count - gone.rating_count > 0
+                              THEN (recipes.rating_sum - gone.rating_sum) * 1.0
+                                   / (recipes.rating_count - gone.rating_count)
+                         END
+        FROM (
+            SELECT recipe_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+            FROM reviews
+            WHERE user_id IN {STAGED_IDS}
+            GROUP BY recipe_id
+        ) AS gone
+        WHERE recipes.id = gone.recipe_id
+    """)
+
+    their_recipes = f"(SELECT id FROM recipes WHERE user_id IN {STAGED_IDS})"
+    conn.execute(f"""
+        DELETE FROM reviews
+        WHERE user_id IN {STAGED_IDS}
+           OR recipe_id IN {their_recipes}
+    """)
+    conn.execute(f"DELETE FROM recipe_ingredients WHERE recipe_id IN {their_recipes}")
+    _fts_unindex(conn, f"user_id IN {STAGED_IDS}", ())
+    conn.execute(f"DELETE FROM recipes WHERE user_id IN {STAGED_IDS}")
+    return conn.execute(f"DELETE FROM users WHERE id IN {STAGED_IDS}").rowcount
+
+
+def _recipes_touched_by_staged_users(conn):
+    """Ids of the recipes the staged users wrote or reviewed."""
+    return [row[0] for row in conn.execute(f"""
+        SELECT id FROM recipes WHERE user_id IN {STAGED_IDS}
+        UNION
+        SELECT recipe_id FROM reviews WHERE user_id IN {STAGED_IDS}
+    """)]
+
+
+def _delete_recipe_rows(conn, recipe_id):
+    _stage_ids(conn, "SELECT ?", (recipe_id,))
+    return _delete_staged_recipes(conn)
+
+
+def _recipes_touched_by_user(conn, user_id):
+    """Ids of the recipes a user wrote or reviewed (their name shows on those)."""
+    return [row[0] for row in conn.execute("""
+        SELECT id FROM recipes WHERE user_id = ?
+        UNION
+        SELECT recipe_id FROM reviews WHERE user_id = ?
+    """, (user_id, user_id))]
+
+
+# ---------------------------------------------
+# CHANGE NOTIFICATIONS
+# ---------------------------------------------
+# Caches above the DB layer (rendered pages etc.) register a callback here
+# and get told which recipes changed once the write has committed.
+
+_recipe_listeners = []
+
+
+def on_recipe_change(callback):
+    """Register callback(recipe_ids), run after recipes are added, changed or removed, or their reviews change."""
+    _recipe_listeners.append(callback)
+    return callback
+
+
+def _recipes_changed(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    for callback in _recipe_listeners:
+        callback(recipe_ids)
+
+
+# ---------------------------------------------
+# KEYSET PAGINATION
+# ---------------------------------------------
+# Listings are paged with "seek" conditions on their sort keys instead of
+# OFFSET, so page 1000 costs the same index seek as page 1 and rows added
+# while someone is paging never shift the pages they have not seen yet.
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Sort orders: (SQL expression, result column, type) from most to least
+# significant, all descending. The last key must be unique.
+SORT_NEWEST = [("r.id", "id", int)]
+SORT_TOP_RATED = [("IFNULL(r.avg_rating, 0)", "sort_rating", float), ("r.id", "id", int)]
+RECIPE_SORTS = {"newest": SORT_NEWEST, "top": SORT_TOP_RATED}
+
+
+class Page:
+    """One page of a listing plus the cursors of its neighbours (None at the ends)."""
+
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _encode_cursor(row, keys):
+    return "_".join(repr(row[column]) for _, column, _ in keys)
+
+
+def _decode_cursor(cursor, keys):
+    """Parse a cursor from the query string; None if it is malformed."""
+    parts = str(cursor).split("_")
+    if len(parts) != len(keys):
+        return None
+    try:
+        return [cast(part) for part, (_, _, cast) in zip(parts, keys)]
+    except ValueError:
+        return None
+
+
+def _keyset_condition(keys, op):
+    """
+    Build "rows past the cursor" for a descending (op "<") or ascending
+    (op ">") walk. Written as a range on the first key so SQLite can seek.
+    """
+    first = keys[0][0]
+    if len(keys) == 1:
+        return f"{first} {op} :k0"
+
+    tail = " OR ".join(f"{expr} {op} :k{i}" for i, (expr, _, _) in enumerate(keys[1:], 1))
+    return f"{first} {op}= :k0 AND ({first} {op} :k0 OR {tail})"
+
+
+def _keyset_page(sql, params, keys, before=None, after=None, limit=None):
+    """
+    Run a listing query one page at a time.
+
+    sql must end in its WHERE clause. before=<cursor> fetches the page
+    after that row in sort order (older), after=<cursor> the page before it.
+    """
+    limit = _page_size(limit)
+    params = dict(params)
+    backwards = after is not None
+
+    values = _decode_cursor(after if backwards else before, keys) if (after or before) else None
+    if values is not None:
+        sql += " AND " + _keyset_condition(keys, ">" if backwards else "<")
+        params.update({f"k{i}": value for i, value in enumerate(values)})
+    else:
+        backwards = False
+
+    direction = "ASC" if backwards else "DESC"
+    sql += " ORDER BY " + ", ".join(f"{expr} {direction}" for expr, _, _ in keys)
+    sql += " LIMIT :limit"
+    params["limit"] = limit + 1
+
+    conn = get_db_connection()
+    rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    return Page(
+        rows,
+        next_cursor=_encode_cursor(rows[-1], keys) if rows and has_next else None,
+        prev_cursor=_encode_cursor(rows[0], keys) if rows and has_prev else None,
+    )
 
 
 # ---------------------------------------------
@@ -22,50 +277,139 @@ def get_approved_recipes():
     cur = conn.cursor()
     cur.execute("SELECT * FROM recipes WHERE status = 'approved'")
     recipes = cur.fetchall()
-    conn.close()
     return recipes
 
 
-def get_total_approved_recipes():
+# Columns the home page cards actually render - never the long text fields
+RECIPE_CARD_COLUMNS = "r.id, r.title, r.category, r.image_url, ROUND(r.avg_rating, 1) AS avg_rating"
+
+APPROVED_IDS_TTL = int(os.environ.get("APPROVED_IDS_TTL", "300"))
+
+
+def _load_approved_recipe_ids():
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM recipes WHERE status = 'approved'")
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
+    rows = conn.execute("SELECT id FROM recipes WHERE status = 'approved'")
+    return array("q", (row[0] for row in rows))
 
 
-def get_total_users():
+# Packed array of approved recipe ids (8 bytes each), read from the partial
+# index and refreshed every APPROVED_IDS_TTL seconds or when an approved
+# recipe appears or disappears in this process.
+approved_recipe_ids = CachedValue(_load_approved_recipe_ids, APPROVED_IDS_TTL)
+
+
+def get_random_approved_recipes(k):
+    """
+    Pick k random approved recipes (card columns only) without scanning
+    the recipes table: sample ids from the cached array, then fetch by id.
+    """
+    ids = approved_recipe_ids.get()
+    if not ids or k <= 0:
+        return []
+
+    picked = random.sample(range(len(ids)), min(k, len(ids)))
+    picked_ids = [ids[i] for i in picked]
+
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT COUNT(*) FROM users
-        WHERE is_approved = 1 AND is_admin = 0
-    """)
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
+    placeholders = ", ".join("?" * len(picked_ids))
+    rows = conn.execute(f"""
+        SELECT {RECIPE_CARD_COLUMNS}
+        FROM recipes r
+        WHERE r.id IN ({placeholders}) AND r.status = 'approved'
+    """, picked_ids).fetchall()
 
+    # Keep the random order (IN returns rows in id order)
+    by_id = {row["id"]: row for row in rows}
+    return [by_id[i] for i in picked_ids if i in by_id]
 
-def get_total_admins():
+
+def get_top_rated_recipes(k):
+    """Best rated approved recipes, read straight off the rating index."""
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1")
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
+    return conn.execute(f"""
+        SELECT {RECIPE_CARD_COLUMNS}
+        FROM recipes r
+        WHERE r.status = 'approved'
+        ORDER BY IFNULL(r.avg_rating, 0) DESC, r.id DESC
+        LIMIT ?
+    """, (k,)).fetchall()
 
-def create_user(username, email, password):
+
+SITE_STATS_TTL = int(os.environ.get("SITE_STATS_TTL", "30"))
+
+
+def _load_site_stats():
     conn = get_db_connection()
-    cur = conn.cursor()
+    row = conn.execute("""
+        SELECT total_recipes, total_users, total_admins
+        FROM site_stats
+        WHERE id = 1
+    """).fetchone()
+    if row is None:
+        return {"total_recipes": 0, "total_users": 0, "total_admins": 0}
+    return dict(row)
 
-    cur.execute("""
+
+# The site_stats row is kept exact by triggers; this cache saves even that
+# lookup and is dropped by every helper that can change one of the counts.
+# The TTL bounds how long changes made by other processes take to show.
+site_stats = CachedValue(_load_site_stats, SITE_STATS_TTL)
+
+
+def get_site_stats():
+    """All home page counters (approved recipes, users, admins) in one lookup."""
+    return site_stats.get()
+
+
+def get_total_approved_recipes():
+    return get_site_stats()["total_recipes"]
+
+
+def get_total_users():
+    return get_site_stats()["total_users"]
+
+
+def get_total_admins():
+    return get_site_stats()["total_admins"]
+
+
+def get_cache_stats():
+    return {
+        "approved_recipe_ids": approved_recipe_ids.stats(),
+        "site_stats": site_stats.stats(),
+        "ingredient_index": ingredient_index.stats(),
+    }
+
+
+def warm_caches():
+    """Load the process-wide caches now instead of on the first requests."""
+    approved_recipe_ids.get()
+    site_stats.get()
+    ingredient_index.get()
+
+
+def _invalidate_recipe_caches(recipe_ids):
+    """After recipe_ids were added, approved, edited or deleted."""
+    approved_recipe_ids.invalidate()
+    site_stats.invalidate()
+    refresh_ingredient_index(recipe_ids)
+
+def create_user(username, email, password):
+    _write("""
         INSERT INTO users (username, email, password, is_approved, is_admin)
         VALUES (?, ?, ?, 0, 0)
     """, (username, email, password))
+    site_stats.invalidate()
 
-    conn.commit()
-    conn.close()
+def update_password_hash(user_id, old_hash, new_hash):
+    """
+    Swap in a rehashed password, unless the stored hash changed meanwhile
+    (a concurrent rehash or password change wins). Returns True if swapped.
+    """
+    return _write(
+        "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+        (new_hash, user_id, old_hash),
+    ) == 1
 
 def get_user_by_email(email):
     """
@@ -76,23 +420,26 @@ def get_user_by_email(email):
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE email = ?", (email,))
     user = cur.fetchone()
-    conn.close()
     return user
 
 def add_recipe(title, ingredients, instructions, category, image_url, video_url, user_id):
     """
-    Insert a new recipe into the database.
-    The recipe will be marked as pending by default.
+    Insert a new recipe into the database and the search index.
+    The recipe will be marked as pending by default. Returns the new id.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO recipes 
-        (title, ingredients, instructions, category, image_url, video_url, user_id, delete_request, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, 0, 'pending')
-    """, (title, ingredients, instructions, category, image_url, video_url, user_id))
-    conn.commit()
-    conn.close()
+    def job(conn):
+        recipe_id = conn.execute("""
+            INSERT INTO recipes 
+            (title, ingredients, instructions, category, image_url, video_url, user_id, delete_request, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, 'pending')
+        """, (title, ingredients, instructions, category, image_url, video_url, user_id)).lastrowid
+        _fts_index(conn, "id = ?", (recipe_id,))
+        store_recipe_ingredients(conn, recipe_id, ingredients)
+        return recipe_id
+
+    recipe_id = run_write(job)
+    _recipes_changed([recipe_id])
+    return recipe_id
 
 def get_approved_recipes_with_user():
     """
@@ -107,7 +454,6 @@ def get_approved_recipes_with_user():
         WHERE recipes.status = 'approved'
     """)
     recipes = cur.fetchall()
-    conn.close()
     return recipes
 
 def get_recipe_by_id(recipe_id):
@@ -123,7 +469,6 @@ def get_recipe_by_id(recipe_id):
         WHERE recipes.id = ?
     """, (recipe_id,))
     recipe = cur.fetchone()
-    conn.close()
     return recipe
 
 
@@ -141,7 +486,6 @@ def get_reviews_by_recipe(recipe_id):
         ORDER BY created_at DESC
     """, (recipe_id,))
     reviews = cur.fetchall()
-    conn.close()
     return reviews
 
 
@@ -153,27 +497,29 @@ def get_rating_data(recipe_id):
     cur = conn.cursor()
     cur.execute("""
         SELECT 
-            ROUND(AVG(rating), 1) AS avg_rating,
-            COUNT(*) AS total_reviews
-        FROM reviews
-        WHERE recipe_id = ?
+            ROUND(avg_rating, 1) AS avg_rating,
+            rating_count AS total_reviews
+        FROM recipes
+        WHERE id = ?
     """, (recipe_id,))
     data = cur.fetchone()
-    conn.close()
     return data
 
 def add_review(recipe_id, user_id, rating, comment=""):
     """
-    Insert a review for a recipe.
+    Insert a review for a recipe and fold it into the recipe's rating aggregates.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO reviews (recipe_id, user_id, rating, comment)
-        VALUES (?, ?, ?, ?)
-    """, (recipe_id, user_id, rating, comment))
-    conn.commit()
-    conn.close()
+    rating = int(rating)
+
+    def job(conn):
+        conn.execute("""
+            INSERT INTO reviews (recipe_id, user_id, rating, comment)
+            VALUES (?, ?, ?, ?)
+        """, (recipe_id, user_id, rating, comment))
+        _apply_rating_delta(conn, recipe_id, rating, 1)
+
+    run_write(job)
+    _recipes_changed([recipe_id])
 
 def get_recipe_reviews(recipe_id):
     """
@@ -189,7 +535,6 @@ def get_recipe_reviews(recipe_id):
         ORDER BY created_at DESC
     """, (recipe_id,))
     reviews = cur.fetchall()
-    conn.close()
     return reviews
 
 # Fetch a single recipe by ID
@@ -198,74 +543,62 @@ def get_recipe_by_id(recipe_id):
     cur = conn.cursor()
     cur.execute("SELECT * FROM recipes WHERE id = ?", (recipe_id,))
     recipe = cur.fetchone()
-    conn.close()
     return recipe
 
 # Update a recipe
 def update_recipe(recipe_id, title, ingredients, instructions, category, image_url, video_url):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE recipes
-        SET title=?, ingredients=?, instructions=?, category=?, image_url=?, video_url=?
-        WHERE id=?
-    """, (title, ingredients, instructions, category, image_url, video_url, recipe_id))
-    conn.commit()
-    conn.close()
+    def job(conn):
+        _fts_unindex(conn, "id = ?", (recipe_id,))
+        conn.execute("""
+            UPDATE recipes
+            SET title=?, ingredients=?, instructions=?, category=?, image_url=?, video_url=?
+            WHERE id=?
+        """, (title, ingredients, instructions, category, image_url, video_url, recipe_id))
+        _fts_index(conn, "id = ?", (recipe_id,))
+        store_recipe_ingredients(conn, recipe_id, ingredients)
 
+    run_write(job)
+    refresh_ingredient_index([recipe_id])
+    _recipes_changed([recipe_id])
 
-def get_all_users_with_recipe_count():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT users.id, users.username, users.email,
-               COUNT(recipes.id) AS recipe_count
-        FROM users
-        LEFT JOIN recipes ON users.id = recipes.user_id
-        WHERE users.is_admin = 0
-        GROUP BY users.id
-    """)
-    users = cur.fetchall()
-    conn.close()
-    return users
 
-# Get all pending user approvals
-def get_pending_users():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE is_approved = 0 AND is_admin = 0")
-    users = cur.fetchall()
-    conn.close()
-    return users
+def get_all_users_with_recipe_count(before=None, after=None, limit=None):
+    """
+    One page of non-admin users (newest first) with their recipe counts.
+    Counts are looked up per shown user, not grouped over the whole table.
+    """
+    return _keyset_page("""
+        SELECT u.id, u.username, u.email,
+               (SELECT COUNT(*) FROM recipes WHERE recipes.user_id = u.id) AS recipe_count
+        FROM users u
+        WHERE u.is_admin = 0
+    """, {}, [("u.id", "id", int)], before, after, limit)
 
+# Get one page of pending user approvals
+def get_pending_users(before=None, after=None, limit=None, q=None):
+    where, params = _moderation_filter("users", q)
+    return _keyset_page(f"""
+        SELECT u.* FROM users u
+        WHERE {MODERATION_QUEUES["users"][1]}{where}
+    """, params, [("u.id", "id", int)], before, after, limit)
 
-# Get all pending recipe approval requests
-def get_pending_recipes():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT recipes.*, users.username
-        FROM recipes
-        JOIN users ON recipes.user_id = users.id
-        WHERE recipes.status = 'pending'
-    """)
-    recipes = cur.fetchall()
-    conn.close()
-    return recipes
+
+# Get one page of pending recipe approval requests
+def get_pending_recipes(before=None, after=None, limit=None, q=None, category=None):
+    where, params = _moderation_filter("recipes", q, category)
+    return _keyset_page(f"""
+        SELECT r.*, users.username
+        FROM recipes r
+        JOIN users ON r.user_id = users.id
+        WHERE {MODERATION_QUEUES["recipes"][1]}{where}
+    """, params, SORT_NEWEST, before, after, limit)
 
 def approve_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET is_approved = 1 WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    _write("UPDATE users SET is_approved = 1 WHERE id = ?", (user_id,))
+    site_stats.invalidate()
 
 def reject_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    delete_user(user_id)
 
 
 def get_user_recipes(user_id):
@@ -277,68 +610,95 @@ def get_user_recipes(user_id):
         WHERE user_id = ?
     """, (user_id,))
     recipes = cur.fetchall()
-    conn.close()
     return recipes
 
+
+MAX_USERS_PER_LOOKUP = 100
+
+
+def get_recipes_for_users(user_ids):
+    """
+    {user id: [recipe rows (id, title, category)]} for many users with one
+    grouped query on idx_recipes_user. Every requested id gets a list, empty
+    for users without recipes.
+    """
+    user_ids = [int(i) for i in user_ids][:MAX_USERS_PER_LOOKUP]
+    result = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return result
+
+    conn = get_db_connection()
+    for row in conn.execute("""
+        SELECT user_id, id, title, category
+        FROM recipes
+        WHERE user_id IN (SELECT value FROM json_each(?))
+        ORDER BY user_id, id
+    """, (json.dumps(user_ids),)):
+        result[row["user_id"]].append(row)
+    return result
+
+
+def get_recipe_owners(recipe_ids):
+    """{recipe id: user id} for the given recipes that exist."""
+    conn = get_db_connection()
+    return dict(conn.execute("""
+        SELECT id, user_id
+        FROM recipes
+        WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps([int(i) for i in recipe_ids]),)).fetchall())
+
 # Fetch single user by ID
 def get_user_by_id(user_id):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     user = cur.fetchone()
-    conn.close()
     return user
 
 # Update user details
 def update_user(user_id, username, email):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    _write("""
         UPDATE users 
         SET username = ?, email = ?
         WHERE id = ?
     """, (username, email, user_id))
-    conn.commit()
-    conn.close()
 
 # Delete a user by ID
 def delete_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    def job(conn):
+        _stage_ids(conn, "SELECT ?", (user_id,))
+        touched = _recipes_touched_by_staged_users(conn)
+        _delete_staged_users(conn)
+        return touched
+
+    touched = run_write(job)
+    _invalidate_recipe_caches(touched)
+    _recipes_changed(touched)
 
 # Delete a recipe by ID
 def delete_recipe(recipe_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: _delete_recipe_rows(conn, recipe_id))
+    _invalidate_recipe_caches([recipe_id])
+    _recipes_changed([recipe_id])
 
 # Approve a recipe by ID
 def approve_recipe(recipe_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE recipes SET status = 'approved' WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    _write("UPDATE recipes SET status = 'approved' WHERE id = ?", (recipe_id,))
+    _invalidate_recipe_caches([recipe_id])
 
 # Reject (delete) a recipe by ID
 def reject_recipe(recipe_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: _delete_recipe_rows(conn, recipe_id))
+    _invalidate_recipe_caches([recipe_id])
+    _recipes_changed([recipe_id])
 
 def update_user(user_id, username, email):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET username=?, email=? WHERE id=?", (username, email, user_id))
-    conn.commit()
-    conn.close()
+    def job(conn):
+        conn.execute("UPDATE users SET username=?, email=? WHERE id=?", (username, email, user_id))
+        return _recipes_touched_by_user(conn, user_id)
+
+    # The username is shown on every recipe and review of this user
+    _recipes_changed(run_write(job))
 
 # db/db.py
 
@@ -347,7 +707,6 @@ def get_user_by_id(user_id):
     c = conn.cursor()
     c.execute("SELECT id, username, email FROM users WHERE id = ?", (user_id,))
     user = c.fetchone()
-    conn.close()
     return user
 
 # db/db.py
@@ -357,40 +716,31 @@ def get_recipes_by_user(user_id):
     c = conn.cursor()
     c.execute("SELECT id, title, category, status FROM recipes WHERE user_id = ?", (user_id,))
     recipes = c.fetchall()
-    conn.close()
     return recipes
 
 
 # Mark a recipe for delete request
 def request_delete_recipe(recipe_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
+    _write("""
         UPDATE recipes
         SET delete_request = 1
         WHERE id = ?
     """, (recipe_id,))
-    conn.commit()
-    conn.close()
 
 
 
-# Get all recipes with pending delete requests
-def get_pending_delete_requests():
+# Get one page of recipes with pending delete requests
+def get_pending_delete_requests(before=None, after=None, limit=None, q=None, category=None):
     """
-    Fetch all recipes that have pending delete requests along with username.
+    Fetch recipes that have pending delete requests along with username.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT recipes.id, recipes.title, users.username
-        FROM recipes
-        JOIN users ON recipes.user_id = users.id
-        WHERE recipes.delete_request = 1
-    """)
-    deletes = c.fetchall()
-    conn.close()
-    return deletes
+    where, params = _moderation_filter("deletes", q, category)
+    return _keyset_page(f"""
+        SELECT r.id, r.title, users.username
+        FROM recipes r
+        JOIN users ON r.user_id = users.id
+        WHERE {MODERATION_QUEUES["deletes"][1]}{where}
+    """, params, SORT_NEWEST, before, after, limit)
 
 
 # Approve delete request (Admin)
@@ -398,11 +748,9 @@ def approve_delete_recipe(recipe_id):
     """
     Admin approves delete request and removes recipe from DB.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: _delete_recipe_rows(conn, recipe_id))
+    _invalidate_recipe_caches([recipe_id])
+    _recipes_changed([recipe_id])
 
 
 # Reject delete request (Admin)
@@ -410,18 +758,15 @@ def reject_delete_request(recipe_id):
     """
     Admin rejects the delete request and resets delete_request = 0.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE recipes SET delete_request = 0 WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    _write("UPDATE recipes SET delete_request = 0 WHERE id = ?", (recipe_id,))
 
 
-def get_approved_recipes_with_user():
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    c.execute("""
+def get_approved_recipes_with_user(before=None, after=None, limit=None, sort="newest"):
+    """
+    One page of approved recipes with creator and rating, newest first
+    or (sort="top") best rated first.
+    """
+    return _keyset_page("""
         SELECT
             r.id,
             r.title,
@@ -429,16 +774,578 @@ def get_approved_recipes_with_user():
             r.category,
             r.status,
             u.username AS creator_username,
-            ROUND(AVG(rv.rating), 1) AS avg_rating,
-            COUNT(rv.id) AS total_reviews
+            ROUND(r.avg_rating, 1) AS avg_rating,
+            r.rating_count AS total_reviews,
+            IFNULL(r.avg_rating, 0) AS sort_rating
         FROM recipes r
         JOIN users u ON r.user_id = u.id
-        LEFT JOIN reviews rv ON r.id = rv.recipe_id
         WHERE r.status = 'approved'
-        GROUP BY r.id
-        ORDER BY r.id DESC
+    """, {}, RECIPE_SORTS.get(sort, SORT_NEWEST), before, after, limit)
+
+
+# ---------------------------------------------
+# JSON API QUERIES
+# ---------------------------------------------
+
+def get_public_recipe(recipe_id):
+    """One approved recipe with its creator and rating (None if not public)."""
+    conn = get_db_connection()
+    return conn.execute("""
+        SELECT r.id, r.title, r.ingredients, r.instructions, r.category,
+               r.image_url, r.video_url,
+               u.username AS creator_username,
+               ROUND(r.avg_rating, 1) AS avg_rating,
+               r.rating_count AS total_reviews
+        FROM recipes r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.id = ? AND r.status = 'approved'
+    """, (recipe_id,)).fetchone()
+
+
+def get_reviews_page(recipe_id, before=None, after=None, limit=None):
+    """One page of a recipe's reviews, newest first."""
+    return _keyset_page("""
+        SELECT rv.id, rv.rating, rv.comment, rv.created_at,
+               u.username AS username
+        FROM reviews rv
+        JOIN users u ON u.id = rv.user_id
+        WHERE rv.recipe_id = :recipe_id
+    """, {"recipe_id": recipe_id}, [("rv.id", "id", int)], before, after, limit)
+
+
+# ---------------------------------------------
+# ROW VERSIONS / CHANGE FEED
+# ---------------------------------------------
+# Triggers (migration 9) stamp every insert/update on recipes, users and
+# reviews with the next value of change_counter; deletes leave a tombstone.
+
+CHANGE_FEED_LIMIT = 500
+
+
+def get_change_version():
+    """The latest version handed out - changes whenever anything changes."""
+    conn = get_db_connection()
+    return conn.execute("SELECT version FROM change_counter WHERE id = 1").fetchone()[0]
+
+
+def get_recipe_versions(recipe_id):
+    """
+    Everything a rendered recipe depends on, as versions: the recipe row,
+    its creator and the newest of its reviews / reviewers. None if the
+    recipe doesn't exist. One indexed lookup, far cheaper than a render.
+    """
+    conn = get_db_connection()
+    return conn.execute("""
+        SELECT r.status,
+               r.version,
+               u.version AS creator_version,
+               (SELECT MAX(MAX(rv.version), MAX(ru.version))
+                FROM reviews rv
+                JOIN users ru ON ru.id = rv.user_id
+                WHERE rv.recipe_id = r.id) AS reviews_version
+        FROM recipes r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.id = ?
+    """, (recipe_id,)).fetchone()
+
+
+# What each table contributes to the change feed: only what the API shows,
+# i.e. approved recipes and the reviews of approved recipes
+CHANGE_SOURCES = {
+    "recipes": "SELECT 'recipes' AS table_name, id, version, 0 AS deleted FROM recipes WHERE version > :since AND status = 'approved'",
+    "users": "SELECT 'users' AS table_name, id, version, 0 AS deleted FROM users WHERE version > :since",
+    "reviews": """
+        SELECT 'reviews' AS table_name, v.id, v.version, 0 AS deleted
+        FROM reviews v
+        JOIN recipes r ON r.id = v.recipe_id
+        WHERE v.version > :since AND r.status = 'approved'
+    """,
+}
+
+
+def get_changes_since(since, limit=None, tables=("recipes", "users", "reviews")):
+    """
+    Rows changed or deleted after version since, oldest change first:
+    (changes, next_since, has_more). Each change is a dict with table, id,
+    version and deleted; callers fetch the rows they care about. Pass
+    next_since back in to continue.
+
+    Recipes that were never approved do not appear at all; an approved
+    recipe that leaves approval comes as deleted.
+    """
+    limit = max(1, min(int(limit or CHANGE_FEED_LIMIT), CHANGE_FEED_LIMIT))
+    parts = [CHANGE_SOURCES[table] for table in tables]
+    marks = ", ".join(f"'{table}'" for table in tables)
+    parts.append(f"""
+        SELECT table_name, row_id, version, 1 FROM tombstones
+        WHERE version > :since AND table_name IN ({marks}) AND kind != 'unlisted'
     """)
 
-    recipes = c.fetchall()
-    conn.close()
-    return recipes
+    conn = get_db_connection()
+    rows = conn.execute(
+        " UNION ALL ".join(parts) + " ORDER BY version LIMIT :limit",
+        {"since": int(since), "limit": limit + 1},
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    changes = [
+        {"table": row[0], "id": row[1], "version": row[2], "deleted": bool(row[3])}
+        for row in rows[:limit]
+    ]
+    next_since = changes[-1]["version"] if changes else int(since)
+    return changes, next_since, has_more
+
+
+# ---------------------------------------------
+# BATCH MODERATION
+# ---------------------------------------------
+# Each batch action takes either explicit ids (the ticked rows) or the
+# admin_requests filter ("everything matching"), stages the rows that are
+# still waiting in that queue and handles them with set-based statements
+# in one transaction. They return the number of rows affected.
+
+# queue -> (table, condition for rows waiting in it)
+MODERATION_QUEUES = {
+    "users": ("users u", "u.is_approved = 0 AND u.is_admin = 0"),
+    "recipes": ("recipes r", "r.status = 'pending'"),
+    "deletes": ("recipes r", "r.delete_request = 1"),
+}
+
+
+def _moderation_filter(queue, q=None, category=None):
+    """Extra WHERE conditions for the admin_requests filter of one queue."""
+    sql, params = "", {}
+    if q:
+        params["q"] = f"%{q}%"
+        if queue == "users":
+            sql += " AND (u.username LIKE :q OR u.email LIKE :q)"
+        else:
+            sql += " AND r.title LIKE :q"
+    if category and queue != "users":
+        sql += " AND r.category = :category"
+        params["category"] = category
+    return sql, params
+
+
+def _stage_moderation(conn, queue, ids=None, q=None, category=None):
+    table, waiting = MODERATION_QUEUES[queue]
+    alias = table.split()[1]
+    select = f"SELECT {alias}.id FROM {table} WHERE {waiting}"
+    if ids is not None:
+        # One bound JSON array instead of thousands of "?" placeholders
+        select += f" AND {alias}.id IN (SELECT value FROM json_each(:ids))"
+        params = {"ids": json.dumps([int(i) for i in ids])}
+    else:
+        where, params = _moderation_filter(queue, q, category)
+        select += where
+    return _stage_ids(conn, select, params)
+
+
+def count_pending(queue, q=None, category=None):
+    """How many rows an "all matching" action on this queue would touch."""
+    table, waiting = MODERATION_QUEUES[queue]
+    where, params = _moderation_filter(queue, q, category)
+    conn = get_db_connection()
+    return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {waiting}{where}", params).fetchone()[0]
+
+
+def approve_users(ids=None, q=None, category=None):
+    def job(conn):
+        _stage_moderation(conn, "users", ids, q)
+        return conn.execute(f"UPDATE users SET is_approved = 1 WHERE id IN {STAGED_IDS}").rowcount
+
+    count = run_write(job)
+    site_stats.invalidate()
+    return count
+
+
+def reject_users(ids=None, q=None, category=None):
+    def job(conn):
+        _stage_moderation(conn, "users", ids, q)
+        touched = _recipes_touched_by_staged_users(conn)
+        return _delete_staged_users(conn), touched
+
+    count, touched = run_write(job)
+    _invalidate_recipe_caches(touched)
+    _recipes_changed(touched)
+    return count
+
+
+def approve_recipes(ids=None, q=None, category=None):
+    def job(conn):
+        staged = _stage_moderation(conn, "recipes", ids, q, category)
+        count = conn.execute(f"""
+            UPDATE recipes SET status = 'approved' WHERE id IN {STAGED_IDS}
+        """).rowcount
+        return count, staged
+
+    count, staged = run_write(job)
+    _invalidate_recipe_caches(staged)
+    _recipes_changed(staged)
+    return count
+
+
+def reject_recipes(ids=None, q=None, category=None):
+    def job(conn):
+        staged = _stage_moderation(conn, "recipes", ids, q, category)
+        return _delete_staged_recipes(conn), staged
+
+    count, staged = run_write(job)
+    _invalidate_recipe_caches(staged)
+    _recipes_changed(staged)
+    return count
+
+
+def approve_delete_requests(ids=None, q=None, category=None):
+    def job(conn):
+        staged = _stage_moderation(conn, "deletes", ids, q, category)
+        return _delete_staged_recipes(conn), staged
+
+    count, staged = run_write(job)
+    _invalidate_recipe_caches(staged)
+    _recipes_changed(staged)
+    return count
+
+
+def reject_delete_requests(ids=None, q=None, category=None):
+    def job(conn):
+        _stage_moderation(conn, "deletes", ids, q, category)
+        return conn.execute(f"""
+            UPDATE recipes SET delete_request = 0 WHERE id IN {STAGED_IDS}
+        """).rowcount
+
+    return run_write(job)
+
+
+# queue -> action -> helper, for the batch endpoint
+BATCH_ACTIONS = {
+    "users": {"approve": approve_users, "reject": reject_users},
+    "recipes": {"approve": approve_recipes, "reject": reject_recipes},
+    "deletes": {"approve": approve_delete_requests, "reject": reject_delete_requests},
+}
+
+
+# ---------------------------------------------
+# SEARCH
+# ---------------------------------------------
+
+# Matches ranked per query. A broad query (a short prefix such as "ch"
+# matches most of the catalogue) ranks only its newest SEARCH_CANDIDATES
+# matches, so its cost stays flat however large the catalogue grows.
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", "1000"))
+
+# Score per column a query word starts a word in. Instructions carry no
+# weight: every candidate matched somewhere.
+SEARCH_WEIGHTS = (
+    ("r.title", 10.0),
+    ("replace(r.ingredients, char(10), ' ')", 4.0),
+    ("r.category", 2.0),
+)
+
+# Best match first; pages are keyset-paged on (score, id) like the listings
+SORT_RELEVANCE = [("scored.score", "score", float), ("scored.id", "id", int)]
+
+# Control characters around highlighted terms; the web layer escapes the
+# text first and only then turns these into <mark> tags.
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+
+def _search_words(text):
+    return re.findall(r"\w+", text.lower())[:8]
+
+
+def _fts_query(words):
+    """
+    Turn the words of a query into a safe FTS5 query that needs all of
+    them. Words of two or three letters are prefixes ("ch"* matches
+    chicken), answered by the table's prefix index; longer words and
+    single letters match whole words. A longer prefix would make FTS5
+    merge the doclists of every word it starts.
+    """
+    return " ".join(f'"{word}"*' if 2 <= len(word) <= 3 else f'"{word}"' for word in words)
+
+
+def search_recipes(text, before=None, after=None, limit=None):
+    """
+    Relevance-ranked search over approved recipes: a word at the start of a
+    word in the title weighs most, then ingredients and category. Returns
+    a Page of card rows that also carry title_highlighted and snippet.
+    """
+    words = _search_words(text or "")
+    if not words:
+        return Page([])
+
+    # Scored on the candidates only - bm25() would first walk the whole
+    # doclist of every term for its IDF. The sorter holds two numbers per
+    # candidate; the card columns are read for the page alone.
+    params = {"match": _fts_query(words), "candidates": SEARCH_CANDIDATES}
+    score = []
+    for i, word in enumerate(words):
+        params[f"w{i}"] = f"% {word}%"
+        score += [f"{weight} * (' ' || {column} LIKE :w{i})" for column, weight in SEARCH_WEIGHTS]
+
+    page = _keyset_page(f"""
+        WITH hits AS (
+            SELECT rowid AS id
+            FROM recipes_fts
+            WHERE recipes_fts MATCH :match
+            ORDER BY rowid DESC
+            LIMIT :candidates
+        ),
+        scored AS (
+            SELECT r.id, r.status, {" + ".join(score)} AS score
+            FROM hits
+            JOIN recipes r ON r.id = hits.id
+        )
+        SELECT scored.id, scored.score
+        FROM scored
+        WHERE scored.status = 'approved'
+    """, params, SORT_RELEVANCE, before, after, limit)
+    if not page.rows:
+        return page
+
+    ids = [row["id"] for row in page.rows]
+    conn = get_db_connection()
+    cards = {row["id"]: row for row in conn.execute(f"""
+        SELECT {RECIPE_CARD_COLUMNS}
+        FROM recipes r
+        WHERE r.id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(ids),))}
+
+    # Highlights and snippets only for the rows on the page, in one walk
+    # over the matches in the page's id range rather than a lookup per row.
+    # The unary + keeps FTS5 from taking the IN list as its lookup key.
+    marked = {row["rowid"]: row for row in conn.execute("""
+        SELECT
+            rowid,
+            highlight(recipes_fts, 0, :hl_start, :hl_end) AS title_highlighted,
+            snippet(recipes_fts, -1, :hl_start, :hl_end, '…', 16) AS snippet
+        FROM recipes_fts
+        WHERE recipes_fts MATCH :match
+          AND rowid BETWEEN :lowest AND :highest
+          AND +rowid IN (SELECT value FROM json_each(:ids))
+    """, {
+        "match": params["match"],
+        "hl_start": HIGHLIGHT_START,
+        "hl_end": HIGHLIGHT_END,
+        "lowest": min(ids),
+        "highest": max(ids),
+        "ids": json.dumps(ids),
+    })}
+
+    rows = []
+    for row in page.rows:
+        card = cards.get(row["id"])
+        if card is None:
+            continue  # deleted in between
+        found = marked.get(row["id"])  # None if it changed in between: shown plain
+        rows.append(dict(
+            card,
+            score=row["score"],
+            title_highlighted=found["title_highlighted"] if found else card["title"],
+            snippet=found["snippet"] if found else "",
+        ))
+    page.rows = rows
+    return page
+
+
+# ---------------------------------------------
+# WHAT CAN I COOK
+# ---------------------------------------------
+
+def what_can_i_cook(pantry, require=(), limit=20):
+    """
+    Recipes ranked by how well the pantry list covers their ingredients,
+    each with card columns plus covered/total/coverage/missing.
+    """
+    matches = ingredient_index.get().cook(pantry, require=require, limit=limit)
+    if not matches:
+        return []
+
+    conn = get_db_connection()
+    placeholders = ", ".join("?" * len(matches))
+    rows = conn.execute(f"""
+        SELECT {RECIPE_CARD_COLUMNS}
+        FROM recipes r
+        WHERE r.id IN ({placeholders}) AND r.status = 'approved'
+    """, [m["id"] for m in matches]).fetchall()
+    by_id = {row["id"]: row for row in rows}
+
+    return [dict(by_id[m["id"]], **m) for m in matches if m["id"] in by_id]
+
+
+def suggest_ingredients(prefix, limit=10):
+    return ingredient_index.get().suggest(prefix, limit)
+
+
+# ---------------------------------------------
+# BULK IMPORT / EXPORT
+# ---------------------------------------------
+# Used by db/bulk.py. One call = one chunk = one write transaction.
+
+RECIPE_IMPORT_COLUMNS = (
+    "title", "ingredients", "instructions", "category", "image_url", "video_url", "status",
+)
+
+
+def _resolve_owners(conn, recipes, default_user_id):
+    """Map each recipe's user_id / user_email to a user id with one query per kind."""
+    emails = {r["user_email"] for r in recipes if r.get("user_email")}
+    ids = {r["user_id"] for r in recipes if r.get("user_id") is not None}
+
+    by_email = {}
+    if emails:
+        marks = ",".join("?" * len(emails))
+        by_email = dict(conn.execute(
+            f"SELECT email, id FROM users WHERE email IN ({marks})", list(emails)
+        ).fetchall())
+    known_ids = set()
+    if ids:
+        marks = ",".join("?" * len(ids))
+        known_ids = {row[0] for row in conn.execute(
+            f"SELECT id FROM users WHERE id IN ({marks})", list(ids)
+        )}
+
+    owners = []
+    for r in recipes:
+        if r.get("user_id") is not None:
+            owners.append(r["user_id"] if r["user_id"] in known_ids else None)
+        elif r.get("user_email"):
+            owners.append(by_email.get(r["user_email"]))
+        else:
+            owners.append(default_user_id)
+    return owners
+
+
+def import_recipe_chunk(recipes, default_user_id=None):
+    """
+    Insert a chunk of validated recipe dicts in one transaction and bring
+    the search and ingredient indexes up to date with set-based statements.
+    Each dict carries its normalized "ingredient_names" (worked out before
+    the write lock is taken).
+    Returns (inserted, rejected) where rejected is a list of
+    (position in chunk, reason) for rows whose owner could not be resolved.
+    """
+    def job(conn):
+        owners = _resolve_owners(conn, recipes, default_user_id)
+        rows, kept, rejected = [], [], []
+        for position, (recipe, owner) in enumerate(zip(recipes, owners)):
+            if owner is None:
+                rejected.append((position, "unknown owner"))
+                continue
+            rows.append([recipe.get(col) for col in RECIPE_IMPORT_COLUMNS] + [owner])
+            kept.append(recipe)
+        if not rows:
+            return 0, rejected, []
+
+        # Each insert reports its own id: with DB_WRITE_QUEUE=0 other
+        # connections may insert recipes in between, so ids need not be
+        # consecutive
+        insert = f"""
+            INSERT INTO recipes ({", ".join(RECIPE_IMPORT_COLUMNS)}, user_id, delete_request)
+            VALUES ({", ".join("?" * len(RECIPE_IMPORT_COLUMNS))}, ?, 0)
+            RETURNING id
+        """
+        new_ids = [conn.execute(insert, row).fetchone()[0] for row in rows]
+
+        _fts_index(conn, "id IN (SELECT value FROM json_each(?))", (json.dumps(new_ids),))
+        conn.executemany(
+            "INSERT OR IGNORE INTO recipe_ingredients (recipe_id, ingredient) VALUES (?, ?)",
+            ((recipe_id, name)
+             for recipe_id, recipe in zip(new_ids, kept)
+             for name in recipe["ingredient_names"]),
+        )
+        return len(rows), rejected, new_ids
+
+    inserted, rejected, new_ids = run_write(job)
+    _invalidate_recipe_caches(new_ids)
+    _recipes_changed(new_ids)
+    return inserted, rejected
+
+
+def iter_recipes_for_export(status=None, batch_size=1000):
+    """
+    Yield every recipe (optionally only one status) with its creator's
+    username/email, in id order. Rows are fetched batch_size at a time
+    from one read snapshot, so memory stays flat however big the catalogue is.
+    """
+    conn = get_db_connection()
+    where = "WHERE r.status = ?" if status else ""
+    cur = conn.execute(f"""
+        SELECT r.id, r.title, r.ingredients, r.instructions, r.category,
+               r.image_url, r.video_url, r.status,
+               u.username AS username, u.email AS user_email,
+               ROUND(r.avg_rating, 2) AS avg_rating, r.rating_count
+        FROM recipes r
+        LEFT JOIN users u ON u.id = r.user_id
+        {where}
+        ORDER BY r.id
+    """, (status,) if status else ())
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+# ---------------------------------------------
+# REPAIR / BACKFILL
+# ---------------------------------------------
+
+def repair_rating_aggregates():
+    """
+    Recompute rating_sum / rating_count / avg_rating for every recipe from
+    the reviews table. Returns the number of recipes whose values changed.
+    """
+    return _write("""
+        UPDATE recipes
+        SET rating_sum = agg.rating_sum,
+            rating_count = agg.rating_count,
+            avg_rating = agg.avg_rating
+        FROM (
+            SELECT r.id,
+                   COALESCE(SUM(rv.rating), 0) AS rating_sum,
+                   COUNT(rv.id) AS rating_count,
+                   AVG(rv.rating) AS avg_rating
+            FROM recipes r
+            LEFT JOIN reviews rv ON rv.recipe_id = r.id
+            GROUP BY r.id
+        ) AS agg
+        WHERE recipes.id = agg.id
+          AND (recipes.rating_sum != agg.rating_sum
+               OR recipes.rating_count != agg.rating_count
+               OR recipes.avg_rating IS NOT agg.avg_rating)
+    """)
+
+
+def repair_site_stats():
+    """Recount the site_stats row from the base tables."""
+    _write("""
+        INSERT OR REPLACE INTO site_stats (id, total_recipes, total_users, total_admins)
+        VALUES (
+            1,
+            (SELECT COUNT(*) FROM recipes WHERE status = 'approved'),
+            (SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_admin = 0),
+            (SELECT COUNT(*) FROM users WHERE is_admin = 1)
+        )
+    """)
+    site_stats.invalidate()
+
+
+def rebuild_search_index():
+    """Rebuild recipes_fts from the recipes table (only needed after repairs)."""
+    _write("INSERT INTO recipes_fts(recipes_fts) VALUES ('rebuild')")
+
+
+def rebuild_ingredient_index():
+    """Re-normalize every recipe's ingredients into recipe_ingredients."""
+    def job(conn):
+        rows = conn.execute("SELECT id, ingredients FROM recipes").fetchall()
+        for row in rows:
+            store_recipe_ingredients(conn, row["id"], row["ingredients"])
+        return len(rows)
+
+    count = run_write(job)
+    ingredient_index.invalidate()
+    return count
@@ -0,0 +1,51 @@
+import time
+
+from db.connection import get_db_connection, run_write
+
+
+# ---------------------------------------------
+# IMAGE INDEX
+# ---------------------------------------------
+# Which remote image URLs have been copied into the local image store
+# (migration 11). Rows are 'stored' with the digest of the original, or
+# 'failed' with the error, to be retried after a while.
+
+def get_image(url):
+    """The images row for url (digest, status, error, fetched_at), or None."""
+    conn = get_db_connection()
+    return conn.execute(
+        "SELECT digest, status, error, fetched_at FROM images WHERE url = ?", (url,)
+    ).fetchone()
+
+
+def record_image(url, digest):
+    run_write(lambda conn: conn.execute("""
+        INSERT OR REPLACE INTO images (url, digest, status, error, fetched_at)
+        VALUES (?, ?, 'stored', NULL, ?)
+    """, (url, digest, time.time())))
+
+
+def record_image_failure(url, error):
+    run_write(lambda conn: conn.execute("""
+        INSERT OR REPLACE INTO images (url, digest, status, error, fetched_at)
+        VALUES (?, NULL, 'failed', ?, ?)
+    """, (url, str(error)[:500], time.time())))
+
+
+def get_unfetched_image_urls(retry_before):
+    """Recipe image URLs never fetched, or failed before retry_before."""
+    conn = get_db_connection()
+    return [row[0] for row in conn.execute("""
+        SELECT DISTINCT r.image_url
+        FROM recipes r
+        LEFT JOIN images i ON i.url = r.image_url
+        WHERE r.image_url IS NOT NULL AND r.image_url != ''
+          AND (i.url IS NULL OR (i.status = 'failed' AND i.fetched_at < ?))
+    """, (retry_before,))]
+
+
+def get_image_counts():
+    conn = get_db_connection()
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT status, COUNT(*) FROM images GROUP BY status"
+    )}
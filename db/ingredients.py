@@ -0,0 +1,362 @@
+import bisect
+import json
+import os
+import re
+import threading
+from array import array
+from itertools import compress
+
+from cache import CachedValue
+from db.connection import get_db_connection
+
+
+# ---------------------------------------------
+# NORMALIZATION
+# ---------------------------------------------
+# "2 cups of finely chopped Red Onions (about 2)" -> "red onion"
+
+UNITS = {
+    "cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "tbs", "tbl",
+    "teaspoon", "teaspoons", "tsp", "ounce", "ounces", "oz", "pound",
+    "pounds", "lb", "lbs", "gram", "grams", "g", "kg", "kilogram",
+    "kilograms", "ml", "milliliter", "milliliters", "l", "liter", "liters",
+    "litre", "litres", "pint", "pints", "quart", "quarts", "gallon",
+    "clove", "cloves", "pinch", "pinches", "dash", "dashes", "can", "cans",
+    "package", "packages", "packet", "stick", "sticks", "slice", "slices",
+    "piece", "pieces", "bunch", "bunches", "handful", "sprig", "sprigs",
+    "head", "heads", "jar", "jars", "bottle", "drop", "drops", "inch",
+}
+
+DESCRIPTORS = {
+    "of", "a", "an", "the", "and", "or", "to", "for", "taste", "about",
+    "fresh", "freshly", "chopped", "finely", "roughly", "coarsely", "diced",
+    "minced", "sliced", "thinly", "grated", "shredded", "crushed", "ground",
+    "large", "medium", "small", "whole", "boneless", "skinless", "peeled",
+    "beaten", "melted", "softened", "cooked", "uncooked", "raw", "dried",
+    "frozen", "optional", "divided", "packed", "heaping", "level", "cubed",
+    "halved", "quartered", "rinsed", "drained", "room", "temperature", "cold",
+    "warm", "hot", "extra", "virgin", "some", "few", "more", "plus",
+}
+
+# Words whose trailing "s" is not a plural
+NOT_PLURAL = {"asparagus", "couscous", "hummus", "molasses", "swiss", "citrus", "bass", "grass"}
+
+_QUANTITY = re.compile(r"[\d¼½¾⅓⅔⅛/.\-–]+")
+_QUANTITY_WITH_UNIT = re.compile(r"[\d¼½¾⅓⅔⅛/.]+([a-z]+)")  # "200g", "2tbsp"
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+
+
+def singularize(word):
+    if word in NOT_PLURAL or len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_ingredient(item):
+    """Reduce one ingredient line to its normalized name, or None."""
+    item = _PARENTHETICAL.sub(" ", item.lower())
+    item = item.split(" for ")[0]
+    words = []
+    for word in re.findall(r"[a-z\d¼½¾⅓⅔⅛/.\-–]+", item):
+        word = word.strip(".-–")
+        if not word or _QUANTITY.fullmatch(word) or word in UNITS or word in DESCRIPTORS:
+            continue
+        unit = _QUANTITY_WITH_UNIT.fullmatch(word)
+        if unit and unit.group(1) in UNITS:
+            continue
+        words.append(singularize(word))
+    return " ".join(words) or None
+
+
+def normalize_ingredients(text):
+    """Split a free-text ingredient list and normalize each entry (no duplicates)."""
+    names = []
+    for item in re.split(r"[\n,;•]+|\band\b|&", text or ""):
+        name = normalize_ingredient(item)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def store_recipe_ingredients(conn, recipe_id, text):
+    """Replace the recipe_ingredients rows of one recipe (inside a write job)."""
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+    conn.executemany(
+        "INSERT INTO recipe_ingredients (recipe_id, ingredient) VALUES (?, ?)",
+        [(recipe_id, name) for name in normalize_ingredients(text)],
+    )
+
+
+# ---------------------------------------------
+# INVERTED INDEX
+# ---------------------------------------------
+
+def _to_bitmap(positions):
+    """Build an int bitset in one pass (OR-ing shifted ints one by one is quadratic)."""
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for pos in positions:
+        data[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(data, "little")
+
+
+# byte value -> positions of its set bits
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class IngredientIndex:
+    """
+    In-memory inverted index over approved recipes.
+
+    postings:  ingredient -> sorted array of recipe ids
+    bitmaps:   ingredient -> int bitset over dense recipe positions, used
+               for fast AND/OR of whole posting lists
+    recipe_ingredients: recipe id -> tuple of its ingredient names
+    by_total:  ingredient count -> bitset of the recipes with that many
+
+    replace() patches one recipe in place. Positions of removed recipes
+    are left unused and new recipes get the next free one, so the bitmaps
+    of everything else stay valid.
+    """
+
+    def __init__(self, pairs):
+        by_ingredient = {}
+        by_recipe = {}
+        for recipe_id, ingredient in pairs:
+            by_ingredient.setdefault(ingredient, []).append(recipe_id)
+            by_recipe.setdefault(recipe_id, []).append(ingredient)
+
+        self.recipe_ids = array("q", sorted(by_recipe))
+        self.position = {recipe_id: i for i, recipe_id in enumerate(self.recipe_ids)}
+
+        self.postings = {}
+        self.bitmaps = {}
+        for ingredient, ids in by_ingredient.items():
+            ids.sort()
+            self.postings[ingredient] = array("q", ids)
+            self.bitmaps[ingredient] = _to_bitmap(self.position[recipe_id] for recipe_id in ids)
+
+        self.recipe_ingredients = {rid: tuple(names) for rid, names in by_recipe.items()}
+        sizes = {}
+        for recipe_id, names in by_recipe.items():
+            sizes.setdefault(len(names), []).append(self.position[recipe_id])
+        self.by_total = {total: _to_bitmap(positions) for total, positions in sizes.items()}
+        self.vocabulary = sorted(self.postings)
+
+        # word -> ingredient names containing it, so "chicken" finds "chicken breast"
+        self.words = {}
+        for ingredient in self.vocabulary:
+            for word in ingredient.split():
+                self.words.setdefault(word, []).append(ingredient)
+        self._lock = threading.Lock()
+
+    def replace(self, recipe_id, names):
+        """Re-index one recipe under its current ingredient names (none: drop it)."""
+        with self._lock:
+            old = self.recipe_ingredients.get(recipe_id)
+            if old is not None:
+                bit = 1 << self.position[recipe_id]
+                for name in old:
+                    self.bitmaps[name] &= ~bit
+                    postings = self.postings[name]
+                    del postings[bisect.bisect_left(postings, recipe_id)]
+                self.by_total[len(old)] &= ~bit
+                # Readers skip ids without ingredients, so this goes last
+                del self.recipe_ingredients[recipe_id]
+            if not names:
+                return
+
+            position = self.position.get(recipe_id)
+            if position is None:
+                position = self.position[recipe_id] = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+            self.recipe_ingredients[recipe_id] = tuple(names)
+            bit = 1 << position
+            for name in names:
+                if name not in self.postings:
+                    self.postings[name] = array("q")
+                    self.bitmaps[name] = 0
+                    bisect.insort(self.vocabulary, name)
+                    for word in name.split():
+                        self.words.setdefault(word, []).append(name)
+                bisect.insort(self.postings[name], recipe_id)
+                self.bitmaps[name] |= bit
+            self.by_total[len(names)] = self.by_total.get(len(names), 0) | bit
+
+    def expand(self, term):
+        """All indexed ingredient names a pantry term stands for."""
+        name = normalize_ingredient(term)
+        if not name:
+            return set()
+
+        words = name.split()
+        candidates = set(self.words.get(words[0], ()))
+        for word in words[1:]:
+            candidates &= set(self.words.get(word, ()))
+        return {c for c in candidates if f" {name} " in f" {c} "}
+
+    @staticmethod
+    def _bitmap(names, bitmaps):
+        bitmap = 0
+        for name in names:
+            bitmap |= bitmaps.get(name, 0)
+        return bitmap
+
+    def _ids(self, bitmap):
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        recipe_ids = self.recipe_ids
+        # compress() skips the zero bytes in C; only set bits cost Python time
+        return [
+            recipe_ids[index * 8 + bit]
+            for index in compress(range(len(data)), data)
+            for bit in _BYTE_BITS[data[index]]
+        ]
+
+    def cook(self, pantry, require=(), limit=20):
+        """
+        Rank recipes by how much of their ingredient list the pantry covers.
+        Every term in require must be covered. Returns dicts sorted by fewest
+        missing ingredients, then highest coverage.
+        """
+        have = set()
+        for term in pantry:
+            have |= self.expand(term)
+        if not have:
+            return []
+        required = [self.expand(term) for term in require]
+
+        # replace() may add keys meanwhile: work on a snapshot of what is read
+        with self._lock:
+            bitmaps = {name: self.bitmaps.get(name, 0) for name in have.union(*required)}
+            totals = list(self.by_total.items())
+
+        candidates = self._bitmap(have, bitmaps)
+        for names in required:
+            candidates &= self._bitmap(names, bitmaps)
+        if not candidates:
+            return []
+
+        # How many pantry ingredients each recipe has, as a bit-sliced
+        # counter: bit i of the count for position p is bit p of planes[i].
+        # Everything up to picking the results is whole-bitmap arithmetic.
+        planes = []
+        for name in have:
+            carry = bitmaps[name]
+            for i, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[i], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+
+        def covering(count, mask):
+            """The positions in mask whose count is exactly count."""
+            if count >> len(planes):
+                return 0
+            for i, plane in enumerate(planes):
+                mask &= plane if count >> i & 1 else ~plane
+                if not mask:
+                    break
+            return mask
+
+        # Rank order is fewest missing, then (at equal missing) the longest
+        # ingredient list, then id - so walk the groups in exactly that order
+        # and stop once limit recipes are found
+        groups = sorted(
+            ((total, candidates & bitmap) for total, bitmap in totals),
+            reverse=True,
+        )
+        groups = [(total, mask) for total, mask in groups if mask]
+        results = []
+        for missing in range(groups[0][0] if groups else 0):
+            for total, mask in groups:
+                if total <= missing:
+                    break
+                found = covering(total - missing, mask)
+                if not found:
+                    continue
+                for recipe_id in sorted(self._ids(found)):
+                    names = self.recipe_ingredients.get(recipe_id)
+                    if names is None or len(names) != total:
+                        continue  # changed by a concurrent replace()
+                    covered = total - missing
+                    results.append({
+                        "id": recipe_id,
+                        "covered": covered,
+                        "total": total,
+                        "coverage": round(covered / total, 3),
+                        "missing": [n for n in names if n not in have],
+                    })
+                    if len(results) == limit:
+                        return results
+        return results
+
+    def suggest(self, prefix, limit=10):
+        """Autocomplete: indexed ingredients starting with prefix, most used first."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        matches = [name for name in self.vocabulary[start:min(end, start + 500)] if self.postings[name]]
+        matches.sort(key=lambda name: -len(self.postings[name]))
+        return matches[:limit]
+
+
+def _load_ingredient_index():
+    conn = get_db_connection()
+    rows = conn.execute("""
+        SELECT ri.recipe_id, ri.ingredient
+        FROM recipe_ingredients ri
+        JOIN recipes r ON r.id = ri.recipe_id
+        WHERE r.status = 'approved'
+    """)
+    return IngredientIndex((row[0], row[1]) for row in rows)
+
+
+# Writes patch the index (refresh_ingredient_index), so the periodic full
+# reload is only a safety net
+INGREDIENT_INDEX_TTL = int(os.environ.get("INGREDIENT_INDEX_TTL", "3600"))
+# Above this many changed recipes a full reload is cheaper than patching
+INGREDIENT_INDEX_MAX_PATCH = int(os.environ.get("INGREDIENT_INDEX_MAX_PATCH", "5000"))
+
+ingredient_index = CachedValue(_load_ingredient_index, INGREDIENT_INDEX_TTL)
+_refresh_lock = threading.Lock()
+
+
+def refresh_ingredient_index(recipe_ids):
+    """Bring the given recipes up to date in the loaded index after a write."""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return
+    if len(recipe_ids) > INGREDIENT_INDEX_MAX_PATCH:
+        ingredient_index.invalidate()
+        return
+
+    # Serialized, so two refreshes of one recipe cannot apply out of order
+    with _refresh_lock:
+        conn = get_db_connection()
+        names = {}
+        for row in conn.execute("""
+            SELECT ri.recipe_id, ri.ingredient
+            FROM recipe_ingredients ri
+            JOIN recipes r ON r.id = ri.recipe_id
+            WHERE r.status = 'approved'
+              AND ri.recipe_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(recipe_ids),)):
+            names.setdefault(row[0], []).append(row[1])
+
+        def patch(index):
+            for recipe_id in recipe_ids:
+                index.replace(recipe_id, names.get(recipe_id, ()))
+
+        ingredient_index.update(patch)
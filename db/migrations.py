@@ -0,0 +1,434 @@
+import sqlite3
+
+from db.connection import DB_NAME, apply_storage_profile
+
+
+# ---------------------------------------------
+# MIGRATIONS
+# ---------------------------------------------
+# Each migration is (version, description, step). A step is either an SQL
+# script or a function taking the connection. The applied version is kept
+# in PRAGMA user_version, so every migration runs exactly once per DB.
+# Never edit a migration that has shipped - add a new one instead.
+
+def _initial_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_approved INTEGER DEFAULT 0,
+            is_admin INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recipes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            ingredients TEXT NOT NULL,
+            instructions TEXT NOT NULL,
+            category TEXT,
+            image_url TEXT,
+            video_url TEXT,
+            user_id INTEGER,
+            delete_request INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            rating INTEGER NOT NULL,
+            comment TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(recipe_id) REFERENCES recipes(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+
+def _recipe_ingredients(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recipe_ingredients (
+            recipe_id INTEGER NOT NULL REFERENCES recipes(id),
+            ingredient TEXT NOT NULL,
+            PRIMARY KEY (recipe_id, ingredient)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient
+            ON recipe_ingredients(ingredient, recipe_id)
+    """)
+
+    # Backfill existing recipes with the same normalizer the app uses
+    from db.ingredients import store_recipe_ingredients
+    for row in conn.execute("SELECT id, ingredients FROM recipes").fetchall():
+        store_recipe_ingredients(conn, row[0], row[1])
+
+
+# Tables that carry a row version, with the columns whose changes count
+VERSIONED_TABLES = {
+    "recipes": (
+        "title", "ingredients", "instructions", "category", "image_url", "video_url",
+        "user_id", "status", "delete_request", "rating_sum", "rating_count", "avg_rating",
+    ),
+    "users": ("username", "email", "is_approved", "is_admin"),
+    "reviews": ("recipe_id", "user_id", "rating", "comment"),
+}
+
+
+def _row_versions(conn):
+    """
+    Every insert, update and delete on a versioned table takes the next
+    value of one global counter, so "everything that changed since N" is a
+    single range query per table. Deletes leave a tombstone with their version.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tombstones (
+            version INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Backfill: existing rows get distinct versions in table/id order
+    version = 0
+    for table in VERSIONED_TABLES:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP")
+        ids = [row[0] for row in conn.execute(f"SELECT id FROM {table} ORDER BY id")]
+        conn.executemany(
+            f"UPDATE {table} SET version = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(version + i, row_id) for i, row_id in enumerate(ids, 1)],
+        )
+        version += len(ids)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_version ON {table}(version)")
+    conn.execute("INSERT OR REPLACE INTO change_counter (id, version) VALUES (1, ?)", (version,))
+
+    bump = "UPDATE change_counter SET version = version + 1 WHERE id = 1;"
+    current = "(SELECT version FROM change_counter WHERE id = 1)"
+    for table, columns in VERSIONED_TABLES.items():
+        stamp = f"""
+            UPDATE {table} SET version = {current}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.id;
+        """
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN {bump} {stamp} END
+        """)
+        # Only the listed columns: the trigger's own UPDATE must not re-fire it
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_update
+            AFTER UPDATE OF {", ".join(columns)} ON {table}
+            BEGIN {bump} {stamp} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                {bump}
+                INSERT INTO tombstones (version, table_name, row_id)
+                VALUES ({current}, '{table}', OLD.id);
+            END
+        """)
+
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "indexes for hot query predicates", """
+        -- Partial indexes: only the rows each listing actually filters for
+        CREATE INDEX IF NOT EXISTS idx_recipes_approved
+            ON recipes(id) WHERE status = 'approved';
+        CREATE INDEX IF NOT EXISTS idx_recipes_pending
+            ON recipes(id) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS idx_recipes_delete_request
+            ON recipes(id) WHERE delete_request = 1;
+        CREATE INDEX IF NOT EXISTS idx_recipes_user
+            ON recipes(user_id);
+
+        CREATE INDEX IF NOT EXISTS idx_reviews_recipe_created
+            ON reviews(recipe_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_reviews_user
+            ON reviews(user_id);
+
+        CREATE INDEX IF NOT EXISTS idx_users_members
+            ON users(is_approved) WHERE is_admin = 0;
+        CREATE INDEX IF NOT EXISTS idx_users_members_id
+            ON users(id) WHERE is_admin = 0;
+        CREATE INDEX IF NOT EXISTS idx_users_admins
+            ON users(id) WHERE is_admin = 1;
+    """),
+    (3, "denormalized rating aggregates on recipes", """
+        ALTER TABLE recipes ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE recipes ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE recipes ADD COLUMN avg_rating REAL;
+
+        UPDATE recipes
+        SET rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE recipe_id = recipes.id),
+            rating_count = (SELECT COUNT(*) FROM reviews WHERE recipe_id = recipes.id),
+            avg_rating = (SELECT AVG(rating) FROM reviews WHERE recipe_id = recipes.id);
+    """),
+    (4, "index for the top-rated recipe listing", """
+        CREATE INDEX IF NOT EXISTS idx_recipes_approved_rating
+            ON recipes(IFNULL(avg_rating, 0), id) WHERE status = 'approved';
+    """),
+    (5, "site_stats counters maintained by triggers", """
+        -- One row holding the home page counters. Triggers keep it exact
+        -- for every write path, whichever process or helper makes it.
+        CREATE TABLE IF NOT EXISTS site_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_recipes INTEGER NOT NULL DEFAULT 0,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            total_admins INTEGER NOT NULL DEFAULT 0
+        );
+
+        INSERT OR REPLACE INTO site_stats (id, total_recipes, total_users, total_admins)
+        VALUES (
+            1,
+            (SELECT COUNT(*) FROM recipes WHERE status = 'approved'),
+            (SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_admin = 0),
+            (SELECT COUNT(*) FROM users WHERE is_admin = 1)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_recipe_insert
+        AFTER INSERT ON recipes WHEN NEW.status = 'approved'
+        BEGIN
+            UPDATE site_stats SET total_recipes = total_recipes + 1 WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_recipe_delete
+        AFTER DELETE ON recipes WHEN OLD.status = 'approved'
+        BEGIN
+            UPDATE site_stats SET total_recipes = total_recipes - 1 WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_recipe_status
+        AFTER UPDATE OF status ON recipes
+        WHEN (OLD.status = 'approved') != (NEW.status = 'approved')
+        BEGIN
+            UPDATE site_stats
+            SET total_recipes = total_recipes + (NEW.status = 'approved') - (OLD.status = 'approved')
+            WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE site_stats
+            SET total_users = total_users + (NEW.is_approved = 1 AND NEW.is_admin = 0),
+                total_admins = total_admins + (NEW.is_admin = 1)
+            WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_delete
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE site_stats
+            SET total_users = total_users - (OLD.is_approved = 1 AND OLD.is_admin = 0),
+                total_admins = total_admins - (OLD.is_admin = 1)
+            WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_update
+        AFTER UPDATE OF is_approved, is_admin ON users
+        BEGIN
+            UPDATE site_stats
+            SET total_users = total_users
+                    + (NEW.is_approved = 1 AND NEW.is_admin = 0)
+                    - (OLD.is_approved = 1 AND OLD.is_admin = 0),
+                total_admins = total_admins + (NEW.is_admin = 1) - (OLD.is_admin = 1)
+            WHERE id = 1;
+        END;
+    """),
+    (6, "full-text search index over recipes", """
+        -- External-content FTS5 table: the text lives in recipes only, the
+        -- index is kept in step by the write helpers in db/db.py. prefix=
+        -- adds prefix indexes so "chic*" style queries avoid a term scan.
+        CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+            title, ingredients, instructions, category,
+            content = 'recipes',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+
+        INSERT INTO recipes_fts(recipes_fts) VALUES ('rebuild');
+    """),
+    (7, "structured ingredient index", _recipe_ingredients),
+    (8, "email outbox", """
+        -- Outgoing mail is queued here and sent by the workers in mailer.py.
+        -- next_attempt_at (unix time) doubles as a lease: a worker pushes it
+        -- into the future when it claims a row, so a crashed worker's mail
+        -- becomes due again instead of getting lost.
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_addr TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+            ON email_outbox(next_attempt_at) WHERE status = 'pending';
+    """),
+    (9, "row versions and tombstones", _row_versions),
+    (10, "precomputed recipe similarities", """
+        -- Top-K neighbours per recipe as packed little-endian arrays:
+        -- similar_ids int32, scores float32, best first
+        CREATE TABLE IF NOT EXISTS recipe_similarity (
+            recipe_id INTEGER PRIMARY KEY,
+            similar_ids BLOB NOT NULL,
+            scores BLOB NOT NULL,
+            built_version INTEGER NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS recommender_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            built_version INTEGER NOT NULL,
+            full_build_version INTEGER NOT NULL,
+            built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (11, "locally stored recipe images", """
+        -- Remote image URL -> sha256 of the stored original (see images.py)
+        CREATE TABLE IF NOT EXISTS images (
+            url TEXT PRIMARY KEY,
+            digest TEXT,
+            status TEXT NOT NULL,
+            error TEXT,
+            fetched_at REAL NOT NULL
+        );
+    """),
+    (12, "server-side sessions", """
+        -- Session id (the only thing in the cookie) -> serialized session
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+    """),
+    (13, "email outbox expiry and cleanup", """
+        -- expires_at (unix time, NULL = never): a message still unsent by
+        -- then is given up on, e.g. an OTP past its validity.
+        -- finished_at: when it was sent or given up on; the body is cleared
+        -- at that point and the row deleted a while later.
+        ALTER TABLE email_outbox ADD COLUMN expires_at REAL;
+        ALTER TABLE email_outbox ADD COLUMN finished_at REAL;
+
+        UPDATE email_outbox SET body = '', finished_at = unixepoch()
+        WHERE status != 'pending';
+
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_finished
+            ON email_outbox(finished_at) WHERE status != 'pending';
+    """),
+    (14, "change feed limited to approved recipes", """
+        -- kind: 'deleted' - a row the API could show; 'unlisted' - a recipe
+        -- deleted before it was approved, left out of the public feed;
+        -- 'withdrawn' - an approved recipe that left approval, which the
+        -- feed reports as deleted although the row is still there.
+        ALTER TABLE tombstones ADD COLUMN kind TEXT NOT NULL DEFAULT 'deleted';
+
+        DROP TRIGGER IF EXISTS trg_version_recipes_delete;
+        CREATE TRIGGER trg_version_recipes_delete
+        AFTER DELETE ON recipes
+        BEGIN
+            UPDATE change_counter SET version = version + 1 WHERE id = 1;
+            INSERT INTO tombstones (version, table_name, row_id, kind)
+            VALUES (
+                (SELECT version FROM change_counter WHERE id = 1), 'recipes', OLD.id,
+                CASE WHEN OLD.status = 'approved' THEN 'deleted' ELSE 'unlisted' END
+            );
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_recipes_withdrawn
+        AFTER UPDATE OF status ON recipes
+        WHEN OLD.status = 'approved' AND NEW.status != 'approved'
+        BEGIN
+            UPDATE change_counter SET version = version + 1 WHERE id = 1;
+            INSERT INTO tombstones (version, table_name, row_id, kind)
+            VALUES ((SELECT version FROM change_counter WHERE id = 1), 'recipes', NEW.id, 'withdrawn');
+        END;
+    """),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_name=None, target=None):
+    """
+    Apply every pending migration up to target (default: latest).
+    Returns the list of versions that were applied.
+    """
+    conn = sqlite3.connect(db_name or DB_NAME, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    apply_storage_profile(conn)
+    applied = []
+
+    try:
+        for version, description, step in MIGRATIONS:
+            if target is not None and version > target:
+                break
+
+            # BEGIN IMMEDIATE + re-check so parallel workers starting up
+            # at the same time don't apply the same migration twice
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if get_schema_version(conn) >= version:
+                    conn.execute("COMMIT")
+                    continue
+
+                if callable(step):
+                    step(conn)
+                else:
+                    for statement in _split_script(step):
+                        conn.execute(statement)
+
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            applied.append(version)
+            print(f"Applied migration {version}: {description}")
+    finally:
+        conn.close()
+
+    return applied
+
+
+def _split_script(script):
+    """Split an SQL script into statements (executescript would auto-commit)."""
+    statements = []
+    current = ""
+    for line in script.splitlines(keepends=True):
+        if line.strip().startswith("--"):
+            continue
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
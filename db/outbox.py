@@ -0,0 +1,103 @@
+import time
+
+from db.connection import get_db_connection, run_write
+
+
+# ---------------------------------------------
+# EMAIL OUTBOX
+# ---------------------------------------------
+# Queue table for outgoing mail (see migrations 8 and 13). Rows go
+# pending -> sent, or pending -> failed once they run out of attempts or
+# pass their expires_at. Finished rows keep no body (it may hold an OTP)
+# and are deleted by delete_finished_emails.
+
+def enqueue_email(to_addr, subject, body, expires_at=None):
+    """Queue one message for delivery and return its outbox id."""
+    return run_write(lambda conn: conn.execute("""
+        INSERT INTO email_outbox (to_addr, subject, body, next_attempt_at, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (to_addr, subject, body, time.time(), expires_at)).lastrowid)
+
+
+def claim_due_emails(limit, lease):
+    """
+    Claim up to limit due messages for lease seconds and return them.
+    The claim happens in one write transaction, so two workers (or two
+    processes) never get the same row. Messages past their expires_at
+    are given up on first instead of sent late.
+    """
+    now = time.time()
+    params = {"now": now, "lease_until": now + lease, "limit": limit}
+
+    def claim(conn):
+        conn.execute("""
+            UPDATE email_outbox
+            SET status = 'failed', body = '', finished_at = :now, last_error = 'expired'
+            WHERE status = 'pending' AND next_attempt_at <= :now AND expires_at <= :now
+        """, params)
+        return conn.execute("""
+            UPDATE email_outbox
+            SET next_attempt_at = :lease_until
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= :now
+                ORDER BY next_attempt_at
+                LIMIT :limit
+            )
+            RETURNING id, to_addr, subject, body, attempts, expires_at
+        """, params).fetchall()
+
+    return run_write(claim)
+
+
+def mark_emails_sent(email_ids):
+    if not email_ids:
+        return
+    run_write(lambda conn: conn.executemany("""
+        UPDATE email_outbox
+        SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP, last_error = NULL,
+            body = '', finished_at = ?
+        WHERE id = ?
+    """, [(time.time(), email_id) for email_id in email_ids]))
+
+
+def mark_email_failed(email_id, error, retry_at=None):
+    """Record a failed attempt; retry_at=None gives up on the message."""
+    run_write(lambda conn: conn.execute("""
+        UPDATE email_outbox
+        SET attempts = attempts + 1,
+            last_error = :error,
+            status = CASE WHEN :retry_at IS NULL THEN 'failed' ELSE 'pending' END,
+            next_attempt_at = COALESCE(:retry_at, next_attempt_at),
+            body = CASE WHEN :retry_at IS NULL THEN '' ELSE body END,
+            finished_at = CASE WHEN :retry_at IS NULL THEN :now END
+        WHERE id = :id
+    """, {"id": email_id, "error": str(error)[:500], "retry_at": retry_at, "now": time.time()}))
+
+
+def delete_finished_emails(before, limit=1000):
+    """Delete up to limit sent or failed messages finished before before; returns how many went."""
+    return run_write(lambda conn: conn.execute("""
+        DELETE FROM email_outbox WHERE id IN (
+            SELECT id FROM email_outbox
+            WHERE status != 'pending' AND finished_at <= ?
+            LIMIT ?
+        )
+    """, (before, limit)).rowcount)
+
+
+def get_next_email_due():
+    """Unix time the next pending message is due, or None if there is none."""
+    conn = get_db_connection()
+    row = conn.execute("""
+        SELECT MIN(next_attempt_at) FROM email_outbox WHERE status = 'pending'
+    """).fetchone()
+    return row[0]
+
+
+def get_outbox_counts():
+    conn = get_db_connection()
+    counts = {"pending": 0, "sent": 0, "failed": 0}
+    for row in conn.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status"):
+        counts[row[0]] = row[1]
+    return counts
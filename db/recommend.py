@@ -0,0 +1,433 @@
+import heapq
+import json
+import os
+import sys
+import time
+from array import array
+from collections import defaultdict
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+from db.connection import get_db_connection, run_write
+from db.db import RECIPE_CARD_COLUMNS
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+#   flask build-recommendations          refresh recipes reviewed since last time
+#   flask build-recommendations --full   recompute every recipe (e.g. nightly)
+#
+# Item-item collaborative filtering: two recipes are similar when the same
+# people rate them the same way (cosine over ratings centered on each
+# user's mean). The top RECOMMEND_K neighbours of every reviewed recipe are
+# stored in recipe_similarity, so both "similar recipes" and "recommended
+# for you" are a handful of primary key lookups at request time.
+#
+# NumPy + SciPy do the build as sparse matrix products; without them a
+# pure-Python version gives the same results, fine for small databases.
+RECOMMEND_K = int(os.environ.get("RECOMMEND_K", "20"))
+# Added to every recipe's squared norm: pulls down the similarity of
+# recipes with only a few ratings, whose scores are mostly noise
+RECOMMEND_SHRINK = float(os.environ.get("RECOMMEND_SHRINK", "10"))
+# Only each user's newest ratings count; the work grows with the square
+# of the ratings per user
+RECOMMEND_MAX_USER_RATINGS = int(os.environ.get("RECOMMEND_MAX_USER_RATINGS", "300"))
+# Upper bound on the entries of one block of the similarity product
+RECOMMEND_BLOCK_ENTRIES = int(os.environ.get("RECOMMEND_BLOCK_ENTRIES", str(10_000_000)))
+
+# Ratings above this count for a recipe's neighbours, below it against them
+RATING_NEUTRAL = 3
+# How many of a user's latest ratings their recommendations start from
+RECOMMEND_HISTORY = 50
+
+WRITE_CHUNK = 5000
+FETCH_CHUNK = 100_000
+
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, blob):
+    values = array(typecode)
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+# ---------------------------------------------
+# RATING MATRIX
+# ---------------------------------------------
+
+def _rating_rows(conn):
+    """(user_id, recipe_id, rating) of every review, oldest first."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute("SELECT user_id, recipe_id, rating FROM reviews ORDER BY id")
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK)
+        if not rows:
+            break
+        yield rows
+
+
+def load_ratings(conn):
+    """
+    The ratings the model is built from: the newest rating per user and
+    recipe, and only the user's newest RECOMMEND_MAX_USER_RATINGS.
+    NumPy: (user ids, recipe ids, ratings) arrays. Otherwise
+    {user id: {recipe id: rating}}.
+    """
+    if np is None:
+        by_user = defaultdict(dict)
+        for rows in _rating_rows(conn):
+            for user_id, recipe_id, rating in rows:
+                ratings = by_user[user_id]
+                ratings.pop(recipe_id, None)  # re-insert so dict order stays oldest first
+                ratings[recipe_id] = rating
+        cap = RECOMMEND_MAX_USER_RATINGS
+        return {
+            user_id: dict(list(ratings.items())[-cap:]) if len(ratings) > cap else ratings
+            for user_id, ratings in by_user.items()
+        }
+
+    chunks = [np.array(rows, dtype=np.int64) for rows in _rating_rows(conn)]
+    if not chunks:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+    data = np.concatenate(chunks)
+    del chunks
+    return select_ratings(data[:, 0], data[:, 1], data[:, 2])
+
+
+def select_ratings(users, recipes, ratings):
+    """The load_ratings() selection on arrays of every rating, oldest first."""
+    age = np.arange(len(users))[::-1]  # 0 = newest review
+
+    # Newest rating per (user, recipe): sort by user, recipe, newest first
+    order = np.lexsort((age, recipes, users))
+    users, recipes, ratings, age = users[order], recipes[order], ratings[order], age[order]
+    first = np.ones(len(users), dtype=bool)
+    first[1:] = (users[1:] != users[:-1]) | (recipes[1:] != recipes[:-1])
+    users, recipes, ratings, age = users[first], recipes[first], ratings[first], age[first]
+
+    # Newest RECOMMEND_MAX_USER_RATINGS per user
+    order = np.lexsort((age, users))
+    users, recipes, ratings = users[order], recipes[order], ratings[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    counts = np.diff(np.r_[starts, len(users)])
+    position = np.arange(len(users)) - np.repeat(starts, counts)
+    keep = position < RECOMMEND_MAX_USER_RATINGS
+    return users[keep], recipes[keep], ratings[keep].astype(np.float32)
+
+
+# ---------------------------------------------
+# SIMILARITIES
+# ---------------------------------------------
+
+def _neighbours_numpy(ratings, k, targets=None):
+    users, recipes, values = ratings
+    if not len(users):
+        return
+    recipe_ids, cols = np.unique(recipes, return_inverse=True)
+    _, rows = np.unique(users, return_inverse=True)
+
+    # Center on each user's mean rating
+    per_user = np.bincount(rows)
+    means = np.bincount(rows, weights=values) / per_user
+    centered = (values - means[rows]).astype(np.float32)
+    matrix = sparse.csr_matrix((centered, (rows, cols)), shape=(len(per_user), len(recipe_ids)))
+    matrix.eliminate_zeros()
+    # Scale every recipe's column to unit length (plus shrinkage) up front,
+    # so the product below is the cosine itself
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel() + RECOMMEND_SHRINK)
+    matrix = (matrix @ sparse.diags((1 / norms).astype(np.float32))).tocsr()
+    by_recipe = matrix.T.tocsr()
+
+    if targets is None:
+        targets = np.arange(len(recipe_ids))
+    else:
+        targets = np.flatnonzero(np.isin(recipe_ids, np.asarray(list(targets), dtype=np.int64)))
+
+    # Upper bound on each recipe's row of the product: the ratings of everyone who rated it
+    raters = by_recipe.copy()
+    raters.data[:] = 1
+    work = raters @ np.diff(matrix.indptr).astype(np.float64)
+
+    start = 0
+    while start < len(targets):
+        end, total = start + 1, work[targets[start]]
+        while end < len(targets) and total + work[targets[end]] <= RECOMMEND_BLOCK_ENTRIES:
+            total += work[targets[end]]
+            end += 1
+        block = targets[start:end]
+        product = (by_recipe[block] @ matrix).tocsr()
+        # Only positive similarities to other recipes are kept
+        own = np.repeat(block, np.diff(product.indptr))
+        product.data[(product.data <= 0) | (product.indices == own)] = 0
+        product.eliminate_zeros()
+        for i, col in enumerate(block):
+            lo, hi = product.indptr[i], product.indptr[i + 1]
+            others, scores = product.indices[lo:hi], product.data[lo:hi]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                others, scores = others[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            yield int(recipe_ids[col]), recipe_ids[others[order]].tolist(), scores[order].tolist()
+        start = end
+
+
+def _neighbours_python(ratings, k, targets=None):
+    centered = {}
+    raters = defaultdict(list)
+    squares = defaultdict(float)
+    for user_id, user_ratings in ratings.items():
+        mean = sum(user_ratings.values()) / len(user_ratings)
+        values = {recipe_id: rating - mean for recipe_id, rating in user_ratings.items() if rating != mean}
+        centered[user_id] = values
+        for recipe_id, value in values.items():
+            raters[recipe_id].append((user_id, value))
+            squares[recipe_id] += value * value
+
+    norms = {recipe_id: (total + RECOMMEND_SHRINK) ** 0.5 for recipe_id, total in squares.items()}
+    for recipe_id in sorted(raters if targets is None else set(targets) & raters.keys()):
+        dots = defaultdict(float)
+        for user_id, value in raters[recipe_id]:
+            for other, other_value in centered[user_id].items():
+                dots[other] += value * other_value
+        dots.pop(recipe_id, None)
+        scores = ((dot / (norms[recipe_id] * norms[other]), other) for other, dot in dots.items())
+        top = heapq.nlargest(k, (pair for pair in scores if pair[0] > 0))
+        yield recipe_id, [other for _, other in top], [score for score, _ in top]
+
+
+def compute_neighbours(ratings, k=RECOMMEND_K, targets=None):
+    """Yield (recipe id, similar ids, scores) best first, for targets (default: every rated recipe)."""
+    if np is None:
+        return _neighbours_python(ratings, k, targets)
+    return _neighbours_numpy(ratings, k, targets)
+
+
+# ---------------------------------------------
+# BUILD
+# ---------------------------------------------
+
+def _current_version(conn):
+    row = conn.execute("SELECT version FROM change_counter WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def _store(rows, version):
+    """Write (recipe id, similar ids, scores) rows, WRITE_CHUNK per transaction."""
+    def job(conn, chunk):
+        conn.executemany("""
+            INSERT OR REPLACE INTO recipe_similarity (recipe_id, similar_ids, scores, built_version)
+            VALUES (?, ?, ?, ?)
+        """, [(recipe_id, _pack("i", ids), _pack("f", scores), version) for recipe_id, ids, scores in chunk])
+
+    for start in range(0, len(rows), WRITE_CHUNK):
+        chunk = rows[start:start + WRITE_CHUNK]
+        run_write(lambda conn: job(conn, chunk))
+
+
+def _load_neighbours(conn, recipe_ids):
+    """{recipe id: [(similar id, score), ...]} as currently stored."""
+    rows = conn.execute("""
+        SELECT recipe_id, similar_ids, scores
+        FROM recipe_similarity
+        WHERE recipe_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(recipe_ids)),))
+    return {
+        row[0]: list(zip(_unpack("i", row[1]), _unpack("f", row[2])))
+        for row in rows
+    }
+
+
+def _patch_neighbours(conn, fresh, k):
+    """
+    Similarity is symmetric, so a recomputed recipe also moves in the lists
+    of its old and new neighbours: put it in (or take it out of) those
+    lists instead of recomputing them. Returns the patched rows.
+    """
+    old = _load_neighbours(conn, fresh)
+    updates = defaultdict(dict)  # neighbour -> {recomputed recipe: new score or None}
+    for recipe_id, (ids, scores) in fresh.items():
+        for other, _ in old.get(recipe_id, ()):
+            updates[other][recipe_id] = None
+        for other, score in zip(ids, scores):
+            updates[other][recipe_id] = score
+    for recipe_id in fresh:
+        updates.pop(recipe_id, None)
+
+    patched = []
+    for other, current in _load_neighbours(conn, updates).items():
+        changes = updates[other]
+        merged = [(score, neighbour) for neighbour, score in current if neighbour not in changes]
+        merged.extend((score, neighbour) for neighbour, score in changes.items() if score is not None)
+        top = heapq.nlargest(k, merged)
+        patched.append((other, [neighbour for _, neighbour in top], [score for score, _ in top]))
+    return patched
+
+
+def build_recommendations(full=False, k=RECOMMEND_K, progress=print):
+    """
+    Bring recipe_similarity up to date. The first build, and full=True,
+    recompute every reviewed recipe. Otherwise only recipes with reviews
+    added or changed since the last build are recomputed and patched into
+    their neighbours' lists; deleted recipes are dropped. Ratings shifting
+    a user's mean, and deleted reviews, only show after the next full
+    build, so run one now and then (e.g. nightly).
+    Returns {"recomputed", "patched", "removed", "seconds"}.
+    """
+    started = time.perf_counter()
+    conn = get_db_connection()
+    state = conn.execute("SELECT built_version FROM recommender_state WHERE id = 1").fetchone()
+    # Taken before reading: anything written meanwhile is picked up next time
+    version = _current_version(conn)
+    full = full or state is None
+
+    removed = []
+    if full:
+        targets = None
+    else:
+        targets = [row[0] for row in conn.execute(
+            "SELECT DISTINCT recipe_id FROM reviews WHERE version > ?", (state[0],)
+        )]
+        removed = [row[0] for row in conn.execute("""
+            SELECT row_id FROM tombstones
+            WHERE table_name = 'recipes' AND kind != 'withdrawn' AND version > ?
+        """, (state[0],))]
+
+    recomputed = patched = 0
+    if full or targets:
+        progress(f"Loading ratings ({'numpy' if np is not None else 'pure Python'})...")
+        ratings = load_ratings(conn)
+        progress(f"Computing neighbours for {'every rated recipe' if full else f'{len(targets):,} recipe(s)'}...")
+
+        if full:
+            batch = []
+            for row in compute_neighbours(ratings, k):
+                if not row[1]:
+                    continue
+                batch.append(row)
+                if len(batch) == WRITE_CHUNK:
+                    _store(batch, version)
+                    recomputed += len(batch)
+                    batch = []
+            _store(batch, version)
+            recomputed += len(batch)
+        else:
+            # Recipes with no usable ratings left get an empty list
+            fresh = {recipe_id: ([], []) for recipe_id in targets}
+            fresh.update(
+                (recipe_id, (ids, scores))
+                for recipe_id, ids, scores in compute_neighbours(ratings, k, targets)
+            )
+            # Read the neighbours' old lists before the recomputed rows replace them
+            patched_rows = _patch_neighbours(conn, fresh, k)
+            _store([(recipe_id, ids, scores) for recipe_id, (ids, scores) in fresh.items()], version)
+            _store(patched_rows, version)
+            recomputed, patched = len(fresh), len(patched_rows)
+        del ratings
+
+    def finish(conn):
+        if full:
+            # Recipes that lost all their ratings
+            conn.execute("DELETE FROM recipe_similarity WHERE built_version < ?", (version,))
+        if removed:
+            conn.execute("""
+                DELETE FROM recipe_similarity
+                WHERE recipe_id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(removed),))
+        conn.execute("""
+            INSERT INTO recommender_state (id, built_version, full_build_version, built_at)
+            VALUES (1, :version, :version, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET
+                built_version = :version,
+                full_build_version = CASE WHEN :full THEN :version ELSE full_build_version END,
+                built_at = CURRENT_TIMESTAMP
+        """, {"version": version, "full": full})
+
+    run_write(finish)
+    return {
+        "recomputed": recomputed,
+        "patched": patched,
+        "removed": len(removed),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+# ---------------------------------------------
+# QUERIES
+# ---------------------------------------------
+# Neighbours of deleted or unapproved recipes may still be stored; the
+# card query filters them out.
+
+def _recipe_cards(conn, recipe_ids, exclude_user=None):
+    """Approved recipe cards for recipe_ids, in that order."""
+    sql = f"""
+        SELECT {RECIPE_CARD_COLUMNS}
+        FROM recipes r
+        WHERE r.id IN (SELECT value FROM json_each(:ids))
+          AND r.status = 'approved'
+    """
+    if exclude_user is not None:
+        # Nothing they wrote or already rated
+        sql += """
+          AND r.user_id != :user
+          AND NOT EXISTS (SELECT 1 FROM reviews v WHERE v.recipe_id = r.id AND v.user_id = :user)
+        """
+    rows = conn.execute(sql, {"ids": json.dumps(list(recipe_ids)), "user": exclude_user}).fetchall()
+    by_id = {row["id"]: row for row in rows}
+    return [by_id[recipe_id] for recipe_id in recipe_ids if recipe_id in by_id]
+
+
+def get_similar_recipes(recipe_id, limit=6):
+    """Approved recipes most similar to this one, best first (empty until a build has run)."""
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT similar_ids FROM recipe_similarity WHERE recipe_id = ?", (recipe_id,)
+    ).fetchone()
+    if row is None:
+        return []
+    return _recipe_cards(conn, list(_unpack("i", row[0])))[:limit]
+
+
+def get_recommended_recipes(user_id, limit=6):
+    """
+    Approved recipes for a user from the neighbours of what they rated
+    lately: each neighbour scores similarity x (rating - RATING_NEUTRAL).
+    """
+    conn = get_db_connection()
+    history = {}
+    for recipe_id, rating in conn.execute("""
+        SELECT recipe_id, rating FROM reviews
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+    """, (user_id, RECOMMEND_HISTORY)):
+        history.setdefault(recipe_id, rating)  # newest rating wins
+    if not history:
+        return []
+
+    totals = defaultdict(float)
+    for recipe_id, neighbours in _load_neighbours(conn, history).items():
+        weight = history[recipe_id] - RATING_NEUTRAL
+        if weight:
+            for other, score in neighbours:
+                totals[other] += score * weight
+    for recipe_id in history:
+        totals.pop(recipe_id, None)
+
+    candidates = heapq.nlargest(limit * 3, (pair for pair in totals.items() if pair[1] > 0),
+                                key=lambda pair: pair[1])
+    return _recipe_cards(conn, [recipe_id for recipe_id, _ in candidates], exclude_user=user_id)[:limit]
@@ -0,0 +1,53 @@
+import time
+
+from db.connection import get_db_connection, run_write
+
+
+# ---------------------------------------------
+# SESSION STORE
+# ---------------------------------------------
+# Server-side sessions (migration 12), keyed by the random id in the
+# session cookie. Expired rows are ignored on read and swept in batches.
+
+def load_session(session_id):
+    """(data, expires_at) for a live session, or None."""
+    conn = get_db_connection()
+    return conn.execute(
+        "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+        (session_id, time.time()),
+    ).fetchone()
+
+
+def save_session(session_id, data, expires_at):
+    run_write(lambda conn: conn.execute("""
+        INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+    """, (session_id, data, expires_at)))
+
+
+def touch_session(session_id, expires_at):
+    """Push an unchanged session's expiry forward without rewriting its data."""
+    run_write(lambda conn: conn.execute(
+        "UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, session_id)
+    ))
+
+
+def delete_session(session_id):
+    run_write(lambda conn: conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)))
+
+
+def delete_expired_sessions(limit=1000):
+    """Delete up to limit expired sessions and return how many went."""
+    return run_write(lambda conn: conn.execute("""
+        DELETE FROM sessions WHERE id IN (
+            SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?
+        )
+    """, (time.time(), limit)).rowcount)
+
+
+def get_session_counts():
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(expires_at <= ?), 0) FROM sessions", (time.time(),)
+    ).fetchone()
+    return {"stored": row[0], "expired": row[1]}
@@ -0,0 +1,56 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Processes x threads, sized from the CPU count. Every worker runs its own
+# pool and writer thread on the shared SQLite file (WAL + busy_timeout);
+# threads cover the time requests spend waiting on SQLite and I/O, and the
+# GIL makes more than about one process per core pointless.
+#
+#   WEB_BIND=0.0.0.0:8000 WEB_WORKERS=4 WEB_THREADS=8 gunicorn -c gunicorn.conf.py wsgi:app
+#
+# WEB_BIND, WEB_WORKERS and WEB_THREADS (and their defaults) live in
+# serving.py, shared with wsgi.py, along with how the DB, password and
+# image pools of each worker are sized.
+import os
+
+from serving import WEB_BIND, WEB_THREADS, WEB_WORKERS, fit_pools
+
+bind = WEB_BIND
+workers = WEB_WORKERS
+worker_class = "gthread"
+threads = WEB_THREADS
+
+# Import the app (migrations, cache warm-up) once in the master and fork
+# the workers from it; db/connection.py and mailer.py reset their
+# connections and threads in each child.
+preload_app = True
+
+fit_pools(workers, threads)
+# Every worker drains the outbox; one sender each is plenty
+os.environ.setdefault("MAIL_WORKERS", "1")
+
+timeout = int(os.environ.get("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("WEB_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    # Already warm when preloaded (a cache hit); loads them otherwise
+    from db.connection import release_db_connection
+    from db.db import warm_caches
+
+    warm_caches()
+    release_db_connection()
+
+
+def worker_exit(server, worker):
+    # Graceful shutdown: finish queued writes and mail batches, close connections
+    from db.connection import close_all_connections
+    from mailer import outbox
+
+    outbox.stop()
+    close_all_connections()
@@ -0,0 +1,607 @@
+import atexit
+import hashlib
+import http.client
+import io
+import ipaddress
+import multiprocessing
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import abort, request, send_file, url_for
+
+from cache import LRUCache
+from db.connection import release_db_connection
+from db.images import (
+    get_image,
+    record_image,
+    record_image_failure,
+    get_unfetched_image_urls,
+    get_image_counts,
+)
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Recipe images are copied once into a local content-addressed store
+# (IMAGE_DIR/originals/<sha256>) and served as resized variants from
+# /img/<sha256>/<variant>, with a one-year immutable Cache-Control: the
+# digest changes whenever the picture does.
+#
+# Templates use {{ url | image_src("card") }}. A remote URL seen for the
+# first time is still hotlinked on that render while a background thread
+# downloads it; uploads are stored straight away. Variants are made in a
+# process pool (Pillow is CPU-bound and holds the GIL) and kept on disk.
+# Without Pillow, every variant is the original as stored.
+#
+#   flask fetch-images        download every recipe image not stored yet
+IMAGE_DIR = os.environ.get("IMAGE_DIR", "image_cache")
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_FETCH_WORKERS = int(os.environ.get("IMAGE_FETCH_WORKERS", "2"))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_RESIZE_TIMEOUT = float(os.environ.get("IMAGE_RESIZE_TIMEOUT", "30"))
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(50_000_000)))
+IMAGE_RETRY_AFTER = float(os.environ.get("IMAGE_RETRY_AFTER", "3600"))  # after a failed fetch
+# file:// URLs, plain paths and private/loopback hosts - for tests and
+# local development only, never on a public server
+IMAGE_ALLOW_LOCAL = os.environ.get("IMAGE_ALLOW_LOCAL", "0") == "1"
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# For the original served in place of a variant that could not be made
+IMAGE_FALLBACK_MAX_AGE = 300
+
+# Settings init_images() takes from app.config when they are set there
+# (FLASK_IMAGE_DIR, RECIPE_SETTINGS, ...), over the variables above
+CONFIGURABLE = (
+    "IMAGE_DIR", "IMAGE_FETCH_TIMEOUT", "IMAGE_RESIZE_TIMEOUT", "IMAGE_MAX_BYTES",
+    "IMAGE_MAX_PIXELS", "IMAGE_RETRY_AFTER", "IMAGE_ALLOW_LOCAL",
+)
+
+# name -> bounding box; images are only ever scaled down
+VARIANTS = {
+    "thumb": (320, 320),
+    "card": (800, 600),
+    "full": (1600, 1600),
+}
+
+# name -> (mimetype, Pillow format, save options), in order of preference
+FORMATS = {
+    "webp": ("image/webp", "WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("image/jpeg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# Magic numbers of what browsers display, for the no-Pillow fallback
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+LOCAL_URL = re.compile(r"/img/([0-9a-f]{64})(?:/\w+)?")
+
+
+class ImageError(ValueError):
+    """Not an image we can store (bad type, too big, unreachable...)."""
+
+
+# ---------------------------------------------
+# STORAGE
+# ---------------------------------------------
+
+def _original_path(digest):
+    return os.path.join(IMAGE_DIR, "originals", digest[:2], digest)
+
+
+def _variant_path(digest, variant, fmt):
+    return os.path.join(IMAGE_DIR, "variants", digest[:2], digest, f"{variant}.{fmt}")
+
+
+def _write_atomic(path, data):
+    """Write via a temp file + rename, so readers never see half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def sniff_mimetype(data):
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            if mimetype == "image/webp" and data[8:12] != b"WEBP":
+                continue
+            return mimetype
+    return None
+
+
+def check_image(data):
+    """Raise ImageError unless data is a raster image within the size limits."""
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ImageError(f"larger than {IMAGE_MAX_BYTES} bytes")
+    if Image is None:
+        if sniff_mimetype(data) is None:
+            raise ImageError("not a JPEG, PNG, GIF or WebP image")
+        return
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.width * im.height > IMAGE_MAX_PIXELS:
+                raise ImageError(f"{im.width}x{im.height} is more than {IMAGE_MAX_PIXELS} pixels")
+            im.verify()
+    except ImageError:
+        raise
+    except UnidentifiedImageError as e:
+        raise ImageError("not a JPEG, PNG, GIF or WebP image") from e
+    except Exception as e:
+        raise ImageError(f"not a readable image: {e}") from e
+
+
+def store_original(data):
+    """Check and store an original image (once per content); returns its digest."""
+    check_image(data)
+    digest = hashlib.sha256(data).hexdigest()
+    path = _original_path(digest)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return digest
+
+
+def local_url(digest, variant="full"):
+    """What image_url holds for an uploaded image."""
+    return f"/img/{digest}/{variant}"
+
+
+# ---------------------------------------------
+# DOWNLOADS
+# ---------------------------------------------
+
+def _check_host(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ImageError("only http(s) image URLs can be fetched")
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """
+    socket.create_connection() for image downloads: resolve the host once,
+    refuse it unless every address is public, and connect to exactly the
+    addresses that were checked - a second lookup could be answered with a
+    private one (DNS rebinding).
+    """
+    host, port = address
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ImageError(f"cannot resolve {host}: {e}") from e
+    if not IMAGE_ALLOW_LOCAL:
+        for info in infos:
+            if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+                raise ImageError(f"{host} is not a public address")
+
+    error = OSError(f"no addresses for {host}")
+    for family, kind, proto, _, sockaddr in infos:
+        sock = socket.socket(family, kind, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    # TLS still verifies the certificate against the host name
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _CheckedRedirects(urllib.request.HTTPRedirectHandler):
+    """Only follow redirects to http(s); the address check happens on connect."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_host(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies from the environment: the connection has to go to the checked
+# address itself, not to a proxy that resolves the name again
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler, _CheckedRedirects,
+)
+
+
+def download(url):
+    """The bytes of a remote image (or, with IMAGE_ALLOW_LOCAL, a local file)."""
+    if IMAGE_ALLOW_LOCAL and (url.startswith("file://") or os.path.isabs(url)):
+        path = urllib.request.url2pathname(urllib.parse.urlsplit(url).path) if url.startswith("file://") else url
+        try:
+            with open(path, "rb") as f:
+                return f.read(IMAGE_MAX_BYTES + 1)
+        except OSError as e:
+            raise ImageError(f"cannot read {path}: {e}") from e
+
+    _check_host(url)
+    req = urllib.request.Request(url, headers={"User-Agent": "RecipeManager-ImageFetcher/1.0"})
+    try:
+        with _opener.open(req, timeout=IMAGE_FETCH_TIMEOUT) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith("image/"):
+                raise ImageError(f"served as {content_type}, not an image")
+            return response.read(IMAGE_MAX_BYTES + 1)
+    except OSError as e:  # URLError, HTTPError, timeouts
+        raise ImageError(f"download failed: {e}") from e
+
+
+# ---------------------------------------------
+# VARIANTS
+# ---------------------------------------------
+# Runs in the worker processes: only paths and plain values go in and out.
+
+def render_variant(source, target, box, pil_format, options):
+    with Image.open(source) as im:
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale, far cheaper than a full decode
+        im.draft("RGB", box)
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail(box, Image.LANCZOS)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+        if pil_format == "JPEG" and im.mode == "RGBA":
+            # No alpha in JPEG: flatten onto white
+            background = Image.new("RGB", im.size, (255, 255, 255))
+            background.paste(im, mask=im.getchannel("A"))
+            im = background
+        out = io.BytesIO()
+        im.save(out, pil_format, **options)
+    _write_atomic(target, out.getvalue())
+    return target
+
+
+def supported_formats():
+    if Image is None:
+        return []
+    return [name for name in FORMATS if name != "webp" or features.check("webp")]
+
+
+def choose_format():
+    """WebP for browsers that say they take it, JPEG otherwise."""
+    formats = supported_formats()
+    if "webp" in formats and request.accept_mimetypes["image/webp"]:
+        return "webp"
+    return "jpeg"
+
+
+# ---------------------------------------------
+# IMAGE SERVICE
+# ---------------------------------------------
+# url -> digest of stored images; a miss costs one primary key lookup
+_digests = LRUCache(max_bytes=4 * 1024 * 1024, max_entries=20000)
+# URLs just queued for download (or failing): no lookup for a minute
+_missing = LRUCache(max_bytes=1024 * 1024, max_entries=5000, ttl=60)
+# (digest, variant, format) that failed to render: the original is served
+# meanwhile instead of failing again on every request
+_render_failures = LRUCache(max_bytes=1024 * 1024, max_entries=5000, ttl=300)
+
+
+class ImageService:
+    """
+    Background downloads (a few threads: they wait on the network) and
+    variant rendering (a process pool), each job running at most once at a
+    time however many requests ask for it. Pools start on first use, and
+    again in a forked child.
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS, fetch_workers=IMAGE_FETCH_WORKERS):
+        self.workers = workers
+        self.fetch_workers = fetch_workers
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._fetcher = None
+        self._renderer = None
+        self._pending = {}  # url or (digest, variant, fmt) -> future
+        self.fetched = 0
+        self.fetch_failures = 0
+        self.rendered = 0
+        self.render_failures = 0
+
+    def after_fork(self):
+        # The parent's pools (threads, pipes to its processes) are not ours
+        self._reset()
+
+    def stop(self):
+        with self._lock:
+            fetcher, renderer = self._fetcher, self._renderer
+            self._fetcher = self._renderer = None
+        if fetcher is not None:
+            fetcher.shutdown(wait=True, cancel_futures=True)
+        if renderer is not None:
+            renderer.shutdown(wait=True, cancel_futures=True)
+
+    def _once(self, key, start):
+        """The in-flight future for key, or a new one from start()."""
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = start()
+                future.add_done_callback(lambda _: self._pending.pop(key, None))
+            return future
+
+    # --- downloads
+
+    def fetch_later(self, url):
+        """Queue a download of url unless it is stored, failed lately or queued."""
+        def start():
+            if self._fetcher is None:
+                self._fetcher = ThreadPoolExecutor(self.fetch_workers, thread_name_prefix="image-fetch")
+            return self._fetcher.submit(self._fetch, url)
+
+        return self._once(url, start)
+
+    def fetch(self, url):
+        """Download and store url now; returns the digest (raises ImageError)."""
+        digest = store_original(download(url))
+        record_image(url, digest)
+        _digests.set(url, digest, len(url) + 64)
+        _missing.delete(url)
+        self.fetched += 1
+        self.prepare(digest)
+        return digest
+
+    def _fetch(self, url):
+        try:
+            row = get_image(url)
+            if row is not None and (
+                row["status"] == "stored" or time.time() - row["fetched_at"] < IMAGE_RETRY_AFTER
+            ):
+                return row["digest"]
+            return self.fetch(url)
+        except ImageError as e:
+            self.fetch_failures += 1
+            record_image_failure(url, e)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            release_db_connection()
+
+    # --- variants
+
+    def _render(self, digest, variant, fmt):
+        def start():
+            if self._renderer is None:
+                # spawn: forking a process full of threads is not safe
+                self._renderer = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            _, pil_format, options = FORMATS[fmt]
+            renderer = self._renderer
+            try:
+                future = renderer.submit(
+                    render_variant, _original_path(digest), _variant_path(digest, variant, fmt),
+                    VARIANTS[variant], pil_format, options,
+                )
+            except BrokenProcessPool:
+                # Called under self._lock (see _once)
+                self._renderer = None
+                renderer.shutdown(wait=False, cancel_futures=True)
+                raise
+            self.rendered += 1
+            future.renderer = renderer  # to know which pool broke, if one does
+            return future
+
+        return self._once((digest, variant, fmt), start)
+
+    def _drop_renderer(self, renderer):
+        """Forget a broken pool; the next render starts a fresh one."""
+        with self._lock:
+            if self._renderer is renderer:
+                self._renderer = None
+        renderer.shutdown(wait=False, cancel_futures=True)
+
+    def prepare(self, digest):
+        """Start rendering every variant of a new image in the background."""
+        if not self.workers:
+            return
+        for fmt in supported_formats():
+            for variant in VARIANTS:
+                if not os.path.exists(_variant_path(digest, variant, fmt)):
+                    self._render(digest, variant, fmt)
+
+    def variant(self, digest, variant, fmt):
+        """
+        (path, mimetype, final) of a variant, rendering it first if needed;
+        None if unknown. When the variant cannot be made the original is
+        served instead, with final False so it is not cached for long.
+        """
+        original = _original_path(digest)
+        if not os.path.exists(original):
+            return None
+        if Image is None:
+            return self._original(original, final=True)
+
+        path = _variant_path(digest, variant, fmt)
+        if os.path.exists(path):
+            return path, FORMATS[fmt][0], True
+        key = (digest, variant, fmt)
+        if _render_failures.get(key) is not None:
+            return self._original(original, final=False)
+
+        future = None
+        try:
+            if self.workers:
+                future = self._render(digest, variant, fmt)
+                future.result(IMAGE_RESIZE_TIMEOUT)
+            else:
+                _, pil_format, options = FORMATS[fmt]
+                render_variant(original, path, VARIANTS[variant], pil_format, options)
+        except FutureTimeout:
+            # Still running: it may well be done for the next request
+            return self._original(original, final=False)
+        except BrokenProcessPool:
+            if future is not None:
+                self._drop_renderer(future.renderer)
+            return self._original(original, final=False)
+        except Exception as e:  # corrupt or unsupported file, disk full...
+            self.render_failures += 1
+            _render_failures.set(key, str(e), 64)
+            return self._original(original, final=False)
+        return path, FORMATS[fmt][0], True
+
+    def _original(self, original, final):
+        """The stored original as a stand-in, if browsers can show its type."""
+        with open(original, "rb") as f:
+            mimetype = sniff_mimetype(f.read(16))
+        if mimetype is None:
+            return None
+        return original, mimetype, final
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "pending": len(self._pending),
+                "fetched": self.fetched,
+                "fetch_failures": self.fetch_failures,
+                "rendered": self.rendered,
+                "render_failures": self.render_failures,
+                "pillow": Image is not None,
+                "formats": supported_formats(),
+            }
+        stats["lookups"] = _digests.stats()
+        stats["index"] = get_image_counts()
+        return stats
+
+
+images = ImageService()
+atexit.register(images.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=images.after_fork)
+
+
+def image_digest(url):
+    """Digest of the stored copy of url (an upload or a fetched remote image), or None."""
+    local = LOCAL_URL.fullmatch(url)
+    if local:
+        return local.group(1)
+    digest = _digests.get(url)
+    if digest is None:
+        row = get_image(url)
+        if row is None or row["status"] != "stored":
+            return None
+        digest = row["digest"]
+        _digests.set(url, digest, len(url) + 64)
+    return digest
+
+
+def image_src(url, variant="card"):
+    """
+    Template filter: the local variant URL for a recipe image. Until a
+    remote image has been downloaded this is the original URL, and the
+    download is queued.
+    """
+    if not url or _missing.get(url):
+        return url
+    digest = image_digest(url)
+    if digest is None:
+        _missing.set(url, True, len(url))
+        images.fetch_later(url)
+        return url
+    return url_for("image_variant", digest=digest, variant=variant)
+
+
+def store_upload(file_storage):
+    """Store an uploaded image (werkzeug FileStorage); returns its image_url."""
+    digest = store_original(file_storage.stream.read(IMAGE_MAX_BYTES + 1))
+    images.prepare(digest)
+    return local_url(digest)
+
+
+def fetch_missing(progress=print):
+    """Download every recipe image not stored yet; returns (stored, failed)."""
+    stored = failed = 0
+    urls = [url for url in get_unfetched_image_urls(time.time() - IMAGE_RETRY_AFTER)
+            if not LOCAL_URL.fullmatch(url)]
+    with ThreadPoolExecutor(IMAGE_FETCH_WORKERS or 1) as pool:
+        def one(url):
+            try:
+                return images.fetch(url), None
+            except ImageError as e:
+                record_image_failure(url, e)
+                return None, e
+            finally:
+                release_db_connection()
+
+        for url, (digest, error) in zip(urls, pool.map(one, urls)):
+            if error is None:
+                stored += 1
+            else:
+                failed += 1
+                progress(f"{url}: {error}")
+    return stored, failed
+
+
+def init_images(app):
+    for name in CONFIGURABLE:
+        if name in app.config:
+            globals()[name] = app.config[name]
+    images.workers = app.config.get("IMAGE_WORKERS", images.workers)
+    images.fetch_workers = app.config.get("IMAGE_FETCH_WORKERS", images.fetch_workers)
+
+    app.add_template_filter(image_src)
+
+    @app.route("/img/<digest>/<variant>")
+    def image_variant(digest, variant):
+        if not DIGEST.fullmatch(digest) or variant not in VARIANTS:
+            abort(404)
+        found = images.variant(digest, variant, choose_format() if Image is not None else None)
+        if found is None:
+            abort(404)
+        path, mimetype, final = found
+        if not final:
+            return send_file(path, mimetype=mimetype, max_age=IMAGE_FALLBACK_MAX_AGE, conditional=True)
+        response = send_file(path, mimetype=mimetype, max_age=IMAGE_MAX_AGE, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept")  # WebP or JPEG
+        return response
@@ -1,61 +1,17 @@
 import sqlite3
 from werkzeug.security import generate_password_hash
 
-DB_NAME = "recipe.db"
+from db.connection import DB_NAME
+from db.migrations import migrate, get_schema_version
 
 # -----------------------------
-# Connect to SQLite DB
+# Create / upgrade tables
 # -----------------------------
+migrate(DB_NAME)
+
 conn = sqlite3.connect(DB_NAME)
 c = conn.cursor()
 
-# -----------------------------
-# Create Tables
-# -----------------------------
-
-# Users table
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT NOT NULL,
-    email TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    is_approved INTEGER DEFAULT 0,
-    is_admin INTEGER DEFAULT 0
-);
-""")
-
-# Recipes table
-c.execute("""
-CREATE TABLE IF NOT EXISTS recipes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title TEXT NOT NULL,
-    ingredients TEXT NOT NULL,
-    instructions TEXT NOT NULL,
-    category TEXT,
-    image_url TEXT,
-    video_url TEXT,
-    user_id INTEGER,
-    delete_request INTEGER DEFAULT 0,
-    status TEXT DEFAULT 'pending',
-    FOREIGN KEY(user_id) REFERENCES users(id)
-);
-""")
-
-# Reviews table
-c.execute("""
-CREATE TABLE IF NOT EXISTS reviews (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    recipe_id INTEGER NOT NULL,
-    user_id INTEGER NOT NULL,
-    rating INTEGER NOT NULL,
-    comment TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(recipe_id) REFERENCES recipes(id),
-    FOREIGN KEY(user_id) REFERENCES users(id)
-);
-""")
-
 # -----------------------------
 # Insert Default Admin
 # -----------------------------
@@ -76,6 +32,7 @@ conn.commit()
 c.execute("SELECT name FROM sqlite_master WHERE type='table';")
 tables = c.fetchall()
 print("Tables in DB:", tables)
+print("Schema version:", get_schema_version(conn))
 
 conn.close()
 print("Database initialized successfully!")
@@ -0,0 +1,287 @@
+import atexit
+import os
+import random
+import smtplib
+import threading
+import time
+import traceback
+from email.message import EmailMessage
+
+from db.connection import release_db_connection
+from db.outbox import (
+    enqueue_email,
+    claim_due_emails,
+    mark_emails_sent,
+    mark_email_failed,
+    delete_finished_emails,
+    get_next_email_due,
+    get_outbox_counts,
+)
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Credentials come from the environment only: SMTP_USER and SMTP_PASSWORD
+# (for Gmail an app password). Without SMTP_USER no login is attempted.
+# For local testing point this at a stand-in server, e.g.
+#   python -m aiosmtpd -n -l localhost:8025
+#   SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SECURITY=none flask run
+# python -m bench.mail runs the whole outbox against such a server and checks
+# what arrives.
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_SECURITY = os.environ.get("SMTP_SECURITY", "ssl")  # ssl | starttls | none
+SMTP_USER = os.environ.get("SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+if SMTP_USER and not SMTP_PASSWORD:
+    raise RuntimeError("SMTP_PASSWORD must be set in the environment when SMTP_USER is")
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "20"))
+MAIL_FROM = os.environ.get("MAIL_FROM", SMTP_USER or "no-reply@localhost")
+
+MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS", "2"))
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE = float(os.environ.get("MAIL_RETRY_BASE", "5"))     # seconds
+MAIL_RETRY_MAX = float(os.environ.get("MAIL_RETRY_MAX", "900"))
+MAIL_LEASE = float(os.environ.get("MAIL_LEASE", "120"))            # claim timeout
+MAIL_IDLE_CLOSE = float(os.environ.get("MAIL_IDLE_CLOSE", "60"))   # drop idle SMTP
+MAIL_POLL = float(os.environ.get("MAIL_POLL", "30"))
+MAIL_KEEP = float(os.environ.get("MAIL_KEEP", str(7 * 24 * 3600)))  # finished rows
+MAIL_SWEEP_INTERVAL = float(os.environ.get("MAIL_SWEEP_INTERVAL", "3600"))
+MAIL_SWEEP_BATCH = int(os.environ.get("MAIL_SWEEP_BATCH", "1000"))
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: ~5s, 10s, 20s ... capped at MAIL_RETRY_MAX."""
+    delay = min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** attempts)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def build_message(row):
+    msg = EmailMessage()
+    msg["Subject"] = row["subject"]
+    msg["From"] = MAIL_FROM
+    msg["To"] = row["to_addr"]
+    msg.set_content(row["body"])
+    return msg
+
+
+# ---------------------------------------------
+# SMTP CONNECTION
+# ---------------------------------------------
+class SMTPConnection:
+    """
+    One logged-in SMTP session kept open between sends. It reconnects when
+    the server has dropped it and closes itself after MAIL_IDLE_CLOSE
+    seconds without use (servers time idle sessions out anyway).
+    """
+
+    def __init__(self):
+        self._smtp = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _open(self):
+        if SMTP_SECURITY == "ssl":
+            smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_SECURITY == "starttls":
+                smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        self.connects += 1
+        return smtp
+
+    def send(self, msg):
+        if self._smtp is None:
+            self._smtp = self._open()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Stale session - one fresh connection, then let it fail
+            self._smtp = self._open()
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > MAIL_IDLE_CLOSE:
+            self.close()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
+
+
+# ---------------------------------------------
+# OUTBOX WORKERS
+# ---------------------------------------------
+class MailOutbox:
+    """
+    Background threads that drain the email_outbox table. Each worker
+    claims a batch of due messages, sends them over its own reused SMTP
+    connection and records the outcome; failures are retried with
+    exponential backoff until MAIL_MAX_ATTEMPTS or the message expires.
+    Finished rows are deleted after MAIL_KEEP seconds.
+    """
+
+    def __init__(self, workers=MAIL_WORKERS, batch_size=MAIL_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._reset()
+
+    def _reset(self):
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._connections = []
+        self._sent = 0
+        self._failed_attempts = 0
+        self._next_sweep = 0.0
+        self._swept = 0
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"mail-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def after_fork(self):
+        """
+        In a forked child the worker threads are gone and the locks may have
+        been held mid-fork; start from scratch (start() brings threads back).
+        The parent's SMTP sessions are dropped without a QUIT.
+        """
+        self._reset()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send(self, to_addr, subject, body, max_age=None):
+        """
+        Queue a message and return straight away; a worker sends it. One
+        not sent within max_age seconds is dropped (None: keep trying).
+        """
+        expires_at = time.time() + max_age if max_age is not None else None
+        email_id = enqueue_email(to_addr, subject, body, expires_at)
+        if self.workers:
+            self.start()
+            self._wakeup.set()
+        return email_id
+
+    def _run(self):
+        smtp = SMTPConnection()
+        with self._lock:
+            self._connections.append(smtp)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    batch = claim_due_emails(self.batch_size, MAIL_LEASE)
+                    if batch:
+                        self._send_batch(smtp, batch)
+                        continue
+                    self._sweep_if_due()
+                    wait = self._time_until_due()
+                except Exception:
+                    # Keep the worker alive; claimed rows come back after the lease
+                    traceback.print_exc()
+                    wait = MAIL_POLL
+                finally:
+                    release_db_connection()
+
+                smtp.close_if_idle()
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+        finally:
+            smtp.close()
+
+    def _sweep_if_due(self):
+        """Delete old finished rows, at most once every MAIL_SWEEP_INTERVAL per process."""
+        with self._lock:
+            if time.monotonic() < self._next_sweep:
+                return
+            self._next_sweep = time.monotonic() + MAIL_SWEEP_INTERVAL
+        before = time.time() - MAIL_KEEP
+        swept = total = delete_finished_emails(before, MAIL_SWEEP_BATCH)
+        # A large backlog goes a batch at a time, so no one write holds the lock long
+        while swept == MAIL_SWEEP_BATCH:
+            swept = delete_finished_emails(before, MAIL_SWEEP_BATCH)
+            total += swept
+        with self._lock:
+            self._swept += total
+
+    def _time_until_due(self):
+        due = get_next_email_due()
+        if due is None:
+            return MAIL_POLL
+        return min(MAIL_POLL, max(0.0, due - time.time()))
+
+    def _send_batch(self, smtp, batch):
+        sent = []
+        for i, row in enumerate(batch):
+            try:
+                smtp.send(build_message(row))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                # The server refused this message - the connection is fine
+                self._failed(row, e)
+            except (smtplib.SMTPException, OSError) as e:
+                # Connection or login problem: don't burn a timeout per
+                # message, put the rest of the batch back for later
+                smtp.close()
+                for row in batch[i:]:
+                    self._failed(row, e)
+                break
+            else:
+                sent.append(row["id"])
+
+        mark_emails_sent(sent)
+        with self._lock:
+            self._sent += len(sent)
+
+    def _failed(self, row, error):
+        attempts = row["attempts"] + 1
+        retry_at = time.time() + retry_delay(attempts) if attempts < MAIL_MAX_ATTEMPTS else None
+        if retry_at is not None and row["expires_at"] is not None and retry_at >= row["expires_at"]:
+            retry_at = None  # the retry would come too late to be of use
+        mark_email_failed(row["id"], error, retry_at)
+        with self._lock:
+            self._failed_attempts += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "workers": sum(t.is_alive() for t in self._threads),
+                "sent": self._sent,
+                "failed_attempts": self._failed_attempts,
+                "swept": self._swept,
+                "smtp_connects": sum(c.connects for c in self._connections),
+            }
+        stats["queue"] = get_outbox_counts()
+        return stats
+
+
+outbox = MailOutbox()
+atexit.register(outbox.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=outbox.after_fork)
+
+
+def send_email(to_addr, subject, body, max_age=None):
+    """Queue an email for background delivery; see MailOutbox.send."""
+    return outbox.send(to_addr, subject, body, max_age)
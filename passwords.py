@@ -0,0 +1,200 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Password hashing is deliberately slow, so it runs in a process pool: a
+# burst of logins queues there instead of holding request threads (and
+# the GIL) for tens of milliseconds each.
+#
+#   PASSWORD_HASH_METHOD     werkzeug method and work factor for new hashes,
+#                            e.g. scrypt:32768:8:1 or pbkdf2:sha256:1000000.
+#                            Hashes made with other parameters are replaced
+#                            the next time their owner logs in.
+#   PASSWORD_WORKERS         hashing processes, per web process: the entry
+#                            points default it to the cores divided by
+#                            WEB_WORKERS (see serving.py), otherwise all
+#                            cores. 0 = hash on the request thread instead
+#   PASSWORD_QUEUE           jobs queued or running before callers wait
+#   PASSWORD_QUEUE_TIMEOUT   seconds a caller waits for room (PasswordBusy)
+#
+# python -m bench.passwords measures logins per second per core.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE = int(os.environ.get("PASSWORD_QUEUE", str(max(1, PASSWORD_WORKERS) * 16)))
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get("PASSWORD_QUEUE_TIMEOUT", "5"))
+PASSWORD_TIMEOUT = float(os.environ.get("PASSWORD_TIMEOUT", "30"))
+
+
+class PasswordBusy(RuntimeError):
+    """
+    The hashing pool cannot take the job now: more than PASSWORD_QUEUE
+    queued for too long, a job timed out or a worker process died.
+    """
+
+
+def normalize_method(method):
+    """method with werkzeug's defaults filled in, as it appears in a stored hash."""
+    name, *params = method.split(":")
+    if name == "scrypt":
+        n, r, p = (params + [None] * 3)[:3]
+        return f"scrypt:{int(n or 2 ** 15)}:{int(r or 8)}:{int(p or 1)}"
+    if name == "pbkdf2":
+        hash_name, iterations = (params + [None] * 2)[:2]
+        return f"pbkdf2:{hash_name or 'sha256'}:{int(iterations or DEFAULT_PBKDF2_ITERATIONS)}"
+    raise ValueError(f"unsupported password hash method {method!r}")
+
+
+HASH_METHOD = normalize_method(PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(stored, method=HASH_METHOD):
+    return stored.split("$", 1)[0] != method
+
+
+# ---------------------------------------------
+# WORKER FUNCTIONS
+# ---------------------------------------------
+# Run in the pool's processes, so they take everything as arguments.
+
+def _check(stored, password, method):
+    """(matches, new hash if it matches but was made with other parameters)."""
+    if not check_password_hash(stored, password):
+        return False, None
+    if needs_rehash(stored, method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+# ---------------------------------------------
+# HASHER
+# ---------------------------------------------
+
+class PasswordHasher:
+    """
+    Runs hashing in a bounded process pool started on first use. With
+    workers=0 the work happens on the calling thread.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue=PASSWORD_QUEUE, method=HASH_METHOD):
+        self.workers = workers
+        self.queue = queue
+        self.method = method
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.queue)
+        self.hashed = 0
+        self.checked = 0
+        self.rehashed = 0
+        self.busy = 0
+
+    def after_fork(self):
+        # The parent's pool (and its pipes to the worker processes) is not ours
+        self._reset()
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(timeout=PASSWORD_QUEUE_TIMEOUT):
+            self.busy += 1
+            raise PasswordBusy("too many password checks queued")
+        try:
+            with self._lock:
+                if self._pool is None:
+                    # spawn: forking a process full of threads is not safe
+                    self._pool = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                pool = self._pool
+                future = pool.submit(fn, *args)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._discard(pool)
+            raise PasswordBusy("password worker died") from e
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(PASSWORD_TIMEOUT)
+        except FutureTimeout as e:
+            self.busy += 1
+            raise PasswordBusy("password check timed out") from e
+        except BrokenProcessPool as e:
+            self._discard(pool)
+            raise PasswordBusy("password worker died") from e
+
+    def _discard(self, pool):
+        """Drop a broken pool; the next job starts a fresh one."""
+        self.busy += 1
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        hashed = self._run(generate_password_hash, password, self.method)
+        self.hashed += 1
+        return hashed
+
+    def check(self, stored, password):
+        """(matches, replacement hash or None) - see _check."""
+        matches, new_hash = self._run(_check, stored, password, self.method)
+        self.checked += 1
+        if new_hash is not None:
+            self.rehashed += 1
+        return matches, new_hash
+
+    def stats(self):
+        return {
+            "method": self.method,
+            "workers": self.workers,
+            "queue": self.queue,
+            "hashed": self.hashed,
+            "checked": self.checked,
+            "rehashed": self.rehashed,
+            "busy": self.busy,
+        }
+
+
+hasher = PasswordHasher()
+atexit.register(hasher.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=hasher.after_fork)
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def check_user_password(user, password):
+    """
+    Check password against a users row. A hash made with other parameters
+    than PASSWORD_HASH_METHOD is replaced on success.
+    """
+    # Imported here so the pool's processes, which import this module, stay DB-free
+    from db.db import update_password_hash
+
+    matches, new_hash = hasher.check(user["password"], password)
+    if new_hash is not None:
+        update_password_hash(user["id"], user["password"], new_hash)
+    return matches
@@ -0,0 +1,431 @@
+import contextvars
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, current_app, g, request, session
+
+from db.connection import get_pool_stats, set_connection_factory
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Everything here is opt-in. With PROFILE unset install() returns straight
+# away: no hooks, no /metrics, and connections stay plain sqlite3 ones.
+#
+#   PROFILE=1                    per-route and per-query timing + /metrics
+#   PROFILE_SAMPLE_RATE=0.01     also profile ~1% of requests (pyinstrument
+#                                if installed, else cProfile) into PROFILE_DIR
+#   N_PLUS_ONE_THRESHOLD=10      same SQL run this often in one request = N+1
+#   METRICS_TOKEN=...            require "Authorization: Bearer ..." on /metrics
+PROFILE = os.environ.get("PROFILE", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "10"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+BACKGROUND = "(background)"  # queries run outside a request: mail workers, maintenance jobs
+
+
+# ---------------------------------------------
+# QUERY TIMING
+# ---------------------------------------------
+# Each request collects its queries in a dict (sql -> [calls, seconds, max])
+# held in a context variable; the totals are merged into the registry once,
+# when the request ends. Time spent fetching rows is added to the query
+# that produced them. Write jobs run in the context of the request that
+# submitted them, so SQL on the writer thread counts for that request too.
+
+_queries = contextvars.ContextVar("profile_queries", default=None)
+
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """One label per statement shape: collapsed whitespace, (?, ?, ?) -> (?...)."""
+    return _PLACEHOLDER_LIST.sub("?...", _WHITESPACE.sub(" ", sql).strip())
+
+
+def query_id(sql):
+    return hashlib.blake2b(sql.encode("utf-8"), digest_size=4).hexdigest()
+
+
+def _record(sql, elapsed, executed):
+    queries = _queries.get()
+    if queries is None:
+        metrics.add_background_query(sql, elapsed, executed)
+        return
+
+    entry = queries.get(sql)
+    if entry is None:
+        entry = queries[sql] = [0, 0.0, 0.0]
+    if executed:
+        entry[0] += 1
+    entry[1] += elapsed
+    if elapsed > entry[2]:
+        entry[2] = elapsed
+
+
+class TimedCursor(sqlite3.Cursor):
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, time.perf_counter() - start, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, time.perf_counter() - start, True)
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._sql is not None:
+                _record(self._sql, time.perf_counter() - start, False)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(super().fetchmany)
+        return self._fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        return self._fetch(super().__next__)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose queries are timed. The C-level Connection.execute
+    shortcut doesn't go through cursor(), so it is overridden as well.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---------------------------------------------
+# METRICS REGISTRY
+# ---------------------------------------------
+class Metrics:
+    """Per-route request timings and per-(route, query) SQL timings."""
+
+    def __init__(self, buckets=DURATION_BUCKETS, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.buckets = buckets
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._lock = threading.Lock()
+        self.routes = {}   # route -> dict, see _route()
+        self.queries = {}  # (route, normalized sql) -> [calls, seconds, max, n_plus_one]
+
+    def _route(self, route):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = {
+                "count": 0,
+                "seconds": 0.0,
+                "max": 0.0,
+                "buckets": [0] * len(self.buckets),
+                "statuses": {},
+                "queries": 0,
+                "query_seconds": 0.0,
+            }
+        return stats
+
+    def _query(self, route, sql):
+        sql = normalize_sql(sql)
+        key = (route, sql)
+        entry = self.queries.get(key)
+        if entry is None:
+            entry = self.queries[key] = [0, 0.0, 0.0, 0]
+        return sql, entry
+
+    def add_request(self, route, status, elapsed, queries):
+        """Record one request; returns the (sql, calls) it newly flagged as N+1."""
+        flagged = []
+        with self._lock:
+            stats = self._route(route)
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    stats["buckets"][i] += 1
+                    break
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+            for sql, (calls, seconds, slowest) in queries.items():
+                stats["queries"] += calls
+                stats["query_seconds"] += seconds
+                sql, entry = self._query(route, sql)
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] = max(entry[2], slowest)
+                if calls >= self.n_plus_one_threshold:
+                    entry[3] += 1
+                    if entry[3] == 1:
+                        flagged.append((sql, calls))
+
+        return flagged
+
+    def add_background_query(self, sql, elapsed, executed):
+        with self._lock:
+            _, entry = self._query(BACKGROUND, sql)
+            if executed:
+                entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+            self.queries.clear()
+
+    def snapshot(self, top=20):
+        """JSON-friendly list of routes, most total time first, each with its top queries."""
+        with self._lock:
+            routes = {route: dict(stats, statuses=dict(stats["statuses"])) for route, stats in self.routes.items()}
+            queries = [(route, sql, list(entry)) for (route, sql), entry in self.queries.items()]
+
+        by_route = {}
+        for route, sql, (calls, seconds, slowest, n_plus_one) in queries:
+            by_route.setdefault(route, []).append({
+                "id": query_id(sql),
+                "sql": sql,
+                "calls": calls,
+                "seconds": round(seconds, 6),
+                "max": round(slowest, 6),
+                "n_plus_one": n_plus_one,
+            })
+
+        result = []
+        for route in sorted(set(routes) | set(by_route), key=lambda r: -routes.get(r, {}).get("seconds", 0)):
+            stats = routes.get(route, {})
+            count = stats.get("count", 0)
+            top_queries = sorted(by_route.get(route, []), key=lambda q: -q["seconds"])[:top]
+            result.append({
+                "route": route,
+                "requests": count,
+                "seconds": round(stats.get("seconds", 0.0), 6),
+                "avg": round(stats["seconds"] / count, 6) if count else None,
+                "max": round(stats.get("max", 0.0), 6),
+                "statuses": stats.get("statuses", {}),
+                "queries_per_request": round(stats["queries"] / count, 2) if count else None,
+                "query_seconds": round(stats.get("query_seconds", 0.0), 6),
+                "slowest_query": max(top_queries, key=lambda q: q["max"])["sql"] if top_queries else None,
+                "queries": top_queries,
+            })
+        return result
+
+    def render_prometheus(self):
+        """The registry in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            routes = sorted(self.routes.items())
+            queries = sorted(self.queries.items())
+
+            metric("recipe_http_request_duration_seconds", "histogram", "Wall time per request by route.")
+            for route, stats in routes:
+                cumulative = 0
+                for bound, count in zip(self.buckets, stats["buckets"]):
+                    cumulative += count
+                    lines.append(f'recipe_http_request_duration_seconds_bucket{{route="{_escape(route)}",le="{bound}"}} {cumulative}')
+                lines.append(f'recipe_http_request_duration_seconds_bucket{{route="{_escape(route)}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'recipe_http_request_duration_seconds_sum{{route="{_escape(route)}"}} {stats["seconds"]:.6f}')
+                lines.append(f'recipe_http_request_duration_seconds_count{{route="{_escape(route)}"}} {stats["count"]}')
+
+            metric("recipe_http_responses_total", "counter", "Responses by route and status code.")
+            for route, stats in routes:
+                for status, count in sorted(stats["statuses"].items()):
+                    lines.append(f'recipe_http_responses_total{{route="{_escape(route)}",status="{status}"}} {count}')
+
+            metric("recipe_route_db_queries_total", "counter", "SQL statements executed by route.")
+            for route, stats in routes:
+                lines.append(f'recipe_route_db_queries_total{{route="{_escape(route)}"}} {stats["queries"]}')
+
+            metric("recipe_route_db_seconds_total", "counter", "Time spent in SQL by route.")
+            for route, stats in routes:
+                lines.append(f'recipe_route_db_seconds_total{{route="{_escape(route)}"}} {stats["query_seconds"]:.6f}')
+
+            # Queries are labelled by a short hash; /admin/profile_stats maps it back to the SQL
+            metric("recipe_db_query_calls_total", "counter", "Executions per route and query.")
+            for (route, sql), entry in queries:
+                lines.append(f'recipe_db_query_calls_total{_query_labels(route, sql)} {entry[0]}')
+
+            metric("recipe_db_query_seconds_total", "counter", "Execute and fetch time per route and query.")
+            for (route, sql), entry in queries:
+                lines.append(f'recipe_db_query_seconds_total{_query_labels(route, sql)} {entry[1]:.6f}')
+
+            metric("recipe_db_query_seconds_max", "gauge", "Slowest single execute or fetch per route and query.")
+            for (route, sql), entry in queries:
+                lines.append(f'recipe_db_query_seconds_max{_query_labels(route, sql)} {entry[2]:.6f}')
+
+            metric("recipe_db_n_plus_one_total", "counter", "Requests that ran the query at least N_PLUS_ONE_THRESHOLD times.")
+            for (route, sql), entry in queries:
+                if entry[3]:
+                    lines.append(f'recipe_db_n_plus_one_total{_query_labels(route, sql)} {entry[3]}')
+
+        stats = get_pool_stats()
+        metric("recipe_db_pool", "gauge", "Connection pool state.")
+        for key in ("size", "opened", "in_use", "idle"):
+            lines.append(f'recipe_db_pool{{state="{key}"}} {stats["pool"][key]}')
+        metric("recipe_db_writer_queued", "gauge", "Write jobs waiting for the writer thread.")
+        lines.append(f'recipe_db_writer_queued {stats["writer"]["queued"]}')
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _query_labels(route, sql):
+    return f'{{route="{_escape(route)}",query="{query_id(sql)}"}}'
+
+
+metrics = Metrics()
+
+
+# ---------------------------------------------
+# SAMPLING PROFILER
+# ---------------------------------------------
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:
+    _Pyinstrument = None
+
+
+class _RequestProfiler:
+    """Profiles the current thread; pyinstrument when installed, cProfile otherwise."""
+
+    def __init__(self):
+        if _Pyinstrument is not None:
+            self._profiler = _Pyinstrument()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def finish(self, route):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        label = re.sub(r"[^\w.-]", "_", route)
+        name = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}-{threading.get_ident()}")
+        if _Pyinstrument is not None:
+            self._profiler.stop()
+            with open(name + ".html", "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(name + ".prof")  # python -m pstats <file>
+
+
+# ---------------------------------------------
+# FLASK HOOKS
+# ---------------------------------------------
+def _route_label():
+    return request.endpoint or "(unmatched)"
+
+
+def _start_request():
+    _queries.set({})
+    g._profile_start = time.perf_counter()
+    g._profile_status = None
+    g._profiler = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        try:
+            g._profiler = _RequestProfiler()
+        except ValueError:
+            pass  # another profiler already owns this thread
+
+
+def _note_status(response):
+    g._profile_status = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    # Runs after a streamed body has been sent, so its queries count too
+    start = g.pop("_profile_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    queries = _queries.get() or {}
+    _queries.set(None)
+
+    route = _route_label()
+    status = 500 if exc is not None else (g.pop("_profile_status", None) or 500)
+    for sql, calls in metrics.add_request(route, status, elapsed, queries):
+        current_app.logger.warning("possible N+1 in %s: %dx %s", route, calls, sql[:200])
+
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        profiler.finish(route)
+
+
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def profile_stats_view():
+    if "is_admin" not in session or session["is_admin"] != 1:
+        return {"error": "Unauthorized"}, 403
+
+    if request.method == "POST":
+        metrics.reset()
+        return {"reset": True}
+    return {
+        "n_plus_one_threshold": metrics.n_plus_one_threshold,
+        "routes": metrics.snapshot(top=int(request.args.get("top", 20))),
+    }
+
+
+def install(app):
+    """
+    Turn on profiling for app when PROFILE=1. Call it before the first
+    query so that every connection (pool, writer, mail workers) is timed.
+    """
+    if not PROFILE:
+        return False
+
+    set_connection_factory(TimedConnection)
+    app.before_request(_start_request)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    app.add_url_rule("/admin/profile_stats", "admin_profile_stats", profile_stats_view, methods=["GET", "POST"])
+    return True
@@ -0,0 +1,38 @@
+import os
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Shared by both entry points (gunicorn.conf.py and wsgi.py), so the same
+# deployment gets the same threads and pools whichever server runs it.
+#
+#   WEB_BIND      host:port to listen on
+#   WEB_WORKERS   web processes under gunicorn (wsgi.py / waitress is one)
+#   WEB_THREADS   request threads per process; they mostly wait on SQLite
+#                 and I/O, so several per core
+#
+# Every web process has its own DB pool and its own spawn process pools
+# for password hashing (passwords.py) and image variants (images.py).
+# Unless they are set explicitly, fit_pools() sizes those for the process
+# count: one DB connection per request thread, and the cores shared out
+# between the processes, so N web workers x PASSWORD_WORKERS hashing
+# processes come to about one per core instead of N per core. Image
+# rendering is bursty and gets at most 2 per process on top.
+#
+# Read before the app is imported: db/connection.py, passwords.py and
+# images.py read their settings once.
+CPUS = os.cpu_count() or 1
+
+WEB_BIND = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", str(CPUS)))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", str(min(32, CPUS * 4))))
+
+
+def fit_pools(processes, threads=WEB_THREADS):
+    """Size the per-process pools for processes web processes, leaving explicit settings alone."""
+    # One pooled connection per request thread, plus one for the main thread
+    os.environ.setdefault("DB_POOL_SIZE", str(threads + 1))
+    cores_each = max(1, CPUS // processes)
+    os.environ.setdefault("PASSWORD_WORKERS", str(cores_each))
+    os.environ.setdefault("IMAGE_WORKERS", str(min(2, cores_each)))
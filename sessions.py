@@ -0,0 +1,235 @@
+import os
+import re
+import secrets
+import threading
+import time
+
+from flask import session
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+
+from cache import LRUCache
+from db.sessions import (
+    load_session,
+    save_session,
+    touch_session,
+    delete_session,
+    delete_expired_sessions,
+    get_session_counts,
+)
+
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+# Sessions live on the server and the cookie carries only a random id, so
+# requests no longer ship (and re-verify) the signup data, OTPs and pending
+# profile changes the views keep in the session.
+#
+#   SESSION_BACKEND=sqlite   sessions table; shared by every worker process
+#   SESSION_BACKEND=memory   per-process LRU - a single process only, and
+#                            everyone is logged out when it restarts
+#   SESSION_BACKEND=cookie   Flask's signed cookie, as before
+#
+# Sessions expire PERMANENT_SESSION_LIFETIME after they were last saved.
+# An unchanged session gets its expiry pushed forward at most once every
+# SESSION_REFRESH seconds, so ordinary page views do not write.
+#
+# SESSION_BACKEND and SESSION_MEMORY_BYTES can also be set in app.config
+# (FLASK_SESSION_BACKEND, RECIPE_SETTINGS), which wins over the variables.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_MEMORY_BYTES = int(os.environ.get("SESSION_MEMORY_BYTES", str(64 * 1024 * 1024)))
+SESSION_REFRESH = float(os.environ.get("SESSION_REFRESH", "3600"))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "300"))
+SESSION_SWEEP_BATCH = int(os.environ.get("SESSION_SWEEP_BATCH", "1000"))
+
+# secrets.token_urlsafe(32): 256 random bits, 43 characters
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{43}")
+
+# Rough per-entry overhead (key, tuple, dict slot) for the memory backend
+ENTRY_OVERHEAD = 200
+
+
+# ---------------------------------------------
+# BACKENDS
+# ---------------------------------------------
+# load(sid) -> (data, expires_at) or None, save(sid, data, expires_at),
+# touch(sid, expires_at), delete(sid), sweep() -> count, stats().
+# data is the serialized session; expires_at is Unix time.
+
+class MemoryBackend:
+    def __init__(self, max_bytes=SESSION_MEMORY_BYTES):
+        self.cache = LRUCache(max_bytes)
+
+    def load(self, sid):
+        return self.cache.get(sid)
+
+    def save(self, sid, data, expires_at):
+        self.cache.set(
+            sid, (data, expires_at), len(data) + ENTRY_OVERHEAD, ttl=max(expires_at - time.time(), 1)
+        )
+
+    def touch(self, sid, expires_at):
+        found = self.cache.get(sid)
+        if found is not None:
+            self.save(sid, found[0], expires_at)
+
+    def delete(self, sid):
+        self.cache.delete(sid)
+
+    def sweep(self):
+        return self.cache.purge_expired()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class SQLiteBackend:
+    def load(self, sid):
+        return load_session(sid)
+
+    def save(self, sid, data, expires_at):
+        save_session(sid, data, expires_at)
+
+    def touch(self, sid, expires_at):
+        touch_session(sid, expires_at)
+
+    def delete(self, sid):
+        delete_session(sid)
+
+    def sweep(self):
+        swept = total = delete_expired_sessions(SESSION_SWEEP_BATCH)
+        # A large backlog goes a batch at a time, so no one write holds the lock long
+        while swept == SESSION_SWEEP_BATCH:
+            swept = delete_expired_sessions(SESSION_SWEEP_BATCH)
+            total += swept
+        return total
+
+    def stats(self):
+        return get_session_counts()
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SQLiteBackend}
+
+
+# ---------------------------------------------
+# SESSION INTERFACE
+# ---------------------------------------------
+
+class ServerSession(SecureCookieSession):
+    """A session stored server-side under sid (None until first saved)."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.rotate = False
+
+    def regenerate(self):
+        """Move the data to a fresh id when it is saved (e.g. on login)."""
+        self.rotate = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+    session_class = ServerSession
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self.swept = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.fullmatch(sid):
+            found = self.backend.load(sid)
+            if found is not None:
+                data, expires_at = found
+                try:
+                    return self.session_class(self.serializer.loads(data), sid, expires_at)
+                except ValueError:
+                    pass  # unreadable: start over
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        partitioned = self.get_cookie_partitioned(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # Emptied (logged out): forget it on both sides
+        if not session:
+            if session.modified and session.sid is not None:
+                self.backend.delete(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure,
+                    samesite=samesite, httponly=httponly, partitioned=partitioned,
+                )
+            return
+
+        now = time.time()
+        expires_at = now + app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            if session.rotate and session.sid is not None:
+                self.backend.delete(session.sid)
+                session.sid = None
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            self.backend.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+        elif session.expires_at < expires_at - SESSION_REFRESH:
+            self.backend.touch(session.sid, expires_at)
+        else:
+            return
+        session.expires_at = expires_at
+
+        response.set_cookie(
+            name, session.sid, expires=self.get_expiration_time(app, session),
+            domain=domain, path=path, secure=secure,
+            samesite=samesite, httponly=httponly, partitioned=partitioned,
+        )
+        self.sweep_if_due()
+
+    def sweep_if_due(self):
+        """Delete expired sessions, at most once every SESSION_SWEEP_INTERVAL per process."""
+        if time.monotonic() < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = time.monotonic() + SESSION_SWEEP_INTERVAL
+            self.swept += self.backend.sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats["backend"] = type(self.backend).__name__
+        stats["swept"] = self.swept
+        return stats
+
+
+def regenerate_session():
+    """Give the current session a new id, against session fixation. No-op for cookie sessions."""
+    if isinstance(session._get_current_object(), ServerSession):
+        session.regenerate()
+
+
+def init_sessions(app):
+    """Install the SESSION_BACKEND session store; returns it (None for cookie sessions)."""
+    backend = app.config.get("SESSION_BACKEND", SESSION_BACKEND)
+    if backend == "cookie":
+        return None
+    if backend not in BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of cookie, {', '.join(BACKENDS)}")
+    if backend == "memory":
+        store = MemoryBackend(app.config.get("SESSION_MEMORY_BYTES", SESSION_MEMORY_BYTES))
+    else:
+        store = BACKENDS[backend]()
+    app.session_interface = ServerSessionInterface(store)
+    return app.session_interface
@@ -0,0 +1,54 @@
+"""
+Production entry point.
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py wsgi:app       # Linux / macOS: processes x threads
+
+    pip install waitress
+    python wsgi.py                              # anywhere: one process, many threads
+
+Module-level settings (RECIPE_DB, DB_POOL_SIZE, MAIL_*, ...) are environment
+variables read when the app is imported. Flask settings come from FLASK_*
+variables (FLASK_SECRET_KEY, FLASK_SESSION_COOKIE_SECURE=true, ...) and,
+last, from the Python file named by RECIPE_SETTINGS; app.py loads them
+before setting up sessions and images, which also take SESSION_BACKEND and
+IMAGE_* from there.
+"""
+import sys
+
+from serving import WEB_BIND, WEB_THREADS, fit_pools
+
+DEFAULT_SECRET_KEY = "supersecretkey"
+
+
+def create_app():
+    """
+    Import the app (which loads its configuration), then warm its caches. Runs once in the
+    gunicorn master (preload_app), so workers fork with the caches filled.
+    """
+    # Before the app's modules read their pool sizes (gunicorn.conf.py did
+    # it already, for its worker count); waitress serves from one process
+    fit_pools(1)
+    from app import app
+    from db.connection import release_db_connection
+    from db.db import warm_caches
+
+    if app.secret_key == DEFAULT_SECRET_KEY:
+        print("warning: using the built-in secret key - set FLASK_SECRET_KEY", file=sys.stderr)
+
+    warm_caches()
+    release_db_connection()
+    return app
+
+
+# python wsgi.py: the spawned image and password pool workers import this
+# script again as __mp_main__, and must not build (and warm) the app each
+if __name__ != "__mp_main__":
+    app = create_app()
+
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    host, _, port = WEB_BIND.rpartition(":")
+    serve(app, host=host or "0.0.0.0", port=int(port), threads=WEB_THREADS)